@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""benchmark.py: contains code of worker measuring time and memory of the training step of a model in different execution modes (eager, checkpointed, compiled)"""
+
+import os
+# Force MKL (CPU BLAS) to use one core, faster
+os.environ["OMP_NUM_THREADS"] = '1'
+
+import yaml
+import time
+import resource
+import argparse
+import multiprocessing
+from queue import Empty
+
+import torch
+
+from problems.problem_factory import ProblemFactory
+from models.model_factory import ModelFactory
+
+from utils.app_state import AppState
+from utils.param_interface import ParamInterface
+from utils.worker_utils import recurrent_config_parse
+
+# Execution modes: name -> custom model parameters.
+MODES = {
+    'eager': {},
+    'checkpoint': {'checkpoint_interval': 10},
+    'compiled': {'compile_cell': True},
+}
+
+
+def peak_memory():
+    """
+    Returns the peak memory used by the process so far (in MB) - CUDA
+    allocator peak if CUDA is used, peak resident set size otherwise.
+
+    """
+    if AppState().use_CUDA:
+        return torch.cuda.max_memory_allocated() / 2**20
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def run_mode(configs, mode_params, seq_length, num_steps, queue):
+    """
+    Builds the model and the problem, and measures forward + backward passes
+    on a single batch. Runs in a separate process, so the memory peaks of
+    different modes do not mix.
+
+    :param configs: List of configuration files.
+    :param mode_params: Custom model parameters of the mode.
+    :param seq_length: Sequence length (overwrites problem settings if > 0).
+    :param num_steps: Number of measured passes.
+    :param queue: Queue the results are put into.
+
+    """
+    param_interface = ParamInterface()
+    for config in reversed(configs):
+        with open(config, 'r') as stream:
+            param_interface.add_custom_params(yaml.safe_load(stream))
+
+    # Overwrite model and problem parameters.
+    param_interface['model'].add_custom_params(mode_params)
+    if seq_length > 0:
+        param_interface['training']['problem'].add_custom_params(
+            {'min_sequence_length': seq_length,
+             'max_sequence_length': seq_length})
+
+    AppState().set_dtype('float')
+    AppState().set_itype('int')
+
+    model = ModelFactory.build_model(param_interface['model'])
+    problem = ProblemFactory.build_problem(
+        param_interface['training']['problem'])
+    data_tuple, aux_tuple = problem.generate_batch()
+
+    # Peak memory is a high-water mark - measure the baseline before any pass.
+    memory_before = peak_memory()
+
+    # Warm-up pass.
+    model.train()
+    logits = model(data_tuple)
+    problem.evaluate_loss(data_tuple, logits, aux_tuple).backward()
+    del logits
+
+    start = time.time()
+    for _ in range(num_steps):
+        model.zero_grad()
+        logits = model(data_tuple)
+        problem.evaluate_loss(data_tuple, logits, aux_tuple).backward()
+        del logits
+    elapsed = (time.time() - start) / num_steps
+
+    steps_per_batch = data_tuple.inputs.size(-2)
+    queue.put((elapsed, elapsed / steps_per_batch,
+               peak_memory(), peak_memory() - memory_before))
+
+
+if __name__ == '__main__':
+    # Create parser with list of  runtime arguments.
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        '--config',
+        dest='config',
+        type=str,
+        default='',
+        help='Name of the configuration file(s) to be loaded (more than one file must be separated with coma ",")')
+    parser.add_argument(
+        '--modes',
+        dest='modes',
+        type=str,
+        default=','.join(MODES.keys()),
+        help='Execution modes to be compared, separated with coma (DEFAULT: all of {})'.format(
+            ', '.join(MODES.keys())))
+    parser.add_argument(
+        '--seq_length', dest='seq_length', default=-1, type=int,
+        help='Sequence length (DEFAULT: -1, i.e. taken from the problem configuration)')
+    parser.add_argument(
+        '--steps', dest='steps', default=5, type=int,
+        help='Number of measured training steps (DEFAULT: 5)')
+    parser.add_argument(
+        '--timeout', dest='timeout', default=600, type=int,
+        help='Maximal duration of the measurement of a mode, in seconds (DEFAULT: 600)')
+    parser.add_argument(
+        '--checkpoint_interval', dest='checkpoint_interval', default=10, type=int,
+        help='Interval of the stored cell states in the checkpoint mode (DEFAULT: 10)')
+
+    # Parse arguments.
+    FLAGS, unparsed = parser.parse_known_args()
+
+    # Check if config file was selected.
+    if FLAGS.config == '':
+        print('Please pass configuration file(s) as --config parameter')
+        exit(-1)
+
+    # Get list of configs that need to be loaded.
+    configs_to_load = recurrent_config_parse(FLAGS.config, [])
+
+    MODES['checkpoint']['checkpoint_interval'] = FLAGS.checkpoint_interval
+
+    # Every mode is measured in a fresh process.
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for mode in FLAGS.modes.split(','):
+        if mode not in MODES:
+            print('Error: Unknown mode {}'.format(mode))
+            exit(-2)
+        queue = context.Queue()
+        process = context.Process(target=run_mode, args=(
+            configs_to_load, MODES[mode], FLAGS.seq_length, FLAGS.steps, queue))
+        process.start()
+
+        # Wait for the results - until the process dies or the timeout.
+        deadline = time.time() + FLAGS.timeout
+        result = None
+        while result is None and time.time() < deadline:
+            try:
+                result = queue.get(timeout=1)
+            except Empty:
+                if not process.is_alive() and queue.empty():
+                    break
+
+        if result is None and process.is_alive():
+            process.terminate()
+        process.join()
+        if result is None:
+            print('Error: Mode {} failed (exit code {}), skipping it'.format(
+                mode, process.exitcode))
+            continue
+        results[mode] = result
+
+    # Print the report.
+    print('{:>12} {:>14} {:>16} {:>16} {:>18}'.format(
+        'mode', 'batch [ms]', 'step [ms]', 'peak [MB]', 'peak increase [MB]'))
+    for mode, (batch_time, step_time, peak, increase) in results.items():
+        print('{:>12} {:>14.2f} {:>16.3f} {:>16.1f} {:>18.1f}'.format(
+            mode, batch_time * 1000, step_time * 1000, peak, increase))
+    if 'eager' in results:
+        for mode, (_, step_time, _, increase) in results.items():
+            if mode != 'eager':
+                print('{}: step latency {:.2f}x of eager, peak memory saved w.r.t. eager: {:.1f} MB'.format(
+                    mode, step_time / results['eager'][1],
+                    results['eager'][3] - increase))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""compiled_cell.py: contains TorchScript (traced) execution of recurrent cells"""
+
+import logging
+
+import torch
+from torch import nn
+from torch.nn.utils.weight_norm import WeightNorm
+
+from models.sequential_model import flatten_state, unflatten_state
+
+logger = logging.getLogger('CompiledCell')
+
+
+class _TracedStep(nn.Module):
+    """
+    Wrapper of a recurrent cell operating on flat lists of tensors:
+    forward(input, *flat_state) -> (output, *flat_state).
+
+    The cell is a submodule, so the traced module shares its parameters
+    (gradients reach the parameters of the cell).
+
+    """
+
+    def __init__(self, cell, state_template):
+        super(_TracedStep, self).__init__()
+        self.cell = cell
+        self._state_template = state_template
+
+    def forward(self, input_t, *flat_state):
+        state = unflatten_state(self._state_template, flat_state)
+
+        output_t, state = self.cell(input_t, state)
+
+        # Remember the structure of the resulting state.
+        self._state_template = state
+        return (output_t,) + tuple(flatten_state(state))
+
+
+class CompiledCell(object):
+    """
+    Recurrent cell executed through a traced (TorchScript) step function.
+
+    Follows the same ``output_t, state = cell(input_t, state)`` protocol as
+    the original cell. Traced step functions are cached in memory, keyed by
+    the mode of the cell and the shapes, types and devices of input and
+    state. Cells that cannot be traced (e.g. returning no output) are run
+    eagerly.
+
+    """
+
+    def __init__(self, cell, check_trace=False):
+        """
+        Initializes the compiled cell.
+
+        :param cell: Recurrent cell (nn.Module).
+        :param check_trace: Re-run every traced step on the same inputs and check that the graphs and outputs match, e.g. to detect data-dependent control flow (DEFAULT: False).
+
+        """
+        self.cell = cell
+        self.check_trace = check_trace
+
+        # Traced step functions: key -> (ScriptModule, state template), or
+        # None if the cell could not be traced.
+        self._traced = {}
+
+    @staticmethod
+    def is_supported(cell):
+        """
+        Checks whether the cell can be compiled, i.e. it is a module without
+        hooks. Weight normalization pre-hooks are allowed, as recomputation
+        of the weights is recorded in the trace.
+
+        :param cell: Recurrent cell.
+        :return: True if the compiled execution can be used.
+
+        """
+        if not isinstance(cell, nn.Module):
+            return False
+        for module in cell.modules():
+            pre_hooks = [hook for hook in module._forward_pre_hooks.values()
+                         if not isinstance(hook, WeightNorm)]
+            if module._forward_hooks or pre_hooks or module._backward_hooks:
+                return False
+        return True
+
+    def _key(self, input_t, flat_state):
+        """
+        Returns the cache key: mode of the cell, shapes, types and devices of
+        input and state.
+
+        """
+        return (self.cell.training, tuple(input_t.shape), input_t.dtype, input_t.device) + \
+            tuple((tuple(tensor.shape), tensor.dtype, tensor.device, tensor.requires_grad)
+                  for tensor in flat_state)
+
+    def _get_traced(self, input_t, cell_state, flat_state):
+        """
+        Returns the traced step function for given shapes - from memory or by
+        tracing the cell.
+
+        """
+        key = self._key(input_t, flat_state)
+        if key not in self._traced:
+            step = _TracedStep(self.cell, cell_state)
+            try:
+                traced = torch.jit.trace(
+                    step, (input_t,) + tuple(flat_state),
+                    check_trace=self.check_trace)
+                self._traced[key] = (traced, step._state_template)
+            except (RuntimeError, TypeError, torch.jit.TracingCheckError) as error:
+                logger.warning("Cannot compile {}, running it eagerly: {}".format(
+                    type(self.cell).__name__, error))
+                self._traced[key] = None
+
+        return self._traced[key]
+
+    def __call__(self, input_t, cell_state):
+        """
+        Performs a single step of the cell.
+
+        :param input_t: Input at time t [BATCH_SIZE x INPUT_SIZE]
+        :param cell_state: Cell state at time t-1.
+        :return: Tuple (output at time t, cell state at time t).
+
+        """
+        flat_state = flatten_state(cell_state)
+        traced = self._get_traced(input_t, cell_state, flat_state)
+        if traced is None:
+            return self.cell(input_t, cell_state)
+
+        traced, state_template = traced
+        results = traced(input_t, *flat_state)
+        return results[0], unflatten_state(state_template, results[1:])
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import warnings
+import torch
+from utils.param_interface import ParamInterface
+from models.model_factory import ModelFactory
+from models.sequential_model import flatten_state
+from models.compiled_cell import CompiledCell
+from models.thalnet.thalnet_cell import ThalNetCell
+# Tests for CompiledCell (run from the root directory:
+# python -m models.compiled_cell_test)
+input_size, output_size, context_size, center_size_per_module, num_modules = \
+    28, 10, 32, 16, 4
+batch_size, seq_length = 3, 5
+
+cell = ThalNetCell(input_size, output_size, context_size,
+                   center_size_per_module, num_modules)
+# ThalNet modules use weight normalization (a forward pre-hook).
+assert CompiledCell.is_supported(cell)
+compiled_cell = CompiledCell(cell)
+
+# The compiled cell must produce the same outputs and states as the eager one.
+state = cell.init_state(batch_size)
+compiled_state = state
+inputs = torch.randn(batch_size, seq_length, input_size)
+outputs, compiled_outputs = [], []
+for t in range(seq_length):
+    output, state = cell(inputs[:, t], state)
+    compiled_output, compiled_state = compiled_cell(inputs[:, t], compiled_state)
+    outputs.append(output)
+    compiled_outputs.append(compiled_output)
+    print(output)
+    print(compiled_output)
+    assert torch.allclose(output, compiled_output, atol=1e-6)
+    for (center, ctrl_state), (compiled_center, compiled_ctrl_state) in zip(
+            state, compiled_state):
+        assert torch.allclose(center, compiled_center, atol=1e-6)
+        assert torch.allclose(ctrl_state.hidden_state,
+                              compiled_ctrl_state.hidden_state, atol=1e-6)
+
+# The step was traced (and not run eagerly).
+assert len(compiled_cell._traced) > 0
+assert all(traced is not None for traced in compiled_cell._traced.values())
+
+# Gradients reach the parameters of the cell and match the eager ones.
+torch.stack(outputs).sum().backward()
+eager_grads = [param.grad for param in cell.parameters()]
+for param in cell.parameters():
+    param.grad = None
+torch.stack(compiled_outputs).sum().backward()
+for eager_grad, param in zip(eager_grads, cell.parameters()):
+    if eager_grad is None:
+        assert param.grad is None
+    else:
+        assert torch.allclose(eager_grad, param.grad, atol=1e-5)
+
+
+# Memory augmented models: the cells compiled by SequentialModel must give
+# the same outputs, final states and gradients as the eager ones. The traces
+# are checked (re-run and compared), and tracer warnings, e.g. about
+# data-dependent control flow, are turned into errors.
+data_bits, control_bits = 8, 2
+cell_names = {'ntm': 'ntm_cell', 'dnc': 'DNCCell', 'dwm': 'DWMCell'}
+models_params = {
+    'ntm': {'num_control_bits': control_bits, 'num_data_bits': data_bits,
+            'controller': {'name': 'rnn', 'hidden_state_size': 20,
+                           'num_layers': 1, 'non_linearity': 'sigmoid'},
+            'interface': {'num_read_heads': 1, 'shift_size': 3},
+            'memory': {'num_content_bits': 10, 'num_addresses': -1}},
+    'dnc': {'control_bits': control_bits, 'data_bits': data_bits,
+            'hidden_state_dim': 20, 'memory_content_size': 10,
+            'memory_addresses_size': -1, 'num_writes': 1, 'num_reads': 1,
+            'shift_size': 3, 'controller_type': 'lstm',
+            'use_ntm_write': False, 'use_ntm_read': False,
+            'use_ntm_order': False, 'use_extra_write_gate': False,
+            'non_linearity': 'sigmoid'},
+    'dwm': {'control_bits': control_bits, 'data_bits': data_bits,
+            'hidden_state_dim': 5, 'memory_content_size': 10,
+            'memory_addresses_size': -1, 'num_heads': 1,
+            'use_content_addressing': False, 'shift_size': 3}}
+
+inputs = torch.randn(batch_size, seq_length, control_bits + data_bits)
+for name, model_params in models_params.items():
+    # Separate subtree of the (singleton) parameter registry for every model.
+    params = ParamInterface(name)
+    params.add_default_params(dict(model_params, name=name))
+    model = ModelFactory.build_model(params)
+    cell_state = model.init_cell_state(inputs)
+
+    model.compile_cell = False
+    outputs, state = model.forward_window(inputs, cell_state)
+    outputs.sum().backward()
+    eager_grads = [param.grad for param in model.parameters()]
+    model.zero_grad()
+
+    model.compile_cell = True
+    cell = getattr(model, cell_names[name])
+    compiled_cell = model._get_compiled_cell(cell)
+    assert isinstance(compiled_cell, CompiledCell), name
+    compiled_cell.check_trace = True
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', torch.jit.TracerWarning)
+        compiled_outputs, compiled_state = model.forward_window(inputs, cell_state)
+    print(name, outputs[0, -1])
+    print(name, compiled_outputs[0, -1])
+
+    # The step was traced (and not run eagerly).
+    assert len(compiled_cell._traced) > 0, name
+    assert all(traced is not None for traced in compiled_cell._traced.values()), name
+
+    assert torch.allclose(outputs, compiled_outputs, atol=1e-5), name
+    for tensor, compiled_tensor in zip(flatten_state(state), flatten_state(compiled_state)):
+        assert torch.allclose(tensor, compiled_tensor, atol=1e-5), name
+
+    compiled_outputs.sum().backward()
+    for eager_grad, param in zip(eager_grads, model.parameters()):
+        if eager_grad is None:
+            assert param.grad is None, name
+        else:
+            assert torch.allclose(eager_grad, param.grad, atol=1e-4), name
@@ -7,7 +7,7 @@ from .memory_usage import MemoryUsage
 from .param_gen import Param_Generator
 from .plot_data import plot_memory_attention, plot_memory
 from .temporal_linkage import TemporalLinkageState, TemporalLinkage
-from .tensor_utils import normalize, sim, outer_prod, circular_conv
+from .tensor_utils import normalize, sim, outer_prod, erase_add, circular_conv
 
 __all__ = [
     'ControlParams',
@@ -25,4 +25,5 @@ __all__ = [
     'normalize',
     'sim',
     'outer_prod',
+    'erase_add',
     'circular_conv']
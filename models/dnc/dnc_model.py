@@ -19,7 +19,6 @@
 __author__ = " Ryan L. McAvoy"
 
 import numpy as np
-import torch
 
 import logging
 from models.sequential_model import SequentialModel
@@ -66,13 +65,21 @@ class DNC(SequentialModel):
 
         (inputs, targets) = data_tuple
 
-        dtype = self.app_state.dtype
+        # init state
+        cell_state = self.init_cell_state(inputs)
+
+        output, _ = self.forward_window(inputs, cell_state)
 
-        output = None
+        return output
+
+    def init_cell_state(self, inputs):
+        """
+        Returns the initial cell state for the given input sequences.
 
-        if self.app_state.visualize:
-            self.cell_state_history = []
+        :param inputs: input sequences [batch_size, seq_len, input_size]
+        :returns: Initial DNC cell state.
 
+        """
         batch_size = inputs.size(0)
         seq_length = inputs.size(1)
 
@@ -83,36 +90,36 @@ class DNC(SequentialModel):
         if memory_addresses_size == -1:
             memory_addresses_size = seq_length
 
-        # init state
-        cell_state = self.DNCCell.init_state(memory_addresses_size, batch_size)
-
-        #cell_state = self.init_state(memory_addresses_size)
-        for j in range(seq_length):
-            output_cell, cell_state = self.DNCCell(
-                inputs[..., j, :], cell_state)
-
-            if output_cell is None:
-                continue
-
-            output_cell = output_cell[..., None, :]
-            if output is None:
-                output = output_cell
-            else:
-                output = torch.cat([output, output_cell], dim=-2)
-
-            # This is for the time plot
-            if self.app_state.visualize:
-                self.cell_state_history.append(
-                    (cell_state.memory_state.detach().cpu().numpy(),
-                     cell_state.int_init_state.usage.detach().cpu().numpy(),
-                     cell_state.int_init_state.links.precedence_weights.detach().cpu().numpy(),
-                     cell_state.int_init_state.read_weights.detach().cpu().numpy(),
-                     cell_state.int_init_state.write_weights.detach().cpu().numpy()))
-
-            # if self.plot_active:
-            #    self.plot_memory_attention(output, cell_state)
+        return self.DNCCell.init_state(memory_addresses_size, batch_size)
 
-        return output
+    def forward_window(self, inputs, cell_state):
+        """
+        Runs the DNC cell over (a window of) the input sequences.
+
+        :param inputs: input sequences [batch_size, window_len, input_size]
+        :param cell_state: DNC cell state at the beginning of the window.
+        :returns: Tuple (output [batch_size, window_len, output_size], cell state at the end of the window).
+
+        """
+        return self.recurrent_forward(
+            self.DNCCell, inputs, cell_state,
+            record_state=self.record_cell_state)
+
+    @staticmethod
+    def record_cell_state(cell_state):
+        """
+        Converts the cell state into an entry of the cell state history (for
+        the time plot).
+
+        :param cell_state: DNC cell state.
+        :returns: Tuple of numpy arrays (memory, usage, precedence weights, read weights, write weights).
+
+        """
+        return (cell_state.memory_state.detach().cpu().numpy(),
+                cell_state.int_init_state.usage.detach().cpu().numpy(),
+                cell_state.int_init_state.links.precedence_weights.detach().cpu().numpy(),
+                cell_state.int_init_state.read_weights.detach().cpu().numpy(),
+                cell_state.int_init_state.write_weights.detach().cpu().numpy())
 
     def plot_memory_attention(self, data_tuple, predictions, sample_number=0):
         """
@@ -62,7 +62,9 @@ class Interface:
         self.use_ntm_order = params['use_ntm_order']
         self.use_extra_write_gate = params['use_extra_write_gate']
 
-        self.mem_usage = MemoryUsage()
+        # Number of least used slots considered by the allocation (-1: all).
+        self.mem_usage = MemoryUsage(
+            top_k=params.get('allocation_top_k', -1))
 
         self.temporal_linkage = TemporalLinkage(self._num_writes)
 
@@ -117,8 +119,7 @@ class Interface:
 
         memory = Memory(mem)
 
-        memory.erase_weighted(erase, write_attention)
-        memory.add_weighted(add, write_attention)
+        memory.erase_add_weighted(erase, add, write_attention)
 
         mem = memory.content
 
@@ -49,16 +49,22 @@ class MemoryUsage(object):
 
     The function `write_allocation_weights` can be invoked to get free locations to write to for a number of write heads.
 
+    When `top_k` is positive, the allocation only ranks the `top_k` least used slots (`torch.topk` instead of a full
+    sort), all other slots get zero allocation weight. This is equivalent to the full sort when `top_k` covers the
+    whole memory.
+
     """
 
-    def __init__(self, name='MemoryUsage'):
+    def __init__(self, name='MemoryUsage', top_k=-1):
         """
         Creates a MemoryUsages module.
 
         :param name: Name of the module.
+        :param top_k: Number of least used slots considered by the allocation (DEFAULT: -1, i.e. all slots).
 
         """
         super(MemoryUsage, self).__init__()
+        self.top_k = top_k
 
     def init_state(self, memory_address_size, batch_size):
         """
@@ -122,9 +128,16 @@ class MemoryUsage(object):
 
         """
 
+        # Use the full sort if all slots are to be considered anyway.
+        use_topk = 0 < self.top_k < usage.shape[-1]
+
         allocation_weights = []
         for i in range(num_writes):
-            allocation_weights.append(self._allocation(usage))
+            if use_topk:
+                allocation_weights.append(
+                    self._allocation_topk(usage, self.top_k))
+            else:
+                allocation_weights.append(self._allocation(usage))
             # update usage to take into account writing to this new allocation
             usage = usage + \
                 ((1 - usage) * write_gates[:, i, :] * allocation_weights[i])
@@ -202,6 +215,36 @@ class MemoryUsage(object):
 
         return unsorted_all
 
+    def _allocation_topk(self, usage, k):
+        r"""Computes allocation by selecting the `k` least used slots.
+        Same as `_allocation`, but the (exclusive) cumulative product is computed
+        over the `k` smallest usages only; the allocation of the remaining slots
+        is negligibly small anyway and is set to zero.
+        Args:
+          :param usage: tensor of shape `[batch_size, memory_size]` indicating current
+              memory usage.
+          :param k: Number of least used slots considered.
+        Returns:
+          :returns: Tensor of shape `[batch_size, memory_size]` corresponding to allocation.
+        """
+        # Ensure values are not too small prior to cumprod.
+        usage = _EPSILON + (1 - _EPSILON) * usage
+
+        # k smallest usages, in ascending order.
+        sorted_usage, indices = torch.topk(
+            usage, k, dim=1, largest=False, sorted=True)
+        sorted_nonusage = 1 - sorted_usage
+
+        # Exclusive cumulative product over the k selected slots only.
+        prod_sorted_usage = self.exclusive_cumprod_temp(sorted_usage)
+        sorted_allocation = sorted_nonusage * prod_sorted_usage
+
+        # Scatter back to the original indexing, unselected slots get zero.
+        unsorted_all = torch.zeros_like(usage)
+        unsorted_all.scatter_(1, indices, sorted_allocation)
+
+        return unsorted_all
+
     def exclusive_cumprod_temp(self, sorted_usage, dim=1):
         """
         Applies the exclusive cumultative product (at the moment it assumes the
@@ -16,6 +16,7 @@
 # limitations under the License.
 
 
+import torch
 from memory_usage import MemoryUsage
 # Tests for MemoryUsage
 leng = 10
@@ -34,3 +35,22 @@ print(usage)
 cumprod = mem_use.exclusive_cumprod_temp(usage)
 print(cumprod.shape)
 print(cumprod)
+
+# Tests for top-k allocation: with k equal to the memory size it must give
+# the same allocation as the full sort.
+usage = torch.rand(3, leng)
+alloc = mem_use._allocation(usage)
+alloc_topk = mem_use._allocation_topk(usage, leng)
+print(alloc)
+print(alloc_topk)
+assert torch.allclose(alloc, alloc_topk)
+
+# With k < memory size only the k least used slots get allocation weight.
+k = 4
+alloc_topk = mem_use._allocation_topk(usage, k)
+print(alloc_topk)
+assert ((alloc_topk > 0).sum(dim=1) <= k).all()
+_, least_used = torch.topk(usage, k, dim=1, largest=False)
+assert torch.allclose(alloc_topk.gather(1, least_used),
+                      alloc.gather(1, least_used))
+
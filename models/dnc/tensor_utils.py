@@ -85,6 +85,87 @@ def outer_prod(x, y):
     return x[..., :, None] * y[..., None, :]
 
 
+class FusedEraseAdd(torch.autograd.Function):
+    """
+    Fused multi-head erase/add memory write. Computes
+
+        mem_new = mem * prod_{head h} (1 - erase(h) x wt(h)) + sum_{head h} add(h) x wt(h)
+
+    without materializing the [batch_size, num_heads, memory_content_size,
+    memory_addresses_size] outer products. Only the inputs are saved for
+    backward, the per-head erase factors are recomputed there.
+
+    """
+
+    @staticmethod
+    def forward(ctx, mem, erase, add, wt):
+        """
+        :param mem: the memory [batch_size, memory_content_size, memory_addresses_size]
+        :param erase: data to be erased from memory [batch_size, num_heads, memory_content_size]
+        :param add: the data to be added to memory [batch_size, num_heads, memory_content_size]
+        :param wt: head's weights [batch_size, num_heads, memory_addresses_size]
+        :return: the updated memory [batch_size, memory_content_size, memory_addresses_size]
+
+        """
+        ctx.save_for_backward(mem, erase, add, wt)
+
+        # Multiplicative erase - one [batch, content, addresses] factor at a time.
+        out = mem
+        for h in range(wt.size(-2)):
+            out = out * (1 - erase[..., h, :, None] * wt[..., h, None, :])
+
+        # Additive update: sum over heads as a single batched matmul.
+        return out + torch.matmul(add.transpose(-1, -2), wt)
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        mem, erase, add, wt = ctx.saved_tensors
+        num_heads = wt.size(-2)
+
+        def factor(h):
+            # Erase factor of head h [batch_size, memory_content_size, memory_addresses_size]
+            return 1 - erase[..., h, :, None] * wt[..., h, None, :]
+
+        # Gradients of the multiplicative part - products over the "other"
+        # heads are recomputed instead of divided out, so erase == 1 is safe.
+        grad_mem_out = grad_out * mem
+        grad_erase = []
+        grad_wt = []
+        prod_all = 1
+        for h in range(num_heads):
+            others = grad_mem_out
+            for k in range(num_heads):
+                if k != h:
+                    others = others * factor(k)
+            grad_erase.append(-torch.matmul(others, wt[..., h, :, None])[..., 0])
+            grad_wt.append(-torch.matmul(erase[..., h, None, :], others)[..., 0, :])
+            prod_all = prod_all * factor(h)
+
+        grad_mem = grad_out * prod_all
+        grad_erase = torch.stack(grad_erase, dim=-2)
+
+        # Gradients of the additive part.
+        grad_add = torch.matmul(wt, grad_out.transpose(-1, -2))
+        grad_wt = torch.stack(grad_wt, dim=-2) + torch.matmul(add, grad_out)
+
+        return grad_mem, grad_erase, grad_add, grad_wt
+
+
+def erase_add(mem, erase, add, wt):
+    """
+    Erases from and adds to memory in a single fused step (see
+    FusedEraseAdd).
+
+    :param mem: the memory [batch_size, memory_content_size, memory_addresses_size]
+    :param erase: data to be erased from memory [batch_size, num_heads, memory_content_size]
+    :param add: the data to be added to memory [batch_size, num_heads, memory_content_size]
+    :param wt: head's weights [batch_size, num_heads, memory_addresses_size]
+    :return: the updated memory [batch_size, memory_content_size, memory_addresses_size]
+
+    """
+    return FusedEraseAdd.apply(mem, erase, add, wt)
+
+
 def circular_conv(x, f):
     """
     Batch 1D circular convolution with matching hidden shapes.
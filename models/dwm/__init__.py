@@ -3,7 +3,7 @@ from .dwm_cell import DWMCellStateTuple, DWMCell
 from .dwm_model import DWM
 from .interface import InterfaceStateTuple, Interface
 from .memory import Memory
-from .tensor_utils import normalize, sim, outer_prod, circular_conv
+from .tensor_utils import normalize, sim, outer_prod, erase_add, circular_conv
 
 __all__ = [
     'Controller',
@@ -16,4 +16,5 @@ __all__ = [
     'normalize',
     'sim',
     'outer_prod',
+    'erase_add',
     'circular_conv']
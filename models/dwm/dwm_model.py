@@ -99,14 +99,22 @@ class DWM(SequentialModel):
         # Unpack tuple.
         (inputs, targets) = data_tuple
 
-        if self.app_state.visualize:
-            self.cell_state_history = []
+        # Init state
+        cell_state = self.init_cell_state(inputs)
 
-        output = None
-        # TODO
-        if len(inputs.size()) == 4:
-            inputs = inputs[:, 0, :, :]
+        # loop over the different sequences
+        output, _ = self.forward_window(inputs, cell_state)
+
+        return output
+
+    def init_cell_state(self, inputs):
+        """
+        Returns the initial cell state for the given input sequences.
 
+        :param inputs: tensor containing the data sequences of the batch [batch, sequence_length, input_size]
+        :returns: Initial DWM cell state.
+
+        """
         batch_size = inputs.size(0)
         seq_length = inputs.size(-2)
 
@@ -122,33 +130,38 @@ class DWM(SequentialModel):
         else:
             memory_addresses_size = self.memory_addresses_size
 
-        # Init state
-        cell_state = self.DWMCell.init_state(memory_addresses_size, batch_size)
+        return self.DWMCell.init_state(memory_addresses_size, batch_size)
 
-        # loop over the different sequences
-        for j in range(seq_length):
-            output_cell, cell_state = self.DWMCell(
-                inputs[..., j, :], cell_state)
+    def forward_window(self, inputs, cell_state):
+        """
+        Runs the DWM cell over (a window of) the input sequences.
+
+        :param inputs: tensor containing the data sequences of the batch [batch, window_length, input_size]
+        :param cell_state: DWM cell state at the beginning of the window.
+        :returns: Tuple (output [batch, window_length, output_size], cell state at the end of the window).
 
-            if output_cell is None:
-                continue
+        """
+        # TODO
+        if len(inputs.size()) == 4:
+            inputs = inputs[:, 0, :, :]
 
-            output_cell = output_cell[..., None, :]
-            if output is None:
-                output = output_cell
+        return self.recurrent_forward(
+            self.DWMCell, inputs, cell_state,
+            record_state=self.record_cell_state)
 
-            # Concatenate output
-            else:
-                output = torch.cat([output, output_cell], dim=-2)
+    @staticmethod
+    def record_cell_state(cell_state):
+        """
+        Converts the cell state into an entry of the cell state history (for
+        the time plot).
 
-            # This is for the time plot
-            if self.app_state.visualize:
-                self.cell_state_history.append(
-                    (cell_state.memory_state.detach().numpy(),
-                     cell_state.interface_state.head_weight.detach().numpy(),
-                     cell_state.interface_state.snapshot_weight.detach().numpy()))
+        :param cell_state: DWM cell state.
+        :returns: Tuple of numpy arrays (memory, head weights, snapshot weights).
 
-        return output
+        """
+        return (cell_state.memory_state.detach().numpy(),
+                cell_state.interface_state.head_weight.detach().numpy(),
+                cell_state.interface_state.snapshot_weight.detach().numpy())
 
     # Method to change memory size
     def set_memory_size(self, mem_size):
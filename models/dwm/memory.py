@@ -19,7 +19,7 @@
 __author__ = "Younes Bouhadjar"
 
 import torch
-from models.dwm.tensor_utils import sim, outer_prod
+from models.dwm.tensor_utils import sim, erase_add
 
 
 class Memory:
@@ -56,7 +56,8 @@ class Memory:
         """
 
         # memory = memory + sum_{head h} weighted add(h)
-        self._memory = self._memory + torch.sum(outer_prod(add, wt), dim=-3)
+        self._memory = self._memory + \
+            torch.matmul(add.transpose(-1, -2), wt)
 
     def erase_weighted(self, erase, wt):
         """
@@ -70,8 +71,24 @@ class Memory:
         """
 
         # memory = memory * product_{head h} (1 - weighted erase(h))
-        self._memory = self._memory * \
-            torch.prod(1 - outer_prod(erase, wt), dim=-3)
+        for h in range(wt.size(-2)):
+            self._memory = self._memory * \
+                (1 - erase[..., h, :, None] * wt[..., h, None, :])
+
+    def erase_add_weighted(self, erase, add, wt):
+        """
+        Erases elements from memory and then writes data to it, using the
+        fused write (no per-head outer products are kept for backward).
+
+        :param wt: head's weights [batch_size, num_heads, memory_addresses_size]
+        :param erase: data to be erased from memory [batch_size, num_heads, memory_content_size]
+        :param add: the data to be added to memory [batch_size, num_heads, memory_content_size]
+
+        :return the updated memory [batch_size, memory_addresses_size, memory_content_size]
+
+        """
+
+        self._memory = erase_add(self._memory, erase, add, wt)
 
     def content_similarity(self, k):
         """
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import torch
+from models.dwm.tensor_utils import FusedEraseAdd, erase_add, outer_prod
+# Tests for the fused erase/add memory write (run from the root directory:
+# python -m models.dwm.tensor_utils_test)
+batch_size, num_heads, content_size, addresses_size = 2, 3, 4, 5
+
+
+def unfused_erase_add(mem, erase, add, wt):
+    # Reference: materialized [batch_size, num_heads, content, addresses]
+    # outer products.
+    erase_factors = 1 - outer_prod(erase, wt)
+    for h in range(num_heads):
+        mem = mem * erase_factors[:, h]
+    return mem + outer_prod(add, wt).sum(dim=1)
+
+
+torch.manual_seed(0)
+inputs = [torch.randn(batch_size, content_size, addresses_size, dtype=torch.double),
+          torch.rand(batch_size, num_heads, content_size, dtype=torch.double),
+          torch.randn(batch_size, num_heads, content_size, dtype=torch.double),
+          torch.softmax(torch.randn(batch_size, num_heads, addresses_size, dtype=torch.double), dim=-1)]
+# erase == 1 (full erase) is handled without division.
+inputs[1][0, 0, 0] = 1
+inputs = [tensor.requires_grad_() for tensor in inputs]
+
+# Same forward as the reference.
+out = erase_add(*inputs)
+reference = unfused_erase_add(*inputs)
+assert torch.allclose(out, reference)
+
+# Same gradients as the (autograd) reference.
+grad_out = torch.randn_like(out)
+grads = torch.autograd.grad(out, inputs, grad_out)
+reference_grads = torch.autograd.grad(reference, inputs, grad_out)
+for grad, reference_grad in zip(grads, reference_grads):
+    print(grad.shape, (grad - reference_grad).abs().max().item())
+    assert torch.allclose(grad, reference_grad)
+
+# Backward matches the numerical gradients (double precision).
+assert torch.autograd.gradcheck(FusedEraseAdd.apply, inputs)
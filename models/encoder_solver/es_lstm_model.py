@@ -19,9 +19,11 @@
 __author__ = "Tomasz Kornuta"
 
 from enum import Enum
+import itertools
 import torch
 from torch import nn
 from models.sequential_model import SequentialModel
+from models.fused_lstm import FusedLSTM
 
 
 class EncoderSolverLSTM(SequentialModel):
@@ -69,6 +71,14 @@ class EncoderSolverLSTM(SequentialModel):
 
         self.modes = Enum('Modes', ['Encode', 'Solve'])
 
+        # Fast path: subsequences processed by the encoder/solver in single
+        # fused calls.
+        use_fused = params.get('fused_lstm', True) and \
+            FusedLSTM.is_supported([self.encoder]) and \
+            FusedLSTM.is_supported([self.solver])
+        self.fused_encoder = FusedLSTM([self.encoder]) if use_fused else None
+        self.fused_solver = FusedLSTM([self.solver]) if use_fused else None
+
     def init_state(self, batch_size):
         """
         Returns 'zero' (initial) state.
@@ -108,33 +118,54 @@ class EncoderSolverLSTM(SequentialModel):
         # Initialize state variables.
         (h, c) = self.init_state(batch_size)
 
-        # Logits container.
-        logits = []
-
-        for x in inputs.chunk(inputs.size(1), dim=1):
-            # Squeeze x.
-            x = x.squeeze(1)
+        # Control bits (of the first sample) of all steps - moved to host
+        # once per batch.
+        control = inputs[0, :, [self.encoding_bit, self.solving_bit]].tolist()
 
+        # Mode of every step.
+        modes = []
+        mode = None
+        for (encoding, solving) in control:
             # switch between the encoder and decoder modes. It will stay in
             # this mode till it hits the opposite kind of marker
-            if x[0, self.solving_bit] and not x[0, self.encoding_bit]:
+            if solving and not encoding:
                 mode = self.modes.Solve
-            elif x[0, self.encoding_bit] and not x[0, self.solving_bit]:
+            elif encoding and not solving:
                 mode = self.modes.Encode
-            elif x[0, self.encoding_bit] and x[0, self.solving_bit]:
+            elif encoding and solving:
                 print('Error: both encoding and decoding bit were true')
                 exit(-1)
+            modes += [mode]
+
+        # Use the fused LSTM - unless the cells are run step by step for
+        # visualization.
+        use_fused = self.fused_encoder is not None and not self.app_state.visualize
+
+        # Logits container.
+        logits = []
 
-            if mode == self.modes.Solve:
-                h, c = self.solver(x, (h, c))
-            elif mode == self.modes.Encode:
-                h, c = self.encoder(x, (h, c))
+        # Process the subsequences of steps in the same mode.
+        start = 0
+        for mode, steps in itertools.groupby(modes):
+            stop = start + len(list(steps))
+
+            if use_fused:
+                fused = self.fused_solver if mode == self.modes.Solve else self.fused_encoder
+                hs, (h, c) = fused(inputs[:, start:stop], (h.unsqueeze(0), c.unsqueeze(0)))
+                (h, c) = (h[0], c[0])
+            else:
+                cell = self.solver if mode == self.modes.Solve else self.encoder
+                hs = []
+                for x in inputs[:, start:stop].chunk(stop - start, dim=1):
+                    h, c = cell(x.squeeze(1), (h, c))
+                    hs += [h]
+                hs = torch.stack(hs, 1)
 
             # Collect logits - whatever happens :] (BUT THIS CAN BE EASILY
             # SOLVED - COLLECT LOGITS ONLY IN DECODER!!)
-            logit = self.output(h)
-            logits += [logit]
+            logits += [self.output(hs)]
+            start = stop
 
-        # Stack logits along the temporal (sequence) axis.
-        logits = torch.stack(logits, 1)
+        # Concatenate logits along the temporal (sequence) axis.
+        logits = torch.cat(logits, 1)
         return logits
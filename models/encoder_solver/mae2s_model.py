@@ -18,26 +18,25 @@
 """maes_module.py: File containing Memory Augmented Encoder-Dual-Solver model class."""
 __author__ = "Tomasz Kornuta"
 
-from enum import Enum
 import torch
 import logging
 logger = logging.getLogger('MAE2S-Model')
 
 from problems.problem import DataTuple
-from models.sequential_model import SequentialModel
-from models.encoder_solver.mae_cell import MAECell
+from models.sequential_model import blend_state
 from models.encoder_solver.mas_cell import MASCell
+from models.encoder_solver.maes_model import MAES
 
 
-class MAE2S(SequentialModel):
+class MAE2S(MAES):
     """
     Class implementing the Memory Augmented Encoder-Dual-Solver (MAE2S) model.
 
     The model is variation of MAES, but with two solvers - for dual-task training of the encoder.
 
-    Warning: Class assumes, that the whole batch has the same length, i.e. batch of subsequences
-    becoming input to encoder is of the same length (ends at the same item).
-    The same goes to subsequences being input to decoder.
+    The encode/solve mode is switched per sample, i.e. samples in a batch
+    can have subsequences of different lengths. Encoder and both solvers run
+    in lockstep and their states are blended with the per-sample mode masks.
 
     """
 
@@ -49,37 +48,22 @@ class MAE2S(SequentialModel):
         :param params: Dictionary of parameters.
 
         """
-        # Call base constructor.
+        # Call base constructor (creates the encoder and both solvers).
         super(MAE2S, self).__init__(params)
+        # Model name.
+        self.name = 'MAE2S'
 
-        # Parse parameters.
-        # Indices of control bits triggering encoding/decoding.
-        self.encoding_bit = params.get('encoding_bit', 0)  # Def: 0
+    def create_solvers(self, params):
+        """
+        Creates the two solver cells, triggered by the solving1/solving2
+        control bits.
+
+        :param params: Dictionary of parameters.
+
+        """
+        # Indices of control bits triggering decoding.
         self.solving1_bit = params.get('solving1_bit', 1)  # Def: 1
         self.solving2_bit = params.get('solving2_bit', 2)  # Def: 2
-        # Check if we want to pass the whole cell state or only the memory.
-        self.pass_cell_state = params.get('pass_cell_state', True)
-
-        # It is stored here, but will we used ONLY ONCE - for initialization of
-        # memory called from the forward() function.
-        self.num_memory_addresses = params['memory']['num_addresses']
-        self.num_memory_content_bits = params['memory']['num_content_bits']
-
-        # Save/load encoder.
-        # params['encoder']['save'].add_default_params(False)
-        self.save_encoder = params.get('save_encoder', False)
-        # Path+filename to encoder.
-        self.load_encoder = params.get('load_encoder', '')
-        self.freeze_encoder = params.get('freeze_encoder', False)
-
-        # Create the Encoder cell.
-        self.encoder = MAECell(params)
-
-        # Load and freeze encoder - if required.
-        if self.load_encoder != '':
-            self.encoder.load(self.load_encoder)
-        if self.freeze_encoder:
-            self.encoder.freeze()
 
         # Create the Solver for first task.
         self.solver1 = MASCell(params)
@@ -87,28 +71,6 @@ class MAE2S(SequentialModel):
         # Create the Solver for the second task.
         self.solver2 = MASCell(params)
 
-        # Operation modes.
-        self.modes = Enum('Modes', ['Encode', 'Solve1', 'Solve2'])
-
-    def save(self, model_dir, stat_col):
-        """
-        Method saves the model and encoder to file.
-
-        :param model_dir: Directory where the model will be saved.
-        :param stat_col: Statistics collector that contain current loss and episode number (and other statistics).
-        :return: True if this is the best model that is found till now (considering loss).
-
-        """
-        # Call the case method to save the whole model.
-        is_best_model = super(SequentialModel, self).save(model_dir, stat_col)
-
-        # Additionally, if flag is set to True, save the encoder.
-        if self.save_encoder:
-            self.encoder.save(model_dir, stat_col,
-                              is_best_model, self.save_intermediate)
-
-        return is_best_model
-
     def forward(self, data_tuple):
         """
         Forward function accepts a tuple consisting of:
@@ -147,66 +109,65 @@ class MAE2S(SequentialModel):
         solver1_state = None  # For now, it will be set during execution.
         solver2_state = None  # For now, it will be set during execution.
 
-        # Start as encoder.
-        mode = self.modes.Encode
+        # Control bits of all samples and steps [BATCH_SIZE x LENGTH_SIZE].
+        encoding_BxS = inputs_BxSxI[:, :, self.encoding_bit] != 0
+        solving1_BxS = inputs_BxSxI[:, :, self.solving1_bit] != 0
+        solving2_BxS = inputs_BxSxI[:, :, self.solving2_bit] != 0
+        # Verify the control bits - single check for the whole batch.
+        if ((encoding_BxS & solving1_BxS) | (encoding_BxS & solving2_BxS) |
+                (solving1_BxS & solving2_BxS)).any():
+            logger.error('Two control bits were on:\n {}'.format(inputs_BxSxI))
+            exit(-1)
+
+        # Per-sample modes: all samples start as encoder.
+        encode_mode_B = torch.ones_like(encoding_BxS[:, 0])
+        solve1_mode_B = torch.zeros_like(encoding_BxS[:, 0])
+        solve2_mode_B = torch.zeros_like(encoding_BxS[:, 0])
 
         # Logits container.
         logits = []
 
-        for x in inputs_BxSxI.chunk(inputs_BxSxI.size(1), dim=1):
+        for t, x in enumerate(inputs_BxSxI.chunk(inputs_BxSxI.size(1), dim=1)):
             # Squeeze x.
             x = x.squeeze(1)
 
-            # Switch between the encoder and solver modes.
-            # But first - verify the control bits.
-            if ((x[0, self.encoding_bit] and x[0, self.solving1_bit]) or
-                (x[0, self.encoding_bit] and x[0, self.solving2_bit]) or
-                    (x[0, self.solving1_bit] and x[0, self.solving2_bit])):
-                logger.error('Two control bits were on:\n {}'.format(x))
-                exit(-1)
-
-            # Check if we are stopping the encoder.
-            if mode == self.modes.Encode and (
-                    x[0, self.solving1_bit] or x[0, self.solving2_bit]):
-                #print("initializing solver states")
-                # Initialize states of both solvers.
-                if self.pass_cell_state:
-                    # Initialize solver state with final encoder state.
-                    solver1_state = self.solver1.init_state_with_encoder_state(
-                        encoder_state)
-                    solver2_state = self.solver2.init_state_with_encoder_state(
-                        encoder_state)
-                else:
-                    # Initialize solver state - with final state of memory and
-                    # final attention only.
-                    solver1_state = self.solver1.init_state(
-                        encoder_state.memory_state, encoder_state.interface_state.attention)
-                    solver2_state = self.solver2.init_state(
-                        encoder_state.memory_state, encoder_state.interface_state.attention)
-
-            # Now check which
-            if x[0, self.solving1_bit]:
-                #print("switching to solver1")
-                mode = self.modes.Solve1
-
-            elif x[0, self.solving2_bit]:
-                #print("switching to solver2")
-                mode = self.modes.Solve2
-
-            # Run encoder or solver - depending on the state.
-            if mode == self.modes.Encode:
-                logit, encoder_state = self.encoder(x, encoder_state)
-                # print("encoder")
-            elif mode == self.modes.Solve1:
-                logit, solver1_state = self.solver1(x, solver1_state)
-                # print("solver1")
-            elif mode == self.modes.Solve2:
-                # print("solver2")
-                logit, solver2_state = self.solver2(x, solver2_state)
-
-            # Collect logits from both encoder and solver - they will be masked
+            # States of both solvers of samples that are still encoding are
+            # initialized with the current (i.e. final) encoder state.
+            init_solver1_state = self.init_solver_state(self.solver1, encoder_state)
+            init_solver2_state = self.init_solver_state(self.solver2, encoder_state)
+            if solver1_state is None:
+                solver1_state = init_solver1_state
+                solver2_state = init_solver2_state
+            else:
+                solver1_state = blend_state(
+                    encode_mode_B, init_solver1_state, solver1_state)
+                solver2_state = blend_state(
+                    encode_mode_B, init_solver2_state, solver2_state)
+
+            # Switch (per sample) between the encoder and solver modes.
+            solving1_B = solving1_BxS[:, t]
+            solving2_B = solving2_BxS[:, t]
+            encode_mode_B = encode_mode_B & ~(solving1_B | solving2_B)
+            solve1_mode_B = (solve1_mode_B & ~solving2_B) | solving1_B
+            solve2_mode_B = (solve2_mode_B & ~solving1_B) | solving2_B
+
+            # Run encoder and both solvers in lockstep.
+            encoder_logit, new_encoder_state = self.encoder(x, encoder_state)
+            solver1_logit, new_solver1_state = self.solver1(x, solver1_state)
+            solver2_logit, new_solver2_state = self.solver2(x, solver2_state)
+
+            # States are updated only for the samples in the given mode.
+            encoder_state = blend_state(
+                encode_mode_B, new_encoder_state, encoder_state)
+            solver1_state = blend_state(
+                solve1_mode_B, new_solver1_state, solver1_state)
+            solver2_state = blend_state(
+                solve2_mode_B, new_solver2_state, solver2_state)
+
+            # Collect logits from both encoder and solvers - they will be masked
             # afterwards.
-            logits += [logit]
+            logit = blend_state(encode_mode_B, encoder_logit, solver2_logit)
+            logits += [blend_state(solve1_mode_B, solver1_logit, logit)]
 
         # Stack logits along the temporal (sequence) axis.
         logits = torch.stack(logits, 1)
@@ -18,13 +18,12 @@
 """maes_module.py: File containing Memory Augmented Encoder-Solver model class."""
 __author__ = "Tomasz Kornuta"
 
-from enum import Enum
 import torch
 import logging
 logger = logging.getLogger('MAES-Model')
 
 from problems.problem import DataTuple
-from models.sequential_model import SequentialModel
+from models.sequential_model import SequentialModel, blend_state
 
 from models.encoder_solver.mae_cell import MAECell
 from models.encoder_solver.mas_cell import MASCell
@@ -34,9 +33,9 @@ class MAES(SequentialModel):
     """
     Class implementing the Memory Augmented Encoder-Solver (MAES) model.
 
-    Warning: Class assumes, that the whole batch has the same length, i.e. batch of subsequences
-    becoming input to encoder is of the same length (ends at the same item).
-    The same goes to subsequences being input to decoder.
+    The encode/solve mode is switched per sample, i.e. samples in a batch
+    can have subsequences of different lengths. Encoder and solver run in
+    lockstep and their states are blended with the per-sample mode mask.
 
     """
 
@@ -54,9 +53,8 @@ class MAES(SequentialModel):
         self.name = 'MAES'
 
         # Parse parameters.
-        # Indices of control bits triggering encoding/decoding.
-        self.encoding_bit = params['encoding_bit']  # Def: 0
-        self.solving_bit = params['solving_bit']  # Def: 1
+        # Index of control bit triggering encoding.
+        self.encoding_bit = params.get('encoding_bit', 0)  # Def: 0
         # Check if we want to pass the whole cell state or only the memory.
         self.pass_cell_state = params.get('pass_cell_state', True)
 
@@ -81,12 +79,22 @@ class MAES(SequentialModel):
         if self.freeze_encoder:
             self.encoder.freeze()
 
+        # Create the Decoder/Solver(s).
+        self.create_solvers(params)
+
+    def create_solvers(self, params):
+        """
+        Creates the solver cell, triggered by the solving control bit.
+
+        :param params: Dictionary of parameters.
+
+        """
+        # Index of control bit triggering decoding.
+        self.solving_bit = params['solving_bit']  # Def: 1
+
         # Create the Decoder/Solver.
         self.solver = MASCell(params)
 
-        # Operation modes.
-        self.modes = Enum('Modes', ['Encode', 'Solve'])
-
     def save(self, model_dir, stat_col):
         """
         Method saves the model and encoder to file.
@@ -106,6 +114,23 @@ class MAES(SequentialModel):
 
         return is_best_model
 
+    def init_solver_state(self, solver, encoder_state):
+        """
+        Initializes the solver state on the basis of the (final) encoder state.
+
+        :param solver: Solver cell (MASCell).
+        :param encoder_state: Encoder state (MAECellStateTuple).
+        :returns: Initial solver state (MASCellStateTuple).
+
+        """
+        if self.pass_cell_state:
+            # Initialize solver state with final encoder state.
+            return solver.init_state_with_encoder_state(encoder_state)
+        # Initialize solver state - with final state of memory and
+        # final attention only.
+        return solver.init_state(
+            encoder_state.memory_state, encoder_state.interface_state.attention)
+
     def forward(self, data_tuple):
         """
         Forward function accepts a tuple consisting of:
@@ -143,42 +168,47 @@ class MAES(SequentialModel):
         encoder_state = self.encoder.init_state(init_memory_BxAxC)
         solver_state = None  # For now, it will be set during execution.
 
-        # Start as encoder.
-        mode = self.modes.Encode
+        # Control bits of all samples and steps [BATCH_SIZE x LENGTH_SIZE].
+        encoding_BxS = inputs_BxSxI[:, :, self.encoding_bit] != 0
+        solving_BxS = inputs_BxSxI[:, :, self.solving_bit] != 0
+        # Single check for the whole batch.
+        if (encoding_BxS & solving_BxS).any():
+            logger.error('Two control bits were on:\n {}'.format(inputs_BxSxI))
+            exit(-1)
+
+        # Per-sample mode: all samples start as encoder.
+        solve_mode_B = torch.zeros_like(encoding_BxS[:, 0])
 
         # Logits container.
         logits = []
 
-        for x in inputs_BxSxI.chunk(inputs_BxSxI.size(1), dim=1):
+        for t, x in enumerate(inputs_BxSxI.chunk(inputs_BxSxI.size(1), dim=1)):
             # Squeeze x.
             x = x.squeeze(1)
 
-            # Switch between the encoder and solver modes.
-            if x[0, self.solving_bit] and not x[0, self.encoding_bit]:
-                mode = self.modes.Solve
-                if self.pass_cell_state:
-                    # Initialize solver state with final encoder state.
-                    solver_state = self.solver.init_state_with_encoder_state(
-                        encoder_state)
-                else:
-                    # Initialize solver state - with final state of memory and
-                    # final attention only.
-                    solver_state = self.solver.init_state(
-                        encoder_state.memory_state, encoder_state.interface_state.attention)
-
-            elif x[0, self.encoding_bit] and x[0, self.solving_bit]:
-                logger.error('Two control bits were on:\n {}'.format(x))
-                exit(-1)
-
-            # Run encoder or solver - depending on the state.
-            if mode == self.modes.Encode:
-                logit, encoder_state = self.encoder(x, encoder_state)
-            elif mode == self.modes.Solve:
-                logit, solver_state = self.solver(x, solver_state)
+            # Samples that are not solving yet have their solver state
+            # initialized with the current (i.e. final) encoder state.
+            init_solver_state = self.init_solver_state(self.solver, encoder_state)
+            if solver_state is None:
+                solver_state = init_solver_state
+            else:
+                solver_state = blend_state(
+                    solve_mode_B, solver_state, init_solver_state)
+
+            # Switch (per sample) between the encoder and solver modes.
+            solve_mode_B = solve_mode_B | (solving_BxS[:, t] & ~encoding_BxS[:, t])
+
+            # Run encoder and solver in lockstep.
+            encoder_logit, new_encoder_state = self.encoder(x, encoder_state)
+            solver_logit, solver_state = self.solver(x, solver_state)
+
+            # Encoder state is updated only for the encoding samples.
+            encoder_state = blend_state(
+                solve_mode_B, encoder_state, new_encoder_state)
 
             # Collect logits from both encoder and solver - they will be masked
             # afterwards.
-            logits += [logit]
+            logits += [blend_state(solve_mode_B, solver_logit, encoder_logit)]
 
         # Stack logits along the temporal (sequence) axis.
         logits = torch.stack(logits, 1)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""fused_lstm.py: contains execution of stacks of LSTM cells over whole sequences with the fused (multi-layer) LSTM"""
+
+from torch import nn
+
+
+class FusedLSTM(object):
+    """
+    Runs a stack of LSTM cells (nn.LSTMCell, layer i feeding layer i+1) over
+    whole sequences with a single call of the fused multi-layer nn.LSTM.
+
+    The parameters are shared with (and owned by) the cells, so the state
+    dictionaries of the models are not affected and both the fused and the
+    per-step execution can be used interchangeably.
+
+    """
+
+    def __init__(self, cells):
+        """
+        Initializes the fused LSTM.
+
+        :param cells: List of LSTM cells (nn.LSTMCell).
+
+        """
+        self.cells = list(cells)
+        self.num_layers = len(self.cells)
+        self.hidden_size = self.cells[0].hidden_size
+
+        # Template module - not a submodule of the model, its parameters are
+        # replaced by the (shared) parameters of the cells.
+        self.lstm = nn.LSTM(self.cells[0].input_size, self.hidden_size,
+                            num_layers=self.num_layers,
+                            bias=self.cells[0].bias, batch_first=True)
+        for i, cell in enumerate(self.cells):
+            for name, param in cell.named_parameters():
+                setattr(self.lstm, '{}_l{}'.format(name, i), param)
+
+    @staticmethod
+    def is_supported(cells):
+        """
+        Checks whether the stack of cells can be fused, i.e. all cells have
+        the same hidden size, feed each other and have no hooks.
+
+        :param cells: List of LSTM cells.
+        :return: True if the fused execution can be used.
+
+        """
+        cells = list(cells)
+        for i, cell in enumerate(cells):
+            if not isinstance(cell, nn.LSTMCell):
+                return False
+            if cell.hidden_size != cells[0].hidden_size or \
+                    cell.bias != cells[0].bias:
+                return False
+            if i > 0 and cell.input_size != cells[0].hidden_size:
+                return False
+            if cell._forward_hooks or cell._forward_pre_hooks or \
+                    cell._backward_hooks:
+                return False
+        return True
+
+    def __call__(self, inputs_BxSxI, state=None):
+        """
+        Runs the stack of cells over the whole sequences.
+
+        :param inputs_BxSxI: Inputs [BATCH_SIZE x SEQ_LENGTH x INPUT_SIZE].
+        :param state: Tuple (hidden, memory cell) of states of all layers, each [NUM_LAYERS x BATCH_SIZE x HIDDEN_SIZE] (DEFAULT: None, i.e. zeros).
+        :return: Tuple (hidden states of the last layer [BATCH_SIZE x SEQ_LENGTH x HIDDEN_SIZE], final state tuple).
+
+        """
+        return self.lstm(inputs_BxSxI, state)
@@ -19,6 +19,7 @@ import torch
 from torch import nn
 
 from models.sequential_model import SequentialModel
+from models.fused_lstm import FusedLSTM
 
 
 class LSTM(SequentialModel):
@@ -47,8 +48,20 @@ class LSTM(SequentialModel):
 
         self.linear = nn.Linear(self.hidden_state_dim, self.output_units)
 
+        # Fast path: all layers over the whole sequence in a single fused call.
+        self.fused_lstm = FusedLSTM(self.lstm_layers) \
+            if params.get('fused_lstm', True) and \
+            FusedLSTM.is_supported(self.lstm_layers) else None
+
     def forward(self, data_tuple):
         (x, targets) = data_tuple
+
+        # Use the fused LSTM - unless the cells are run step by step for
+        # visualization.
+        if self.fused_lstm is not None and not self.app_state.visualize:
+            outputs, _ = self.fused_lstm(x)
+            return self.linear(outputs)
+
         # Check if the class has been converted to cuda (through .cuda()
         # method)
         dtype = self.app_state.dtype
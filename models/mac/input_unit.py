@@ -44,6 +44,10 @@
 __author__ = "Vincent Marois"
 
 
+import collections
+import itertools
+
+import torch
 from models.mac.utils_mac import linear
 from models.mac.image_encoding import ImageProcessing
 
@@ -55,12 +59,14 @@ class InputUnit(nn.Module):
     Implementation of the input unit of the MAC network.
     """
 
-    def __init__(self, dim, embedded_dim):
+    def __init__(self, dim, embedded_dim, kb_cache_size=0):
         """
         Constructor for the input unit.
 
         :param dim: global 'd' hidden dimension
         :param embedded_dim: dimension of the word embeddings.
+        :param kb_cache_size: number of images whose encodings & knowledge base projections are cached in evaluation
+        mode (0 disables the cache).
 
         """
 
@@ -83,17 +89,33 @@ class InputUnit(nn.Module):
         # TODO: linear(2*self.dim, self.dim, bias=True) ?
         self.lstm_proj = nn.Linear(2 * self.dim, self.dim)
 
-    def forward(self, questions, questions_len, feature_maps):
+        # LRU cache of the images encodings & knowledge base projections,
+        # keyed by image keys - valid for the weights identified by
+        # kb_cache_version.
+        self.kb_cache_size = kb_cache_size
+        self.kb_cache = collections.OrderedDict()
+        self.kb_cache_version = None
+
+    def weights_version(self):
         """
-        Forward pass of the input unit.
+        Identifies the current weights of the image processing & knowledge
+        base projection (changed by optimizer steps, loading of the weights
+        etc.).
+
+        :return: tuple of (data pointer, version counter) of the parameters.
+
+        """
+        return tuple((p.data_ptr(), p._version) for p in itertools.chain(
+            self.conv.parameters(), self.kb_proj_layer.parameters()))
+
+    def project_images(self, feature_maps):
+        """
+        Encodes the feature maps and projects them into the knowledge base.
 
-        :param questions: tensor of the questions words, shape [batch_size x maxQuestionLength x embedded_dim]
-        :param questions_len: list of the unpadded questions length.
         :param feature_maps: [batch_size x nb_kernels x feat_H x feat_W] coming from ResNet101.
 
-        :return: question encodings: [batch_size x 2*dim],
-                word encodings: [batch_size x maxQuestionLength x dim]
-                images_encodings: [batch_size x nb_kernels x (H*W)]
+        :return: images_encodings: [batch_size x dim x (H*W)],
+                 knowledge base projections: [batch_size x dim x (H*W)]
 
         """
         batch_size = feature_maps.shape[0]
@@ -108,6 +130,98 @@ class InputUnit(nn.Module):
         kb_proj = self.kb_proj_layer(
             feature_maps.permute(0, 2, 1)).permute(0, 2, 1)
 
+        return feature_maps, kb_proj
+
+    def encode_images(self, feature_maps, image_keys=None):
+        """
+        Encodes the images: the duplicated images of the batch are processed
+        once and, in evaluation mode, the encodings are reused from the cache.
+
+        :param feature_maps: [batch_size x nb_kernels x feat_H x feat_W] coming from ResNet101.
+        :param image_keys: tensor (on CPU) of keys identifying the images [batch_size] (DEFAULT: None, no
+        deduplication nor caching).
+
+        :return: images_encodings: [batch_size x dim x (H*W)],
+                 knowledge base projections: [batch_size x dim x (H*W)]
+
+        """
+        if image_keys is None:
+            return self.project_images(feature_maps)
+
+        # deduplicate the images: first occurrence of every (unique) image.
+        unique_keys, inverse = torch.unique(image_keys, return_inverse=True)
+        first = torch.zeros(len(unique_keys), dtype=torch.long).scatter_(
+            0, inverse, torch.arange(len(image_keys)))
+
+        if not self.training and self.kb_cache_size > 0:
+            feature_maps, kb_proj = self.cached_projection(
+                feature_maps, unique_keys.tolist(), first)
+        else:
+            feature_maps, kb_proj = self.project_images(
+                feature_maps.index_select(0, first.to(feature_maps.device)))
+
+        # broadcast to the questions.
+        inverse = inverse.to(feature_maps.device)
+        return feature_maps.index_select(0, inverse), kb_proj.index_select(0, inverse)
+
+    def cached_projection(self, feature_maps, keys, first):
+        """
+        Returns the images encodings & knowledge base projections of the
+        unique images, computing only the ones missing in the cache.
+
+        :param feature_maps: [batch_size x nb_kernels x feat_H x feat_W] coming from ResNet101.
+        :param keys: list of the keys of the unique images.
+        :param first: tensor of the indices of the unique images in the batch.
+
+        :return: images_encodings: [nb_unique_images x dim x (H*W)],
+                 knowledge base projections: [nb_unique_images x dim x (H*W)]
+
+        """
+        # invalidate the cache when the weights have changed.
+        version = self.weights_version()
+        if version != self.kb_cache_version:
+            self.kb_cache.clear()
+            self.kb_cache_version = version
+
+        missing = [i for i, key in enumerate(keys) if key not in self.kb_cache]
+        if missing:
+            with torch.no_grad():
+                images, kb_proj = self.project_images(feature_maps.index_select(
+                    0, first[missing].to(feature_maps.device)))
+            for i, image, kb in zip(missing, images, kb_proj):
+                self.kb_cache[keys[i]] = (image, kb)
+
+        entries = []
+        for key in keys:
+            self.kb_cache.move_to_end(key)
+            entries.append(self.kb_cache[key])
+
+        # memory cap.
+        while len(self.kb_cache) > self.kb_cache_size:
+            self.kb_cache.popitem(last=False)
+
+        images, kb_proj = zip(*entries)
+        return torch.stack(images), torch.stack(kb_proj)
+
+    def forward(self, questions, questions_len, feature_maps, image_keys=None):
+        """
+        Forward pass of the input unit.
+
+        :param questions: tensor of the questions words, shape [batch_size x maxQuestionLength x embedded_dim]
+        :param questions_len: list of the unpadded questions length.
+        :param feature_maps: [batch_size x nb_kernels x feat_H x feat_W] coming from ResNet101.
+        :param image_keys: tensor (on CPU) of keys identifying the images [batch_size] (DEFAULT: None)
+
+        :return: question encodings: [batch_size x 2*dim],
+                word encodings: [batch_size x maxQuestionLength x dim]
+                images_encodings: [batch_size x nb_kernels x (H*W)]
+
+        """
+        batch_size = feature_maps.shape[0]
+
+        # images processing & projection
+        feature_maps, kb_proj = self.encode_images(feature_maps, image_keys)
+
         # avoid useless computations on padding elements: pack sequences
         embed = nn.utils.rnn.pack_padded_sequence(
             questions, questions_len, batch_first=True)
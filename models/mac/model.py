@@ -82,12 +82,16 @@ class MACNetwork(Model):
         self.memory_gate = params['memory_gate']
         self.nb_classes = params['nb_classes']
         self.dropout = params['dropout']
+        # Number of images whose knowledge base projections are cached in
+        # evaluation mode.
+        self.kb_cache_size = params.get('kb_cache_size', 0)
 
         self.image = []
 
         # instantiate units
         self.input_unit = InputUnit(
-            dim=self.dim, embedded_dim=self.embed_hidden)
+            dim=self.dim, embedded_dim=self.embed_hidden,
+            kb_cache_size=self.kb_cache_size)
 
         self.mac_unit = MACUnit(
             dim=self.dim,
@@ -110,12 +114,15 @@ class MACNetwork(Model):
 
         # unpack data_tuple
         inner_tuple, _ = data_tuple
-        image_questions_tuple, questions_len = inner_tuple
+        image_questions_tuple, questions_len = inner_tuple[:2]
         images, questions = image_questions_tuple
+        # keys of the images (optional) - deduplication & caching of the
+        # knowledge base projections.
+        image_keys = inner_tuple[2] if len(inner_tuple) > 2 else None
 
         # input unit
         img, kb_proj, lstm_out, h = self.input_unit(
-            questions, questions_len, images)
+            questions, questions_len, images, image_keys)
         self.image = kb_proj
 
         # recurrent MAC cells
@@ -73,10 +73,32 @@ class NTM(SequentialModel):
                :return: Predictions being a tensor of size  [BATCH_SIZE x LENGTH_SIZE x OUTPUT_SIZE] .
 
         """
-        dtype = self.app_state.dtype
-
         # Unpack data tuple.
         (inputs_BxSxI, targets) = data_tuple
+
+        # Initialize 'zero' state.
+        cell_state = self.init_cell_state(inputs_BxSxI)
+
+        # Check if we want to collect cell history for the visualization
+        # purposes.
+        if self.app_state.visualize:
+            self.cell_state_initial = cell_state
+
+        # Process the sequence step by step, collecting the cell history
+        # (for the visualization purposes) on the way.
+        output_logits_BxSxO, _ = self.forward_window(inputs_BxSxI, cell_state)
+
+        return output_logits_BxSxO
+
+    def init_cell_state(self, inputs_BxSxI):
+        """
+        Returns the initial ('zero') cell state for the given input sequences.
+
+        :param inputs_BxSxI: Input sequences [BATCH_SIZE x LENGTH_SIZE x INPUT_SIZE].
+        :return: Initial NTMCellStateTuple.
+
+        """
+        dtype = self.app_state.dtype
         batch_size = inputs_BxSxI.size(0)
 
         # "Data-driven memory size".
@@ -94,35 +116,20 @@ class NTM(SequentialModel):
             num_memory_addresses,
             self.num_memory_content_bits).type(dtype)
 
-        # Initialize 'zero' state.
-        cell_state = self.ntm_cell.init_state(init_memory_BxAxC)
-
-        # List of output logits [BATCH_SIZE x OUTPUT_SIZE] of length SEQ_LENGTH
-        output_logits_BxO_S = []
-
-        # Check if we want to collect cell history for the visualization
-        # purposes.
-        if self.app_state.visualize:
-            self.cell_state_history = []
-            self.cell_state_initial = cell_state
-
-        # Divide sequence into chunks of size [BATCH_SIZE x INPUT_SIZE] and
-        # process them one by one.
-        for input_t_Bx1xI in inputs_BxSxI.chunk(inputs_BxSxI.size(1), dim=1):
-            # Process one chunk.
-            output_BxO, cell_state = self.ntm_cell(
-                input_t_Bx1xI.squeeze(1), cell_state)
-            # Append to list of logits.
-            output_logits_BxO_S += [output_BxO]
+        return self.ntm_cell.init_state(init_memory_BxAxC)
 
-            # Collect cell history - for the visualization purposes.
-            if self.app_state.visualize:
-                self.cell_state_history.append(cell_state)
+    def forward_window(self, inputs_BxWxI, cell_state):
+        """
+        Processes (a window of) the input sequences step by step.
 
-        # Stack logits along time axis (1).
-        output_logits_BxSxO = torch.stack(output_logits_BxO_S, 1)
+        :param inputs_BxWxI: Input sequences [BATCH_SIZE x WINDOW_SIZE x INPUT_SIZE].
+        :param cell_state: NTMCellStateTuple at the beginning of the window.
+        :return: Tuple (logits [BATCH_SIZE x WINDOW_SIZE x OUTPUT_SIZE], NTMCellStateTuple at the end of the window).
 
-        return output_logits_BxSxO
+        """
+        return self.recurrent_forward(
+            self.ntm_cell, inputs_BxWxI, cell_state,
+            record_state=lambda state: state)
 
     def generate_memory_attention_figure_layout(self):
         """
@@ -21,9 +21,11 @@ Simple Encoder Decoder LSTM tested on serial recall task.
 __author__ = "Vincent Albouy"
 
 from enum import Enum
+import itertools
 import torch
 from torch import nn
 from models.sequential_model import SequentialModel
+from models.fused_lstm import FusedLSTM
 
 
 class EncoderDecoderLSTM(SequentialModel):
@@ -69,6 +71,12 @@ class EncoderDecoderLSTM(SequentialModel):
 
         self.modes = Enum('Modes', ['Encode', 'Decode'])
 
+        # Fast path: encoder subsequences processed in single fused calls
+        # (decoder is fed with its own outputs, so it runs step by step).
+        self.fused_encoder = FusedLSTM([self.encoder]) \
+            if params.get('fused_lstm', True) and \
+            FusedLSTM.is_supported([self.encoder]) else None
+
     def init_state(self, batch_size):
 
         dtype = self.app_state.dtype
@@ -93,31 +101,60 @@ class EncoderDecoderLSTM(SequentialModel):
         # Initialize state variables.
         (h, c) = self.init_state(batch_size)
 
-        # Logits container.
-        logits = []
-
-        for x in inputs.chunk(inputs.size(1), dim=1):
-            # Squeeze x.
-            x = x.squeeze(1)
+        # Control bits (of the first sample) of all steps - moved to host
+        # once per batch.
+        control = inputs[0, :, [self.encoding_bit, self.decoding_bit]].tolist()
 
+        # Mode of every step.
+        modes = []
+        mode = None
+        for (encoding, decoding) in control:
             # switch between the encoder and decoder modes. It will stay in
             # this mode till it hits the opposite kind of marker
-            if x[0, self.decoding_bit] and not x[0, self.encoding_bit]:
+            if decoding and not encoding:
                 mode = self.modes.Decode
-            elif x[0, self.encoding_bit] and not x[0, self.decoding_bit]:
+            elif encoding and not decoding:
                 mode = self.modes.Encode
-            elif x[0, self.encoding_bit] and x[0, self.decoding_bit]:
+            elif encoding and decoding:
                 print('Error: both encoding and decoding bit were true')
                 exit(-1)
+            modes += [mode]
 
-            logit = self.output(h)
-            logits += [logit]
+        # Use the fused LSTM - unless the cells are run step by step for
+        # visualization.
+        use_fused = self.fused_encoder is not None and not self.app_state.visualize
 
-            if mode == self.modes.Decode:
-                h, c = self.decoder(logit, (h, c))
-            elif mode == self.modes.Encode:
-                h, c = self.encoder(x, (h, c))
+        # Logits container.
+        logits = []
 
-        # Stack logits along the temporal (sequence) axis.
-        logits = torch.stack(logits, 1)
+        # Process the subsequences of steps in the same mode.
+        start = 0
+        for mode, steps in itertools.groupby(modes):
+            stop = start + len(list(steps))
+
+            if mode == self.modes.Encode and use_fused:
+                # Logits are computed from the hidden states preceding the
+                # steps.
+                hs, (h_last, c_last) = self.fused_encoder(
+                    inputs[:, start:stop], (h.unsqueeze(0), c.unsqueeze(0)))
+                hs = torch.cat([h.unsqueeze(1), hs[:, :-1]], dim=1)
+                logits += [self.output(hs)]
+                (h, c) = (h_last[0], c_last[0])
+
+            else:
+                for x in inputs[:, start:stop].chunk(stop - start, dim=1):
+                    # Squeeze x.
+                    x = x.squeeze(1)
+
+                    logit = self.output(h)
+                    logits += [logit.unsqueeze(1)]
+
+                    if mode == self.modes.Decode:
+                        h, c = self.decoder(logit, (h, c))
+                    else:
+                        h, c = self.encoder(x, (h, c))
+            start = stop
+
+        # Concatenate logits along the temporal (sequence) axis.
+        logits = torch.cat(logits, 1)
         return logits
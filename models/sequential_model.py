@@ -26,11 +26,98 @@ from models.model import Model
 from problems.problem import DataTuple
 
 
+def detach_state(state):
+    """
+    Detaches a (possibly nested) cell state from the computational graph.
+
+    Works with tensors and (named)tuples/lists of tensors, e.g. NTMCellStateTuple,
+    DNC's InterfaceStateTuple or DWM's DWMCellStateTuple. Other objects are returned
+    unchanged.
+
+    :param state: Cell state.
+    :return: Cell state with all tensors detached.
+
+    """
+    if isinstance(state, torch.Tensor):
+        return state.detach()
+    if isinstance(state, tuple) and hasattr(state, '_fields'):
+        # Named tuple - keep its type.
+        return type(state)(*[detach_state(s) for s in state])
+    if isinstance(state, (tuple, list)):
+        return type(state)(detach_state(s) for s in state)
+    return state
+
+
+def blend_state(mask_B, state_true, state_false):
+    """
+    Blends two (possibly nested) cell states of the same structure sample by
+    sample: takes state_true for samples where mask is set and state_false
+    for others. All tensors of the states must be batch-major.
+
+    :param mask_B: Mask [BATCH_SIZE] (0/1 values).
+    :param state_true: Cell state selected where mask is set.
+    :param state_false: Cell state selected where mask is not set.
+    :return: Blended cell state.
+
+    """
+    if isinstance(state_true, torch.Tensor):
+        mask = mask_B.type(state_true.type()).view(
+            -1, *([1] * (state_true.dim() - 1)))
+        return mask * state_true + (1 - mask) * state_false
+    if isinstance(state_true, tuple) and hasattr(state_true, '_fields'):
+        return type(state_true)(*[blend_state(mask_B, t, f)
+                                  for t, f in zip(state_true, state_false)])
+    if isinstance(state_true, (tuple, list)):
+        return type(state_true)(blend_state(mask_B, t, f)
+                                for t, f in zip(state_true, state_false))
+    return state_true
+
+
+def flatten_state(state):
+    """
+    Returns the list of all tensors of a (possibly nested) cell state.
+
+    :param state: Cell state.
+    :return: List of tensors (depth-first order).
+
+    """
+    if isinstance(state, torch.Tensor):
+        return [state]
+    if isinstance(state, (tuple, list)):
+        return [tensor for s in state for tensor in flatten_state(s)]
+    return []
+
+
+def unflatten_state(template, tensors):
+    """
+    Rebuilds a (possibly nested) cell state from a list of tensors, i.e.
+    inverts flatten_state.
+
+    :param template: Cell state of the same structure.
+    :param tensors: List of tensors (depth-first order).
+    :return: Cell state.
+
+    """
+    tensors = iter(tensors)
+
+    def rebuild(state):
+        if isinstance(state, torch.Tensor):
+            return next(tensors)
+        if isinstance(state, tuple) and hasattr(state, '_fields'):
+            return type(state)(*[rebuild(s) for s in state])
+        if isinstance(state, (tuple, list)):
+            return type(state)(rebuild(s) for s in state)
+        return state
+
+    return rebuild(template)
+
+
 class SequentialModel(Model):
     """
     Class representing base class for all sequential models.
 
-    Provides basic plotting functionality.
+    Provides basic plotting functionality and a common recurrent loop
+    (``recurrent_forward``) running a cell over the time axis.
 
     """
 
@@ -44,6 +131,186 @@ class SequentialModel(Model):
         """
         super(SequentialModel, self).__init__(params)
 
+        # Truncated BPTT window: the cell state is detached every
+        # bptt_window steps (DEFAULT: -1, i.e. backpropagate through the
+        # whole sequence).
+        self.bptt_window = params.get('bptt_window', -1)
+
+        # Activation checkpointing: only every checkpoint_interval-th cell
+        # state is kept for backward, the steps in between are recomputed
+        # (DEFAULT: -1, i.e. all activations are kept).
+        self.checkpoint_interval = params.get('checkpoint_interval', -1)
+
+        # Compiled (traced) execution of the cell (DEFAULT: False).
+        self.compile_cell = params.get('compile_cell', False)
+        self._compiled_cells = {}
+
+        # History of (visualization) cell states, filled by recurrent_forward.
+        self.cell_state_history = None
+
+    def init_cell_state(self, inputs):
+        """
+        Returns the initial cell state for the given (whole) input sequences.
+
+        Abstract - to be defined in derived classes supporting streaming
+        (truncated BPTT) training.
+
+        :param inputs: Input sequences [BATCH_SIZE x SEQ_LENGTH x INPUT_SIZE]
+
+        """
+        raise NotImplementedError(
+            "Model {} does not support streaming".format(self.name))
+
+    def forward_window(self, inputs, cell_state):
+        """
+        Processes a window of the input sequences, starting from the given
+        cell state.
+
+        Abstract - to be defined in derived classes supporting streaming
+        (truncated BPTT) training.
+
+        :param inputs: Window of input sequences [BATCH_SIZE x WINDOW_SIZE x INPUT_SIZE]
+        :param cell_state: Cell state at the beginning of the window.
+        :returns: Tuple (output [BATCH_SIZE x WINDOW_SIZE x OUTPUT_SIZE], cell state at the end of the window).
+
+        """
+        raise NotImplementedError(
+            "Model {} does not support streaming".format(self.name))
+
+    def recurrent_forward(self, cell, inputs, cell_state,
+                          record_state=None, bptt_window=None):
+        """
+        Runs a recurrent cell over the whole input sequence.
+
+        The cell must follow the ``output_t, state = cell(input_t, state)``
+        protocol. Outputs of all steps are collected and stacked once into
+        the output tensor (there is no per-step concatenation).
+
+        When ``record_state`` is set and visualization is active, it is
+        called with the cell state after every step and its result is
+        appended to ``self.cell_state_history``.
+
+        :param cell: Recurrent cell (callable).
+        :param inputs: Input sequences [BATCH_SIZE x SEQ_LENGTH x INPUT_SIZE]
+        :param cell_state: Initial cell state.
+        :param record_state: Function converting the cell state into a history entry (DEFAULT: None).
+        :param bptt_window: Truncated BPTT window, i.e. the cell state is detached every bptt_window steps (DEFAULT: None, i.e. the model's bptt_window).
+        :returns: Tuple (output [BATCH_SIZE x SEQ_LENGTH x OUTPUT_SIZE], final cell state).
+
+        """
+        if bptt_window is None:
+            bptt_window = self.bptt_window
+
+        record = (record_state is not None) and self.app_state.visualize
+        if record:
+            self.cell_state_history = []
+
+        # Visualization falls back to the eager cell.
+        if self.compile_cell and not self.app_state.visualize:
+            cell = self._get_compiled_cell(cell)
+
+        # Checkpointing is pointless without backward and cannot be used
+        # together with recording of the (recomputed) states.
+        if self.checkpoint_interval > 0 and torch.is_grad_enabled() \
+                and not record:
+            return self._checkpointed_recurrent_forward(
+                cell, inputs, cell_state, bptt_window)
+
+        outputs = []
+        for t in range(inputs.size(-2)):
+            # Cut the graph at the window boundaries.
+            if bptt_window > 0 and t > 0 and t % bptt_window == 0:
+                cell_state = detach_state(cell_state)
+
+            output_t, cell_state = cell(inputs[..., t, :], cell_state)
+
+            if output_t is not None:
+                outputs.append(output_t)
+
+            # Collect cell history - for the visualization purposes.
+            if record:
+                self.cell_state_history.append(record_state(cell_state))
+
+        if not outputs:
+            return None, cell_state
+
+        # Single allocation of the whole output sequence.
+        return torch.stack(outputs, dim=-2), cell_state
+
+    def _get_compiled_cell(self, cell):
+        """
+        Returns the compiled version of the cell, or the cell itself if it
+        cannot be compiled (e.g. it has hooks registered).
+
+        :param cell: Recurrent cell.
+        :returns: Compiled cell (or cell).
+
+        """
+        from models.compiled_cell import CompiledCell
+
+        if not CompiledCell.is_supported(cell):
+            return cell
+
+        if id(cell) not in self._compiled_cells:
+            self._compiled_cells[id(cell)] = CompiledCell(cell)
+        return self._compiled_cells[id(cell)]
+
+    def _checkpointed_recurrent_forward(self, cell, inputs, cell_state,
+                                        bptt_window):
+        """
+        Runs a recurrent cell over the whole input sequence, keeping only the
+        cell states at the segment boundaries (every checkpoint_interval steps)
+        for backward. Steps inside a segment are recomputed during backward.
+
+        The cell must return an output at every step.
+
+        :param cell: Recurrent cell (callable).
+        :param inputs: Input sequences [BATCH_SIZE x SEQ_LENGTH x INPUT_SIZE]
+        :param cell_state: Initial cell state.
+        :param bptt_window: Truncated BPTT window (-1: no truncation).
+        :returns: Tuple (output [BATCH_SIZE x SEQ_LENGTH x OUTPUT_SIZE], final cell state).
+
+        """
+        from torch.utils.checkpoint import checkpoint
+
+        seq_length = inputs.size(-2)
+
+        # Segments end at checkpoints and at truncated BPTT window boundaries.
+        boundaries = set(range(0, seq_length, self.checkpoint_interval))
+        if bptt_window > 0:
+            boundaries.update(range(0, seq_length, bptt_window))
+        boundaries = sorted(boundaries) + [seq_length]
+
+        outputs = []
+        for start, stop in zip(boundaries[:-1], boundaries[1:]):
+            # Cut the graph at the window boundaries.
+            if bptt_window > 0 and start > 0 and start % bptt_window == 0:
+                cell_state = detach_state(cell_state)
+
+            template = cell_state
+
+            def run_segment(*flat_state, start=start, stop=stop,
+                            template=template):
+                state = unflatten_state(template, flat_state)
+                segment_outputs = []
+                for t in range(start, stop):
+                    output_t, state = cell(inputs[..., t, :], state)
+                    segment_outputs.append(output_t)
+                # Remember the structure of the resulting state.
+                run_segment.state = state
+                return (torch.stack(segment_outputs, dim=-2),) + \
+                    tuple(flatten_state(state))
+
+            # Non-reentrant checkpoint - gradients reach the parameters even
+            # if no input requires them.
+            results = checkpoint(run_segment, *flatten_state(cell_state),
+                                 use_reentrant=False)
+            outputs.append(results[0])
+            cell_state = unflatten_state(run_segment.state, results[1:])
+
+        # Single allocation of the whole output sequence.
+        return torch.cat(outputs, dim=-2), cell_state
+
     def plot(self, data_tuple, predictions, sample_number=0):
         """
         Creates a default interactive visualization, with a slider enabling to
@@ -116,7 +116,24 @@ class AttnDecoderRNN(nn.Module):
         # basically project from the hidden space to the output vocabulary set
         self.out = nn.Linear(self.hidden_size, self.output_voc_size)
 
-    def forward(self, input, hidden, encoder_outputs):
+    def project_encoder_outputs(self, encoder_outputs):
+        """
+        Precomputes (once per batch) the projection of the encoder outputs by
+        the encoder part of attn_combine.
+
+        As attn_combine is linear, attn_combine([embedded, attn_weights * encoder_outputs]) is equal to
+        W_embedded * embedded + attn_weights * (encoder_outputs * W_encoder^T) + bias, so every decoder step only
+        computes the attention weights and a batched matmul of them with the precomputed projection.
+
+        :param encoder_outputs: encoder outputs, of shape [batch_size x max_length x (hidden_size * encoder.n_dir)]
+
+        :return: projected encoder outputs, of shape [batch_size x max_length x hidden_size]
+
+        """
+        return torch.matmul(
+            encoder_outputs, self.attn_combine.weight[:, self.hidden_size:].t())
+
+    def forward(self, input, hidden, encoder_outputs, encoder_projections=None):
         """
         Runs the Attention Decoder.
 
@@ -126,6 +143,8 @@ class AttnDecoderRNN(nn.Module):
 
         :param encoder_outputs: encoder outputs, of shape [batch_size x max_length x hidden_size]
 
+        :param encoder_projections: encoder outputs projected by project_encoder_outputs() (DEFAULT: None, i.e. computed in every step)
+
         :return: output should be of size [batch_size x 1 x output_voc_size]: tensor containing the output features h_t from the last layer of the RNN, for each t.
 
         :return: hidden should be of size [1 x batch_size x hidden_size]: tensor containing the hidden state for t = seq_length
@@ -149,14 +168,12 @@ class AttnDecoderRNN(nn.Module):
         attn_weights = F.softmax(attn_weights, dim=-1)
         # attn_weights: [batch_size x 1 x max_length]
 
-        # apply attention weights on the encoder outputs
-        attn_applied = torch.bmm(attn_weights, encoder_outputs)
-        # attn_applied: [batch_size x 1 x (hidden_size * (1 + encoder.n_dir)]
-
         # combine the embedded decoder inputs & attended encoder outputs
-        embedded_attn_applied_concat = torch.cat(
-            (embedded, attn_applied), dim=-1)
-        gru_input = self.attn_combine(embedded_attn_applied_concat)
+        if encoder_projections is None:
+            encoder_projections = self.project_encoder_outputs(encoder_outputs)
+        gru_input = F.linear(embedded, self.attn_combine.weight[:, :self.hidden_size],
+                             self.attn_combine.bias) + \
+            torch.bmm(attn_weights, encoder_projections)
         gru_input = F.relu(gru_input)
 
         if self.encoder_bidirectional:  # select hidden state of forward layer of encoder only
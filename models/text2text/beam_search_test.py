@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import torch
+from torch import nn
+from utils.param_interface import ParamInterface
+from models.text2text.simple_encoder_decoder import SimpleEncoderDecoder, \
+    PAD_token, SOS_token, EOS_token
+# Tests for the beam search of SimpleEncoderDecoder (run from the root
+# directory: python -m models.text2text.beam_search_test)
+A, B = 3, 4
+voc_size, max_length, batch_size = 5, 4, 2
+
+
+class ToyDecoder(nn.Module):
+    """
+    Decoder whose output distribution depends on the previous token only:
+    after SOS: A 0.6, B 0.4; after A: EOS 0.4, A 0.3, B 0.3; after B: EOS 0.9.
+    Greedy decoding gives A EOS (0.24), the beam search B EOS (0.36).
+    """
+
+    def __init__(self):
+        super(ToyDecoder, self).__init__()
+        probs = torch.full((voc_size, voc_size), 1e-6)
+        probs[SOS_token, A], probs[SOS_token, B] = 0.6, 0.4
+        probs[A, EOS_token], probs[A, A], probs[A, B] = 0.4, 0.3, 0.3
+        probs[B, EOS_token], probs[B, A], probs[B, B] = 0.9, 0.05, 0.05
+        probs[EOS_token, PAD_token] = 1.0
+        probs[PAD_token, PAD_token] = 1.0
+        self.log_probs = (probs / probs.sum(dim=1, keepdim=True)).log()
+
+    def project_encoder_outputs(self, encoder_outputs):
+        return encoder_outputs
+
+    def forward(self, input, hidden, encoder_outputs, encoder_projections=None):
+        output = self.log_probs[input.squeeze(1)].unsqueeze(1)
+        attention = torch.zeros(input.size(0), 1, max_length)
+        return output, hidden, attention
+
+
+def decode(beam_width):
+    params = ParamInterface()
+    params.add_default_params({
+        'max_length': max_length, 'input_voc_size': voc_size, 'hidden_size': 8,
+        'output_voc_size': voc_size, 'encoder_bidirectional': False,
+        'beam_width': beam_width, 'length_penalty': 0.0})
+    model = SimpleEncoderDecoder(params)
+    model.decoder = ToyDecoder()
+    model.eval()
+
+    inputs = torch.tensor([[A, B, EOS_token, PAD_token]] * batch_size)
+    with torch.no_grad():
+        outputs = model((inputs, inputs))
+    print(outputs.argmax(dim=-1))
+    return outputs
+
+
+# Greedy decoding (beam of width 1).
+outputs = decode(beam_width=1)
+assert outputs.argmax(dim=-1).tolist() == [[A, EOS_token, PAD_token, PAD_token]] * batch_size
+
+# The argmax of the outputs is the best hypothesis of the beam search.
+outputs = decode(beam_width=2)
+assert outputs.argmax(dim=-1).tolist() == [[B, EOS_token, PAD_token, PAD_token]] * batch_size
+# Outputs remain log-probability distributions.
+assert torch.allclose(outputs.exp().sum(dim=-1), torch.ones(batch_size, max_length), atol=1e-5)
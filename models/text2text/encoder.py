@@ -90,29 +90,47 @@ class EncoderRNN(nn.Module):
             batch_first=True,
             bidirectional=self.bidirectional)
 
-    def forward(self, input, hidden):
+    def forward(self, input, hidden, lengths=None, total_length=None):
         """
-        Runs the Encoder.
+        Runs the Encoder over the whole (padded) input sequences in a single
+        GRU call.
 
-        :param input: tensor of indices, of size [batch_size x 1] (word by word looping)
+        :param input: tensor of indices, of size [batch_size x seq_len]
 
         :param hidden: initial hidden state for each element in the input batch.
         Should be of size [(n_layers * n_directions) x batch_size x hidden_size]
 
-        For every input word, the encoder outputs a vector and a hidden state, and uses the hidden state for
-        the next input word.
+        :param lengths: lengths of the (unpadded) input sequences [batch_size]. If given, the sequences are packed,
+        so the padding is not processed (DEFAULT: None)
 
-        :return: output should be of size [batch_size x seq_len x (hidden_size * n_directions)]: tensor containing the output features h_t from the last layer of the RNN, for each t.
+        :param total_length: length the outputs are padded to (DEFAULT: None, i.e. seq_len)
+
+        :return: output should be of size [batch_size x total_length x (hidden_size * n_directions)]: tensor containing the output features h_t from the last layer of the RNN, for each t.
 
         :return: hidden should be of size [(n_layers * n_directions) x batch_size x hidden_size]: tensor containing the hidden state for t = seq_length.
 
 
         """
         embedded = self.embedding(input)
-        # embedded: [batch_size x 1 x hidden_size]
-        output = embedded
+        # embedded: [batch_size x seq_len x hidden_size]
+        total_length = total_length or input.size(1)
+
+        if lengths is None:
+            output, hidden = self.gru(embedded, hidden)
+            # pad the outputs (along the sequence dimension)
+            if total_length > output.size(1):
+                output = nn.functional.pad(
+                    output, (0, 0, 0, total_length - output.size(1)))
+            return output, hidden
+
+        # pack the sequences - lengths are expected on the CPU
+        packed = nn.utils.rnn.pack_padded_sequence(
+            embedded, lengths.cpu(), batch_first=True, enforce_sorted=False)
+
+        output, hidden = self.gru(packed, hidden)
 
-        output, hidden = self.gru(output, hidden)
+        output, _ = nn.utils.rnn.pad_packed_sequence(
+            output, batch_first=True, total_length=total_length)
 
         return output, hidden
 
@@ -44,6 +44,7 @@
     See https://pytorch.org/tutorials/intermediate/seq2seq_translation_tutorial.html """
 __author__ = "Vincent Marois "
 
+import math
 import torch
 import random
 
@@ -73,6 +74,9 @@ class SimpleEncoderDecoder(SequentialModel):
             - input_voc_size: should correspond to the length of the vocabulary set of the input language
             - hidden size: size of the embedding & hidden states vectors.
             - output_voc_size: should correspond to the length of the vocabulary set of the output language
+            - beam_width: number of hypotheses kept by the beam search used in evaluation (DEFAULT: 1, i.e. greedy)
+            - length_penalty: exponent of the length penalty ((5 + length) / 6) ** length_penalty the final scores of \
+            the hypotheses are divided by (DEFAULT: 0.0, i.e. no penalty)
 
         """
         # call base constructor
@@ -106,6 +110,10 @@ class SimpleEncoderDecoder(SequentialModel):
             max_length=self.max_length,
             encoder_bidirectional=self.encoder_bidirectional)
 
+        # parse params of the beam search (evaluation)
+        self.beam_width = params.get('beam_width', 1)
+        self.length_penalty = params.get('length_penalty', 0.0)
+
         print('EncoderDecoderRNN (with Bahdanau attention) created.\n')
 
     def plot(self, data_tuple, predictions, sample_number=0):
@@ -185,42 +193,31 @@ class SimpleEncoderDecoder(SequentialModel):
 
         # reshape tensors: from [batch_size x max_seq_length] to
         # [max_seq_length x batch_size]
-        input_tensor = inputs.transpose(0, 1)
         target_tensor = targets.transpose(0, 1)
 
         # init encoder hidden states
         encoder_hidden = self.encoder.init_hidden(batch_size)
 
-        # create placeholder for the encoder outputs -> will be passed to
-        # attention decoder
-        if self.encoder.bidirectional:
-            encoder_outputs = torch.zeros(
-                self.max_length,
-                batch_size,
-                (self.hidden_size *
-                 2)).type(
-                self.app_state.dtype)
-        else:
-            encoder_outputs = torch.zeros(
-                self.max_length,
-                batch_size,
-                (self.hidden_size *
-                 1)).type(
-                self.app_state.dtype)
-
         # create placeholder for the attention weights -> for visualization
         self.decoder_attentions = torch.zeros(
             batch_size, self.max_length, self.max_length).type(self.app_state.dtype)
 
-        # encoder manual loop
-        for ei in range(self.max_length):
-            encoder_output, encoder_hidden = self.encoder(
-                input_tensor[ei].unsqueeze(-1), encoder_hidden)
-            encoder_outputs[ei] = encoder_output.squeeze()
+        # lengths of the input sentences (up to EOS token, inclusive)
+        input_lengths = (inputs != PAD_token).sum(dim=1)
+
+        # run the encoder over whole (packed) input sequences at once - encoder outputs
+        # are padded to max_length: [batch_size, max_length, hidden_size * n_directions]
+        encoder_outputs, encoder_hidden = self.encoder(
+            inputs, encoder_hidden, input_lengths, self.max_length)
+
+        # project encoder outputs for the attention once per batch
+        encoder_projections = self.decoder.project_encoder_outputs(
+            encoder_outputs)
 
-        # reshape encoder_outputs to be batch_size first: [max_length,
-        # batch_size, *] -> [batch_size, max_length, *]
-        encoder_outputs = encoder_outputs.transpose(0, 1)
+        # Without teacher forcing: beam search over the model's own predictions
+        if not self.training:
+            return self.beam_search(
+                encoder_outputs, encoder_projections, encoder_hidden)
 
         # decoder input : [batch_size x 1] initialized to the value of Start Of
         # String token
@@ -231,55 +228,150 @@ class SimpleEncoderDecoder(SequentialModel):
         # encoder.n_directions) x batch_size x hidden_size]]
         decoder_hidden = encoder_hidden
 
-        # create placeholder for the decoder outputs -> will be the logits
-        decoder_outputs = torch.zeros(
-            self.max_length,
-            batch_size,
-            self.output_voc_size).type(
-            self.app_state.dtype)
+        # container for the decoder outputs -> will be the logits
+        decoder_outputs = []
 
-        if self.training:  # Teacher forcing: Feed the target as the next input
-            for di in range(self.max_length):
-                # base decoder
-                #decoder_output, decoder_hidden = self.decoder(decoder_input, decoder_hidden)
+        # Teacher forcing: Feed the target as the next input (batches can be
+        # padded to less than max_length)
+        for di in range(target_tensor.size(0)):
+            # base decoder
+            #decoder_output, decoder_hidden = self.decoder(decoder_input, decoder_hidden)
 
-                # attention decoder
-                decoder_output, decoder_hidden, decoder_attention = self.decoder(
-                    decoder_input, decoder_hidden, encoder_outputs)
+            # attention decoder
+            decoder_output, decoder_hidden, decoder_attention = self.decoder(
+                decoder_input, decoder_hidden, encoder_outputs, encoder_projections)
 
-                decoder_outputs[di] = decoder_output.squeeze()
+            decoder_outputs += [decoder_output.squeeze(1)]
 
-                # Teacher forcing
-                decoder_input = target_tensor[di].unsqueeze(-1)
+            # Teacher forcing
+            decoder_input = target_tensor[di].unsqueeze(-1)
 
-        else:
-            # Without teacher forcing: use its own predictions as the next
-            # input
-            for di in range(self.max_length):
-                # base decoder
-                #decoder_output, decoder_hidden = self.decoder(decoder_input, decoder_hidden)
+        # stack the decoder outputs: [batch_size x target_length x output_voc_size]
+        return torch.stack(decoder_outputs, dim=1)
 
-                # attention decoder
-                decoder_output, decoder_hidden, decoder_attention = self.decoder(
-                    decoder_input, decoder_hidden, encoder_outputs)
-                decoder_outputs[di] = decoder_output.squeeze()
-
-                # save attention weights
-                self.decoder_attentions[:, di, :] = decoder_attention.squeeze()
+    def beam_search(self, encoder_outputs, encoder_projections, encoder_hidden):
+        """
+        Batched beam search decoding. All hypotheses (beam_width per sample) are
+        decoded as one batch, reordered with index_select at every step. A
+        finished hypothesis (which emitted EOS) is extended with PAD at no cost,
+        and decoding stops as soon as all hypotheses are finished.
 
-                # get most probable word as input of decoder for next iteration
-                topv, topi = decoder_output.topk(k=1, dim=-1)
+        The best hypothesis of every sample is chosen with scores divided by the
+        length penalty.
 
-                # detach from history as input
-                decoder_input = topi.view(batch_size, 1).detach()
+        :param encoder_outputs: encoder outputs [batch_size x max_length x (hidden_size * n_directions)]
+        :param encoder_projections: encoder outputs projected for the attention [batch_size x max_length x hidden_size]
+        :param encoder_hidden: final encoder hidden states [(n_layers * n_directions) x batch_size x hidden_size]
 
-                # TODO: The line below would stop inference when the next predicted word is the EOS token. This if
-                # statement works for batch_size = 1, but how to generalize it to any size?
-                # if decoder_input.item() == EOS_token:
-                #    break
+        :return: decoder outputs of the best hypotheses [batch_size x max_length x output_voc_size]: at every step,
+        the probabilities of the decoded token and of the most probable one are swapped, so the argmax of the
+        outputs is the decoded hypothesis. Steps after EOS contain a distribution favoring PAD token.
 
-        return decoder_outputs.transpose(0, 1)
+        """
+        batch_size = encoder_outputs.size(0)
+        beam_width = self.beam_width
+        voc_size = self.output_voc_size
+        dtype = self.app_state.dtype
+
+        # index of the sample of each hypothesis [batch_size * beam_width]
+        samples = torch.arange(batch_size).type(self.app_state.LongTensor)
+        offsets = samples * beam_width
+        samples = samples.view(-1, 1).expand(
+            batch_size, beam_width).contiguous().view(-1)
+
+        # replicate encoder results for every hypothesis
+        encoder_outputs = encoder_outputs.index_select(0, samples)
+        encoder_projections = encoder_projections.index_select(0, samples)
+        decoder_hidden = encoder_hidden.index_select(1, samples)
+
+        decoder_input = torch.ones(batch_size * beam_width, 1).type(
+            self.app_state.LongTensor) * SOS_token
 
+        # only the first hypothesis of every sample is active at the beginning
+        scores = torch.zeros(batch_size, beam_width).type(dtype)
+        scores[:, 1:] = float('-inf')
+        scores = scores.view(-1)
+        lengths = torch.zeros(batch_size * beam_width).type(dtype)
+        finished = torch.zeros(
+            batch_size * beam_width, dtype=torch.bool, device=scores.device)
+
+        # finished hypotheses can be extended with PAD token only
+        pad_log_probs = torch.full((1, voc_size), float('-inf')).type(dtype)
+        pad_log_probs[0, PAD_token] = 0
+
+        # per step: decoder outputs, attention weights, finished flags of the
+        # decoded hypotheses, parents and tokens of the selected hypotheses
+        step_outputs, step_attentions, step_finished, step_parents, step_tokens = \
+            [], [], [], [], []
+
+        for di in range(self.max_length):
+            decoder_output, decoder_hidden, decoder_attention = self.decoder(
+                decoder_input, decoder_hidden, encoder_outputs, encoder_projections)
+            log_probs = decoder_output.squeeze(1)
+
+            step_outputs += [log_probs]
+            step_attentions += [decoder_attention.squeeze(1)]
+            step_finished += [finished]
+
+            # scores of all extensions of all hypotheses
+            log_probs = torch.where(finished.unsqueeze(1), pad_log_probs, log_probs)
+            candidates = (scores.unsqueeze(1) + log_probs).view(
+                batch_size, beam_width * voc_size)
+
+            # select the best extensions of every sample
+            scores, indices = candidates.topk(k=beam_width, dim=-1)
+            scores = scores.view(-1)
+            parents = (offsets.unsqueeze(1) + indices // voc_size).view(-1)
+            tokens = (indices % voc_size).view(-1)
+            step_parents += [parents]
+            step_tokens += [tokens]
+
+            # reorder the states of the hypotheses
+            lengths = lengths.index_select(0, parents) + \
+                (~finished).index_select(0, parents).type(dtype)
+            finished = finished.index_select(0, parents) | (tokens == EOS_token)
+            decoder_hidden = decoder_hidden.index_select(1, parents)
+            decoder_input = tokens.view(-1, 1).detach()
+
+            # early exit
+            if finished.all():
+                break
+
+        # select the best hypotheses, with scores normalized by length penalty
+        penalties = ((5.0 + lengths) / 6.0) ** self.length_penalty
+        _, best = (scores / penalties).view(batch_size, beam_width).max(dim=-1)
+        hypotheses = offsets + best
+
+        # steps after the end of the sentence get a distribution favoring PAD
+        filler = torch.full((1, voc_size), -math.log(voc_size + 1)).type(dtype)
+        filler[0, PAD_token] = math.log(2.0 / (voc_size + 1))
+
+        # backtrack the best hypotheses
+        decoder_outputs, decoder_attentions = [], []
+        for di in reversed(range(len(step_parents))):
+            tokens = step_tokens[di].index_select(0, hypotheses).view(-1, 1)
+            hypotheses = step_parents[di].index_select(0, hypotheses)
+            done = step_finished[di].index_select(0, hypotheses).unsqueeze(1)
+
+            # make the decoded token the most probable one
+            outputs = step_outputs[di].index_select(0, hypotheses)
+            top_log_probs, top_tokens = outputs.max(dim=-1, keepdim=True)
+            outputs = outputs.scatter(1, top_tokens, outputs.gather(1, tokens)) \
+                .scatter(1, tokens, top_log_probs)
+
+            decoder_outputs.insert(0, torch.where(done, filler, outputs))
+            decoder_attentions.insert(
+                0, step_attentions[di].index_select(0, hypotheses))
+
+        # save attention weights
+        self.decoder_attentions[:, :len(decoder_attentions), :] = \
+            torch.stack(decoder_attentions, dim=1)
+
+        # pad the outputs after early exit
+        decoder_outputs += [filler.expand(batch_size, voc_size)] * \
+            (self.max_length - len(decoder_outputs))
+
+        return torch.stack(decoder_outputs, dim=1)
 
 if __name__ == '__main__':
     # import lines for problem class
@@ -1,5 +1,6 @@
 from .thalnet_cell import ThalNetCell
+from .batched_thalnet_cell import BatchedThalNetCell
 from .thalnet_model import ThalNetModel
 from .thalnet_module import ThalnetModule
 
-__all__ = ['ThalNetCell', 'ThalNetModel', 'ThalnetModule']
+__all__ = ['ThalNetCell', 'BatchedThalNetCell', 'ThalNetModel', 'ThalnetModule']
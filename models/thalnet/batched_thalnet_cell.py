@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""batched_thalnet_cell: The cell of the ThalNet modules, executing all modules at once with stacked weights"""
+
+import torch
+from torch import nn
+import collections
+from utils.app_state import AppState
+
+from models.controllers.ffgru_controller import FFGRUStateTuple
+from models.thalnet.thalnet_cell import ThalNetCell
+
+_BatchedThalNetStateTuple = collections.namedtuple(
+    'BatchedThalNetStateTuple', ('center', 'hidden_state'))
+
+
+class BatchedThalNetStateTuple(_BatchedThalNetStateTuple):
+    """
+    Tuple used by BatchedThalNetCell for storing current/past state information:
+    concatenated centers [batch_size, center_size] and stacked (padded) hidden
+    states of module controllers [num_modules, batch_size, hidden_size].
+    """
+    __slots__ = ()
+
+
+class BatchedThalNetCell(nn.Module):
+    """
+    Implementation of the ThalNetCell running all modules as one grouped
+    computation.
+
+    Weights of the modules (context reading, FF-GRU controllers) are stacked
+    along the first dimension and applied with batched matrix multiplications.
+    As modules differ in the input size (only the first module reads the
+    input) and hidden size (only the last module produces the output),
+    weights are zero-padded: the real weights of a module occupy the trailing
+    rows/columns and the padding is kept at zero by constant masks. The
+    padded hidden units stay at zero, so the cell is numerically equivalent
+    to ThalNetCell.
+
+    Checkpoints of ThalNetCell (per-module weights) are converted when loaded.
+    """
+
+    def __init__(self,
+                 input_size,
+                 output_size,
+                 context_input_size,
+                 center_size_per_module,
+                 num_modules):
+        """
+        Constructor of BatchedThalNetCell class.
+
+        :param input_size: input size
+        :param output_size: output size
+        :param context_input_size: context input size
+        :param center_size_per_module:  center size per module
+        :param num_modules: number of modules
+
+        """
+        # Call base class inits here.
+        super(BatchedThalNetCell, self).__init__()
+
+        self.context_input_size = context_input_size
+        self.input_size = input_size
+        self.output_size = output_size
+        self.center_size = num_modules * center_size_per_module
+        self.center_size_per_module = center_size_per_module
+        self.num_modules = num_modules
+
+        # Input sizes (of the FF layer) and hidden sizes of the modules - only
+        # the first module reads the input, only the last one produces output.
+        self.module_input_sizes = [
+            (self.input_size if i == 0 else 0) + self.context_input_size
+            for i in range(self.num_modules)]
+        self.module_hidden_sizes = [
+            (self.output_size if 0 < i == self.num_modules - 1 else 0) +
+            self.center_size_per_module for i in range(self.num_modules)]
+        self.ff_input_size = max(self.module_input_sizes)
+        self.hidden_size = max(self.module_hidden_sizes)
+
+        M, C, X = self.num_modules, self.center_size, self.context_input_size
+        F, I, H = self.center_size_per_module, self.ff_input_size, self.hidden_size
+
+        # Reading mechanism (weight-normalized linear layers).
+        self.context_weight_g = nn.Parameter(torch.Tensor(M, X, 1))
+        self.context_weight_v = nn.Parameter(torch.Tensor(M, X, C))
+        self.context_bias = nn.Parameter(torch.Tensor(M, X))
+
+        # FF layers of the controllers.
+        self.ff_weight = nn.Parameter(torch.Tensor(M, F, I))
+        self.ff_bias = nn.Parameter(torch.Tensor(M, F))
+
+        # GRU cells of the controllers (gates: reset, update, new).
+        self.gru_weight_ih = nn.Parameter(torch.Tensor(M, 3, H, F))
+        self.gru_weight_hh = nn.Parameter(torch.Tensor(M, 3, H, H))
+        self.gru_bias_ih = nn.Parameter(torch.Tensor(M, 3, H))
+        self.gru_bias_hh = nn.Parameter(torch.Tensor(M, 3, H))
+
+        # Masks keeping the padding at zero.
+        ff_mask = torch.zeros(M, 1, I)
+        hidden_mask = torch.zeros(M, 1, H)
+        for i in range(M):
+            ff_mask[i, :, I - self.module_input_sizes[i]:] = 1
+            hidden_mask[i, :, H - self.module_hidden_sizes[i]:] = 1
+        self.register_buffer('ff_mask', ff_mask)
+        self.register_buffer('hidden_mask', hidden_mask)
+
+        # Initialize the weights exactly as the modules of ThalNetCell are.
+        self.load_state_dict(ThalNetCell(
+            input_size, output_size, context_input_size,
+            center_size_per_module, num_modules).state_dict())
+
+    def init_state(self, batch_size):
+        """
+        Initialize the state of ThalNet.
+
+        :param batch_size: batch size
+        :return: states of the ThalNet cell (BatchedThalNetStateTuple)
+
+        """
+        dtype = AppState().dtype
+
+        # center state initialisation - drawn module by module (as in
+        # ThalNetCell, same initial state for the same seed)
+        center = torch.cat(
+            [torch.randn((batch_size, self.center_size_per_module))
+             for _ in range(self.num_modules)], dim=1).type(dtype)
+
+        # module state initialisation
+        hidden_state = torch.zeros(
+            (self.num_modules, batch_size, self.hidden_size)).type(dtype)
+
+        return BatchedThalNetStateTuple(center, hidden_state)
+
+    def forward(self, inputs, prev_state):
+        """
+        forward run of the BatchedThalNetCell.
+
+        :param inputs: input at time t [batch_size, input_size]
+        :param prev_state: previous state (BatchedThalNetStateTuple)
+        :return: ouput: prediction [batch_size, output_size]
+        :return: states: states (BatchedThalNetStateTuple)
+
+        """
+        if len(inputs.size()) == 3:
+            # inputs_size : [batch_size, num_channel, input_size]
+            # select channel
+            inputs = inputs[:, 0, :]
+        batch_size = inputs.size(0)
+        (prev_center, prev_hidden_MxBxH) = prev_state
+
+        # Read the context of all modules [num_modules, batch_size, context_size].
+        context_weight = self.context_weight_g * self.context_weight_v / \
+            self.context_weight_v.norm(dim=2, keepdim=True)
+        context_MxBxX = torch.matmul(
+            prev_center, context_weight.transpose(1, 2)) + \
+            self.context_bias.unsqueeze(1)
+
+        # Concatenate inputs (used by the first module only) with the context.
+        if self.input_size:
+            context_MxBxX = torch.cat(
+                (inputs.unsqueeze(0).expand(self.num_modules, batch_size, self.input_size),
+                 context_MxBxX), dim=2)
+
+        # FF layers of the controllers.
+        ff_MxBxF = torch.baddbmm(
+            self.ff_bias.unsqueeze(1), context_MxBxX,
+            (self.ff_weight * self.ff_mask).transpose(1, 2))
+
+        # GRU cells of the controllers.
+        H = self.hidden_size
+        weight_ih = (self.gru_weight_ih * self.hidden_mask.unsqueeze(-1)
+                     ).view(self.num_modules, 3 * H, -1)
+        weight_hh = (self.gru_weight_hh * self.hidden_mask.unsqueeze(-1) *
+                     self.hidden_mask.unsqueeze(-2)).view(self.num_modules, 3 * H, H)
+        bias_ih = (self.gru_bias_ih * self.hidden_mask).view(self.num_modules, 1, 3 * H)
+        bias_hh = (self.gru_bias_hh * self.hidden_mask).view(self.num_modules, 1, 3 * H)
+
+        gates_i = torch.baddbmm(bias_ih, ff_MxBxF, weight_ih.transpose(1, 2))
+        gates_h = torch.baddbmm(bias_hh, prev_hidden_MxBxH, weight_hh.transpose(1, 2))
+        (i_r, i_z, i_n) = gates_i.chunk(3, dim=2)
+        (h_r, h_z, h_n) = gates_h.chunk(3, dim=2)
+        reset = torch.sigmoid(i_r + h_r)
+        update = torch.sigmoid(i_z + h_z)
+        new = torch.tanh(i_n + reset * h_n)
+        hidden_MxBxH = (1 - update) * new + update * prev_hidden_MxBxH
+
+        # Center features are the trailing units of all modules.
+        center = hidden_MxBxH[:, :, H - self.center_size_per_module:] \
+            .transpose(0, 1).contiguous().view(batch_size, self.center_size)
+
+        # Output is produced by the last module.
+        output = hidden_MxBxH[-1, :, H - self.module_hidden_sizes[-1]:
+                              H - self.center_size_per_module] \
+            if self.output_size and self.num_modules > 1 else None
+
+        return output, BatchedThalNetStateTuple(center, hidden_MxBxH)
+
+    def unbatch_state(self, state):
+        """
+        Converts the state into the ThalNetCell layout, i.e. list of
+        (center_state_per_module, FFGRUStateTuple) tuples.
+
+        :param state: BatchedThalNetStateTuple.
+        :return: List of module states.
+
+        """
+        (center, hidden_MxBxH) = state
+        centers = center.chunk(self.num_modules, dim=1)
+        return [(centers[i], FFGRUStateTuple(
+            hidden_MxBxH[i, :, self.hidden_size - self.module_hidden_sizes[i]:]))
+            for i in range(self.num_modules)]
+
+    def batch_state(self, states):
+        """
+        Converts the state of ThalNetCell (list of module states) into
+        BatchedThalNetStateTuple.
+
+        :param states: List of (center_state_per_module, FFGRUStateTuple) tuples.
+        :return: BatchedThalNetStateTuple.
+
+        """
+        center = torch.cat([center for (center, _) in states], dim=1)
+        hidden_MxBxH = center.new_zeros(
+            (self.num_modules, center.size(0), self.hidden_size))
+        for i, (_, ctrl_state) in enumerate(states):
+            hidden_MxBxH[i, :, self.hidden_size - self.module_hidden_sizes[i]:] = \
+                ctrl_state.hidden_state
+        return BatchedThalNetStateTuple(center, hidden_MxBxH)
+
+    def convert_state_dict(self, state_dict, prefix=''):
+        """
+        Converts (in place) the weights of ThalNetCell modules
+        ('modules_thalnet.<i>.*') into the stacked layout.
+
+        :param state_dict: State dictionary (e.g. loaded from a checkpoint).
+        :param prefix: Prefix of the cell parameters in the dictionary.
+        :return: The converted dictionary.
+
+        """
+        M, I, H = self.num_modules, self.ff_input_size, self.hidden_size
+
+        def pop(i, name):
+            return state_dict.pop('{}modules_thalnet.{}.{}'.format(prefix, i, name))
+
+        reference = state_dict['{}modules_thalnet.0.fc_context.weight_v'.format(prefix)]
+        ff_weight = reference.new_zeros(self.ff_weight.shape)
+        ff_bias = reference.new_zeros(self.ff_bias.shape)
+        gru_weight_ih = reference.new_zeros(self.gru_weight_ih.shape)
+        gru_weight_hh = reference.new_zeros(self.gru_weight_hh.shape)
+        gru_bias_ih = reference.new_zeros(self.gru_bias_ih.shape)
+        gru_bias_hh = reference.new_zeros(self.gru_bias_hh.shape)
+        context_weight_g, context_weight_v, context_bias = [], [], []
+
+        for i in range(M):
+            context_weight_g.append(pop(i, 'fc_context.weight_g'))
+            context_weight_v.append(pop(i, 'fc_context.weight_v'))
+            context_bias.append(pop(i, 'fc_context.bias'))
+
+            start = I - self.module_input_sizes[i]
+            ff_weight[i, :, start:] = pop(i, 'controller.ff.weight')
+            ff_bias[i] = pop(i, 'controller.ff.bias')
+
+            start = H - self.module_hidden_sizes[i]
+            size = self.module_hidden_sizes[i]
+            gru_weight_ih[i, :, start:] = pop(i, 'controller.gru.weight_ih').view(3, size, -1)
+            gru_weight_hh[i, :, start:, start:] = pop(i, 'controller.gru.weight_hh').view(3, size, size)
+            gru_bias_ih[i, :, start:] = pop(i, 'controller.gru.bias_ih').view(3, size)
+            gru_bias_hh[i, :, start:] = pop(i, 'controller.gru.bias_hh').view(3, size)
+
+        state_dict[prefix + 'context_weight_g'] = torch.stack(context_weight_g)
+        state_dict[prefix + 'context_weight_v'] = torch.stack(context_weight_v)
+        state_dict[prefix + 'context_bias'] = torch.stack(context_bias)
+        state_dict[prefix + 'ff_weight'] = ff_weight
+        state_dict[prefix + 'ff_bias'] = ff_bias
+        state_dict[prefix + 'gru_weight_ih'] = gru_weight_ih
+        state_dict[prefix + 'gru_weight_hh'] = gru_weight_hh
+        state_dict[prefix + 'gru_bias_ih'] = gru_bias_ih
+        state_dict[prefix + 'gru_bias_hh'] = gru_bias_hh
+        state_dict[prefix + 'ff_mask'] = self.ff_mask.clone()
+        state_dict[prefix + 'hidden_mask'] = self.hidden_mask.clone()
+        return state_dict
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Convert checkpoints of ThalNetCell on the fly.
+        if '{}modules_thalnet.0.fc_context.weight_v'.format(prefix) in state_dict:
+            self.convert_state_dict(state_dict, prefix)
+        super(BatchedThalNetCell, self)._load_from_state_dict(
+            state_dict, prefix, *args, **kwargs)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import torch
+from models.thalnet.thalnet_cell import ThalNetCell
+from models.thalnet.batched_thalnet_cell import BatchedThalNetCell
+# Tests for BatchedThalNetCell (run from the root directory:
+# python -m models.thalnet.batched_thalnet_cell_test)
+input_size, output_size, context_size, center_size_per_module, num_modules = \
+    28, 10, 32, 16, 4
+batch_size, seq_length = 3, 5
+
+cell = ThalNetCell(input_size, output_size, context_size,
+                   center_size_per_module, num_modules)
+batched_cell = BatchedThalNetCell(input_size, output_size, context_size,
+                                  center_size_per_module, num_modules)
+
+# Weights of ThalNetCell (checkpoint) are converted when loaded.
+batched_cell.load_state_dict(cell.state_dict())
+
+# Both cells must produce the same outputs and states.
+state = cell.init_state(batch_size)
+batched_state = batched_cell.batch_state(state)
+inputs = torch.randn(batch_size, seq_length, input_size)
+for t in range(seq_length):
+    output, state = cell(inputs[:, t], state)
+    batched_output, batched_state = batched_cell(inputs[:, t], batched_state)
+    print(output)
+    print(batched_output)
+    assert torch.allclose(output, batched_output, atol=1e-6)
+    for (center, ctrl_state), (batched_center, batched_ctrl_state) in zip(
+            state, batched_cell.unbatch_state(batched_state)):
+        assert torch.allclose(center, batched_center, atol=1e-6)
+        assert torch.allclose(ctrl_state.hidden_state,
+                              batched_ctrl_state.hidden_state, atol=1e-6)
+
+# Gradients of the padding stay at zero.
+batched_output.sum().backward()
+assert (batched_cell.ff_weight.grad * (1 - batched_cell.ff_mask) == 0).all()
+assert (batched_cell.gru_bias_hh.grad * (1 - batched_cell.hidden_mask) == 0).all()
+
+# Same initial states for the same seed.
+torch.manual_seed(1)
+state = batched_cell.batch_state(cell.init_state(batch_size))
+torch.manual_seed(1)
+batched_state = batched_cell.init_state(batch_size)
+for tensor, batched_tensor in zip(state, batched_state):
+    assert torch.equal(tensor, batched_tensor)
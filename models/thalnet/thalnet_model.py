@@ -25,6 +25,7 @@ import numpy as np
 
 from models.sequential_model import SequentialModel
 from models.thalnet.thalnet_cell import ThalNetCell
+from models.thalnet.batched_thalnet_cell import BatchedThalNetCell
 
 
 class ThalNetModel(SequentialModel):
@@ -52,12 +53,15 @@ class ThalNetModel(SequentialModel):
         self.center_size_per_module = params['center_size_per_module']
         self.num_modules = params['num_modules']
         self.output_center_size = self.output_size + self.center_size_per_module
+        # Run all modules at once, with stacked weights.
+        self.batched_modules = params.get('batched_modules', False)
 
         # This is for the time plot
         self.cell_state_history = None
 
         # Create the DWM components
-        self.ThalnetCell = ThalNetCell(
+        cell_class = BatchedThalNetCell if self.batched_modules else ThalNetCell
+        self.ThalnetCell = cell_class(
             self.input_size,
             self.output_size,
             self.context_input_size,
@@ -75,40 +79,52 @@ class ThalNetModel(SequentialModel):
         """
         (inputs, _) = data_tuple
 
-        if self.app_state.visualize:
-            self.cell_state_history = []
-
-        output = None
-        batch_size = inputs.size(0)
-        seq_length = inputs.size(-2)
-
         # init state
-        cell_state = self.ThalnetCell.init_state(batch_size)
-        for j in range(seq_length):
-            output_cell, cell_state = self.ThalnetCell(
-                inputs[..., j, :], cell_state)
-
-            if output_cell is None:
-                continue
-
-            output_cell = output_cell[..., None, :]
-            if output is None:
-                output = output_cell
-
-            # concatenate output
-            else:
-                output = torch.cat([output, output_cell], dim=-2)
-
-            # This is for the time plot
-            if self.app_state.visualize:
-                self.cell_state_history.append(
-                    [cell_state[i][0].detach().numpy()
-                     for i in range(self.num_modules)] +
-                    [cell_state[i][1].hidden_state.detach().numpy()
-                     for i in range(self.num_modules)])
+        cell_state = self.init_cell_state(inputs)
+
+        output, _ = self.forward_window(inputs, cell_state)
 
         return output
 
+    def init_cell_state(self, inputs):
+        """
+        Returns the initial cell state for the given input sequences.
+
+        :param inputs: input sequences [batch_size, sequence_length, input_size]
+        :returns: Initial ThalNet cell state.
+
+        """
+        return self.ThalnetCell.init_state(inputs.size(0))
+
+    def forward_window(self, inputs, cell_state):
+        """
+        Runs the ThalNet cell over (a window of) the input sequences.
+
+        :param inputs: input sequences [batch_size, window_length, input_size]
+        :param cell_state: ThalNet cell state at the beginning of the window.
+        :returns: Tuple (output [batch_size, window_length, output_size], cell state at the end of the window).
+
+        """
+        return self.recurrent_forward(
+            self.ThalnetCell, inputs, cell_state,
+            record_state=self.record_cell_state)
+
+    def record_cell_state(self, cell_state):
+        """
+        Converts the cell state into an entry of the cell state history (for
+        the time plot).
+
+        :param cell_state: ThalNet cell state.
+        :returns: List of numpy arrays (module centers followed by module hidden states).
+
+        """
+        if self.batched_modules:
+            cell_state = self.ThalnetCell.unbatch_state(cell_state)
+        return [cell_state[i][0].detach().numpy()
+                for i in range(self.num_modules)] + \
+            [cell_state[i][1].hidden_state.detach().numpy()
+             for i in range(self.num_modules)]
+
     def generate_figure_layout(self):
         from matplotlib.figure import Figure
         import matplotlib.ticker as ticker
@@ -1,6 +1,7 @@
 from .clevr import CLEVR
 from .clevr_dataset import CLEVRDataset
 from .generate_feature_maps import GenerateFeatureMaps
+from .image_grouped_batch_sampler import ImageGroupedBatchSampler
 from .image_text_to_class_problem import ImageTextTuple, SceneDescriptionTuple, ObjectRepresentation, \
     ImageTextToClassProblem
 from .sort_of_clevr import SortOfCLEVR
@@ -10,6 +11,7 @@ __all__ = [
     'CLEVR',
     'CLEVRDataset',
     'GenerateFeatureMaps',
+    'ImageGroupedBatchSampler',
     'ImageTextTuple',
     'SceneDescriptionTuple',
     'ObjectRepresentation',
@@ -50,12 +50,22 @@ import matplotlib.pyplot as plt
 from torch.utils.data import DataLoader
 from torch.utils.data.sampler import RandomSampler
 import torch
-import csv
+import os
+import numpy as np
 
 from problems.problem import DataTuple
 
 from problems.image_text_to_class.image_text_to_class_problem import ImageTextToClassProblem, ImageTextTuple
 from problems.image_text_to_class.clevr_dataset import CLEVRDataset
+from problems.image_text_to_class.image_grouped_batch_sampler import ImageGroupedBatchSampler
+from utils.statistics_collector import AccuracyPerCategoryCollector
+
+import logging
+logger = logging.getLogger('CLEVR')
+
+# Sets of CLEVR & CLEVR-CoGenT - their index identifies the set in the images
+# keys.
+CLEVR_SETS = ['train', 'val', 'test', 'trainA', 'valA', 'valB', 'testA', 'testB']
 
 
 class CLEVR(ImageTextToClassProblem):
@@ -85,6 +95,29 @@ class CLEVR(ImageTextToClassProblem):
         self.clevr_humans = params['clevr_humans']
         self.embedding_type = params['embedding_type']
         self.random_embedding_dim = params['random_embedding_dim']
+        self.precomputed_embeddings = params.get('precomputed_embeddings', False)
+        # Feature maps: read from a memory-mapped .npy file, number of images
+        # cached (per worker).
+        self.feature_maps_memmap = params.get('feature_maps_memmap', False)
+        self.feature_maps_cache_size = params.get('feature_maps_cache_size', 0)
+        # Storage type of the feature maps: 'float32', 'float16' or 'uint8'.
+        self.feature_maps_dtype = params.get('feature_maps_dtype', 'float32')
+        # Extraction of the feature maps (if not found on disk), e.g.
+        # {num_workers: 8, num_threads: 4, channels_last: True} on CPU.
+        self.feature_maps_extraction = params.get('feature_maps_extraction', {})
+
+        # Data loading: number of worker processes (0: batches assembled in
+        # the main process), number of batches prefetched by each worker,
+        # use of page-locked memory (faster copies to GPU).
+        self.num_workers = params.get('num_workers', 0)
+        self.prefetch_factor = params.get('prefetch_factor', 2)
+        self.pin_memory = params.get('pin_memory', False)
+        # Seed of the shuffling (DEFAULT: derived from the torch seed).
+        self.seed = params.get('seed', None)
+        # Batches made of groups of (up to max_questions_per_image) questions
+        # about the same image - fewer feature maps read per batch.
+        self.group_by_image = params.get('group_by_image', False)
+        self.max_questions_per_image = params.get('max_questions_per_image', 4)
 
         # instantiate CLEVRDataset class
         self.clevr_dataset = CLEVRDataset(
@@ -92,25 +125,46 @@ class CLEVR(ImageTextToClassProblem):
             self.clevr_dir,
             self.clevr_humans,
             self.embedding_type,
-            self.random_embedding_dim)
-
-        # to compute the accuracy per family
-        self.family_list = [
-            'query_size',
-            'equal_size',
-            'query_shape',
-            'query_color',
-            'greater_than',
-            'equal_material',
-            'equal_color',
-            'equal_shape',
-            'less_than',
-            'count',
-            'exist',
-            'equal_integer',
-            'query_material']
-        self.tuple_list = [[0, 0] for _ in range(len(self.family_list))]
-        self.dic = dict(zip(self.family_list, self.tuple_list))
+            self.random_embedding_dim,
+            self.precomputed_embeddings,
+            self.feature_maps_memmap,
+            self.feature_maps_cache_size,
+            self.feature_maps_dtype,
+            self.feature_maps_extraction)
+
+        # Persistent, epoch-aware loader - reshuffles the dataset every epoch.
+        self.generator = torch.Generator()
+        self.generator.manual_seed(
+            self.seed if self.seed is not None else torch.initial_seed())
+        if self.group_by_image:
+            batching = {'batch_sampler': ImageGroupedBatchSampler(
+                self.clevr_dataset.image_indices, self.batch_size,
+                self.max_questions_per_image, generator=self.generator)}
+        else:
+            batching = {'batch_size': self.batch_size,
+                        'sampler': RandomSampler(self.clevr_dataset, generator=self.generator)}
+        self.loader = DataLoader(
+            self.clevr_dataset,
+            collate_fn=self.clevr_dataset.collate_data,
+            num_workers=self.num_workers,
+            pin_memory=self.pin_memory,
+            worker_init_fn=self.clevr_dataset.worker_init_fn,
+            persistent_workers=self.num_workers > 0,
+            prefetch_factor=self.prefetch_factor if self.num_workers > 0 else None,
+            **batching)
+        self.batch_iterator = None
+        self.epoch = 0
+        # Number of bytes of feature maps read from file for the last batch.
+        self.bytes_read = 0
+
+        # Accuracy per question family (& per category of families) of the
+        # batches of every set, accumulated since its last export. The
+        # batches of self.set are exported every family_accuracy_interval
+        # episodes (0: never) and after the last test episode, the batches of
+        # another set (validation through the training problem) at every
+        # call.
+        self.family_accuracy_interval = params.get('family_accuracy_interval', 100)
+        self.max_test_episodes = params.get('max_test_episodes', -1)
         self.categories_transform = {
             'query_size': 'query_attribute',
             'equal_size': 'compare_attribute',
@@ -125,112 +179,137 @@ class CLEVR(ImageTextToClassProblem):
             'exist': 'exist',
             'equal_integer': 'compare_integer',
             'query_material': 'query_attribute'}
+        self.family_acc_cols = {}
 
-    def get_acc_per_family(self, data_tuple, aux_tuple, logits):
+    @staticmethod
+    def images_keys(image_indices, set):
         """
-        Compute the accuracy per family for the current batch. Also accumulates
-        the # of correct predictions & questions per family in self.dic (saved
-        to file).
+        Returns the keys identifying the images across the sets: image index,
+        offset by the (small) id of the set shifted by 32 bits (images indices
+        restart from 0 in every set).
 
-        :param data_tuple: DataTuple ((images, questions), targets)
-        :param aux_tuple: (questions_strings, questions_indexes, images_filenames, question_types)
-        :param logits: network predictions.
+        :param image_indices: array of images indices.
+        :param set: Name of the set (one of CLEVR_SETS).
+        :return: tensor of keys (int64).
 
         """
+        return torch.from_numpy(np.asarray(image_indices, dtype=np.int64)) + \
+            (CLEVR_SETS.index(set) << 32)
 
-        # get correct predictions
-        pred = logits.max(1, keepdim=True)[1]
-        correct = pred.eq(data_tuple.targets.view_as(pred))
+    def family_accuracy_collector(self, set):
+        """
+        Returns the collector of the accuracy per family of the batches of a
+        set (created on first use).
 
-        # unpack aux_tuple
-        (s_questions, indexes, imgfiles, question_types) = aux_tuple
-        print('\n')
-        for i in range(correct.size(0)):
-            # update # of questions for the corresponding family
-            self.dic[question_types[i]][1] += 1
-
-            if correct[i] == 1:
-                # update the # of correct predictions for the corresponding
-                # family
-                self.dic[question_types[i]][0] += 1
-
-        for family in self.family_list:
-            if self.dic[family][1] == 0:
-                print('Family: {} - Acc: No questions!'.format(family))
-
-            else:
-                family_accuracy = (self.dic[family][0]) / (self.dic[family][1])
-                print('Family: {} - Acc: {} - Total # of questions: {}'.format(family,
-                                                                               family_accuracy, self.dic[family][1]))
-
-        categories_list = ['query_attribute', 'compare_integer',
-                           'count', 'compare_attribute', 'exist']
-        tuple_list_categories = [[0, 0] for _ in range(len(categories_list))]
-        dic_categories = dict(zip(categories_list, tuple_list_categories))
-        print('\n')
-        for category in categories_list:
-            for family in self.family_list:
-                if self.categories_transform[family] == category:
-                    dic_categories[category][0] += self.dic[family][0]
-                    dic_categories[category][1] += self.dic[family][1]
-
-        for category in categories_list:
-            if dic_categories[category][1] == 0:
-                print('Category: {} - Acc: No questions!'.format(category))
-
-            else:
-                category_accuracy = (
-                    dic_categories[category][0]) / (dic_categories[category][1])
-                print('Category: {} - Acc: {} - Total # of questions: {}'.format(
-                    category, category_accuracy, dic_categories[category][1]))
-
-        with open(self.clevr_dir + '/generated_files/families_acc.csv', 'w') as csv_file:
-            writer = csv.writer(csv_file)
-            for key, value in self.dic.items():
-                writer.writerow([key, value])
+        :param set: Name of the set.
+
+        """
+        if set not in self.family_acc_cols:
+            family_table = self.clevr_dataset.family_table
+            self.family_acc_cols[set] = AccuracyPerCategoryCollector(
+                family_table,
+                groups={family: self.categories_transform.get(family, family)
+                        for family in family_table})
+        return self.family_acc_cols[set]
+
+    def export_family_accuracy(self, set, episode):
+        """
+        Logs the accuracy per family & per category of families of a set
+        accumulated since the last export, appends it to the
+        <set>_families_acc.csv file and resets the counters.
+
+        :param set: Name of the set.
+        :param episode: Episode number.
+
+        """
+        family_acc_col = self.family_accuracy_collector(set)
+        logger.info(family_acc_col.export_to_string(
+            '[Families {:06d} {}]'.format(episode, set)))
+        family_acc_col.export_to_csv(os.path.join(
+            self.clevr_dir, 'generated_files', '{}_families_acc.csv'.format(set)), episode)
+        family_acc_col.reset()
+
+    def add_statistics(self, stat_col):
+        """
+        Add accuracy & number of bytes of feature maps read per batch to
+        collector.
+
+        :param stat_col: Statistics collector.
+
+        """
+        super(CLEVR, self).add_statistics(stat_col)
+        stat_col.add_statistic('bytes_read', '{:d}')
 
     def collect_statistics(self, stat_col, data_tuple, logits, aux_tuple):
         """
-        Collects accuracy.
+        Collects accuracy & number of bytes of feature maps read for the batch.
 
         :param stat_col: Statistics collector.
         :param data_tuple: Data tuple containing inputs and targets.
         :param logits: Logits being output of the model.
-        :param _: auxiliary tuple (aux_tuple) is not used in this function.
+        :param aux_tuple: auxiliary tuple (families ids & set of the batch used for the accuracy per family).
 
         """
         stat_col['acc'] = self.calculate_accuracy(
             data_tuple, logits, aux_tuple)
+        stat_col['bytes_read'] = self.bytes_read
 
-        self.get_acc_per_family(data_tuple, aux_tuple, logits)
+        # accumulate the correct predictions per family (on the device of the
+        # logits), separately for every set
+        (s_questions, indexes, imgfiles, question_types, families, batch_set) = aux_tuple
+        correct = logits.argmax(dim=-1).eq(data_tuple.targets)
+        self.family_accuracy_collector(batch_set).add(families, correct)
+
+        episode = stat_col['episode']
+        if batch_set != self.set \
+                or (self.family_accuracy_interval > 0 and episode % self.family_accuracy_interval == 0) \
+                or episode + 1 == self.max_test_episodes:
+            self.export_family_accuracy(batch_set, episode)
 
     def generate_batch(self):
         """
         Generates a batch from self.clevr_dataset.
 
-        WARNING: WE PASS THE QUESTIONS LENGTH INTO THE DATATUPLE!
+        Batches come from the persistent loader: the samples are drawn
+        without replacement, a new epoch (with a new permutation) starts when
+        the dataset is exhausted.
 
-        :return: - data_tuple: (((images, questions), questions_len), answers)
-                 - aux_tuple: (questions_strings, questions_indexes, images_filenames, question_types) (visualization)
+        WARNING: WE PASS THE QUESTIONS LENGTH & THE IMAGES KEYS INTO THE DATATUPLE!
+        The images keys (on CPU) identify the images across the sets, they allow the model to process duplicated
+        images once.
 
-        """
+        :return: - data_tuple: (((images, questions), questions_len, images_keys), answers)
+                 - aux_tuple: (questions_strings, questions_indexes, images_filenames, question_types, families_ids,
+                 set) (visualization, accuracy per family)
 
-        clevr_loader = DataLoader(
-            self.clevr_dataset,
-            batch_size=self.batch_size,
-            collate_fn=self.clevr_dataset.collate_data,
-            sampler=RandomSampler(
-                self.clevr_dataset))
-
-        images, questions, questions_len, answers, s_questions, indexes, imgfiles, question_types = next(
-            iter(clevr_loader))
+        """
+        if self.batch_iterator is None:
+            self.batch_iterator = iter(self.loader)
+        try:
+            batch = next(self.batch_iterator)
+        except StopIteration:
+            # Start a new epoch.
+            self.epoch += 1
+            self.batch_iterator = iter(self.loader)
+            batch = next(self.batch_iterator)
+
+        images, questions, questions_len, answers, s_questions, indexes, imgfiles, question_types, \
+            self.bytes_read = batch
+
+        # keys of the images: image index, offset by a set-specific value.
+        images_keys = self.images_keys(
+            self.clevr_dataset.image_indices[indexes], self.set)
 
         # create data_tuple
         image_text_tuple = ImageTextTuple(images, questions)
-        inner_data_tuple = (image_text_tuple, questions_len)
+        inner_data_tuple = (image_text_tuple, questions_len, images_keys)
         data_tuple = DataTuple(inner_data_tuple, answers)
 
-        aux_tuple = (s_questions, indexes, imgfiles, question_types)
+        # ids of the families (in the family table shared by all sets).
+        families = torch.from_numpy(
+            self.clevr_dataset.family_ids[self.clevr_dataset.families[indexes]])
+
+        aux_tuple = (s_questions, indexes, imgfiles, question_types, families, self.set)
 
         return data_tuple, aux_tuple
 
@@ -244,15 +323,16 @@ class CLEVR(ImageTextToClassProblem):
         """
         # Unpack tuples and copy data to GPU.
         inner_tuple, answers = data_tuple
-        image_questions_tuple, questions_len = inner_tuple
+        image_questions_tuple, questions_len, images_keys = inner_tuple
         images, questions = image_questions_tuple
 
-        gpu_images = images.cuda()
-        gpu_questions = questions.cuda()
-        gpu_answers = answers.cuda()
+        # Asynchronous copies when the batch is in pinned memory.
+        gpu_images = images.cuda(non_blocking=self.pin_memory)
+        gpu_questions = questions.cuda(non_blocking=self.pin_memory)
+        gpu_answers = answers.cuda(non_blocking=self.pin_memory)
 
         gpu_image_text_tuple = ImageTextTuple(gpu_images, gpu_questions)
-        gpu_inner_data_tuple = (gpu_image_text_tuple, questions_len)
+        gpu_inner_data_tuple = (gpu_image_text_tuple, questions_len, images_keys)
 
         data_tuple = DataTuple(gpu_inner_data_tuple, gpu_answers)
 
@@ -268,16 +348,10 @@ class CLEVR(ImageTextToClassProblem):
         plt.figure(1)
 
         # unpack aux_tuple
-        (s_questions, indexes, imgfiles, question_types) = aux_tuple
+        (s_questions, indexes, imgfiles, question_types, families, batch_set) = aux_tuple
 
         question = s_questions[sample_number]
-        answer = answers[sample_number]
-        answer = list(
-            self.clevr_dataset.answer_dic.keys())[
-            list(
-                self.clevr_dataset.answer_dic.values()).index(
-                answer.data)]  # dirty hack to go back from the
-        # value in a dict to the key.
+        answer = self.clevr_dataset.index_to_answer[int(data_tuple.targets[sample_number])]
         imgfile = imgfiles[sample_number]
 
         from PIL import Image
@@ -308,25 +382,17 @@ class CLEVR(ImageTextToClassProblem):
 
         # unpack data_tuple
         inner_tuple, answer = data_tuple
-        image_questions_tuple, questions_len = inner_tuple
-
-        batch_size = logits.size(0)
+        image_questions_tuple, questions_len, images_keys = inner_tuple
 
         # get index of highest probability
         logits_indexes = torch.argmax(logits, dim=-1)
 
-        prediction_string = [
-            list(self.clevr_dataset.answer_dic.keys())
-            [list(self.clevr_dataset.answer_dic.values()).index(
-                logits_indexes[batch_num].data)]
-            for batch_num in range(batch_size)]
-        answer_string = [
-            list(self.clevr_dataset.answer_dic.keys())
-            [list(self.clevr_dataset.answer_dic.values()).index(
-                answer[batch_num].data)]
-            for batch_num in range(batch_size)]
-
-        (s_questions, indexes, imgfiles, question_types) = aux_tuple
+        # decode the answers indexes
+        index_to_answer = self.clevr_dataset.index_to_answer
+        prediction_string = [index_to_answer[index] for index in logits_indexes.tolist()]
+        answer_string = [index_to_answer[index] for index in answer.tolist()]
+
+        (s_questions, indexes, imgfiles, question_types, families, batch_set) = aux_tuple
         aux_tuple = (s_questions, answer_string, imgfiles,
                      self.set, prediction_string, self.clevr_dir)
 
@@ -356,7 +422,7 @@ if __name__ == "__main__":
     # generate a batch
     data_tuple, aux_tuple = problem.generate_batch()
     inner_tuple, answers = data_tuple
-    image_questions_tuple, questions_len = inner_tuple
+    image_questions_tuple, questions_len, images_keys = inner_tuple
     images, questions = image_questions_tuple
 
     print(questions.shape)
@@ -50,8 +50,13 @@ clevr_dataset.py: This file contains 1 class:
 __author__ = "Vincent Albouy, Vincent Marois"
 
 import h5py
+import json
+import collections
+import numpy as np
 import torch
 import pickle
+import shutil
+import hashlib
 
 from torch.utils.data import Dataset
 
@@ -76,14 +81,19 @@ class CLEVRDataset(Dataset):
     """
 
     def __init__(self, set, clevr_dir, clevr_humans,
-                 embedding_type='random', random_embedding_dim=300):
+                 embedding_type='random', random_embedding_dim=300,
+                 precomputed_embeddings=False, feature_maps_memmap=False,
+                 feature_maps_cache_size=0, feature_maps_dtype='float32',
+                 extraction_params=None):
         """
         Instantiate a ClevrDataset object:
 
             - Mainly check if the files containing the extracted features & tokenized questions already exist. If not,
             it generates them for the specified sub-set.
             - self.img contains then the extracted feature maps
-            - self.data contains the tokenized questions, the associated image filenames, the answers & the question string
+            - self.tokens, self.offsets, self.answers, self.families, self.image_indices contain the (memory-mapped)
+            tokenized questions, the answers, the questions families & the associated images indices
+            - self.family_ids maps the families of self.families to the ids of self.family_table (shared by all sets)
 
         The questions are then embedded based on the specified embedding. This embedding is random by default, but
         pretrained ones are possible.
@@ -99,6 +109,22 @@ class CLEVRDataset(Dataset):
 
         :param random_embedding_dim: In the case of random embedding, this is the embedding dimension to use.
 
+        :param precomputed_embeddings: In the case of pretrained embedding, store the embeddings of the words of the
+        questions vocabulary in a (memory-mapped) float16 file, used instead of the pretrained vectors on the next runs.
+
+        :param feature_maps_memmap: Read the feature maps from a raw .npy file (memory-mapped, converted from the .hdf5
+        file if needed) instead of the .hdf5 file.
+
+        :param feature_maps_cache_size: Number of images whose feature maps are kept in a (per process) LRU cache,
+        0 disables the cache.
+
+        :param feature_maps_dtype: Storage type of the feature maps: 'float32', 'float16' or 'uint8' (quantized per
+        image & channel). The reduced precision files are converted from the float32 one, if it exists. The feature
+        maps are dequantized (to float32) per batch, in collate_data.
+
+        :param extraction_params: dict of arguments of the feature maps extraction (shard_size, num_workers,
+        num_threads, cuda, channels_last, optimize_for_inference), see generate_feature_maps.extract_feature_maps.
+
         """
         # call base constructor
         super(CLEVRDataset).__init__()
@@ -109,6 +135,13 @@ class CLEVRDataset(Dataset):
         self.clevr_humans = clevr_humans
         self.embedding_type = embedding_type
         self.random_embedding_dim = random_embedding_dim
+        self.precomputed_embeddings = precomputed_embeddings
+        self.embedding_table = None
+        self.feature_maps_memmap = feature_maps_memmap
+        self.feature_maps_cache_size = feature_maps_cache_size
+        self.feature_maps_cache = collections.OrderedDict()
+        self.feature_maps_dtype = feature_maps_dtype
+        self.extraction_params = dict(extraction_params or {})
 
         # Get access to app state.
         self.app_state = AppState()
@@ -131,41 +164,67 @@ class CLEVRDataset(Dataset):
         # For the same self.set, this file is the same for CLEVR & CLEVR-Humans
         feature_maps_filename = self.clevr_dir + \
             '/generated_files/{}_CLEVR_features.hdf5'.format(self.set)
+        if self.feature_maps_dtype != 'float32':
+            float32_filename = feature_maps_filename
+            feature_maps_filename = self.clevr_dir + \
+                '/generated_files/{}_CLEVR_features_{}.hdf5'.format(self.set, self.feature_maps_dtype)
+
         if os.path.isfile(feature_maps_filename):
             logger.info('The file {} already exists, loading it.'.format(
                 feature_maps_filename))
 
+        elif self.feature_maps_dtype != 'float32' and os.path.isfile(float32_filename):
+            logger.warning('File {} not found on disk, converting {}:'.format(
+                feature_maps_filename, float32_filename))
+            from problems.image_text_to_class.generate_feature_maps import convert_feature_maps
+            convert_feature_maps(float32_filename, feature_maps_filename,
+                                 self.feature_maps_dtype)
+
         else:
             logger.warning('File {} not found on disk, generating it:'.format(
                 feature_maps_filename))
             self.generate_feature_maps_file(feature_maps_filename)
 
-        # actually load the file
-        self.h = h5py.File(feature_maps_filename, 'r')
-        self.img = self.h['data']
-
-        # checking if the file containing the tokenized questions (& answers,
-        # image filename) exists or not
-        questions_filename = self.clevr_dir + '/generated_files/{}_{}_questions.pkl'.format(
-            self.set, 'CLEVR_Humans' if self.clevr_humans else 'CLEVR')
-        if os.path.isfile(questions_filename):
-            logger.info('The file {} already exists, loading it.'.format(
-                questions_filename))
-
-            # load questions
+        self.feature_maps_npy_filename = feature_maps_filename[:-5] + '.npy'
+        if self.feature_maps_memmap and not os.path.isfile(self.feature_maps_npy_filename):
+            logger.warning('File {} not found on disk, converting {}:'.format(
+                self.feature_maps_npy_filename, feature_maps_filename))
+            from problems.image_text_to_class.generate_feature_maps import convert_feature_maps_to_npy
+            convert_feature_maps_to_npy(
+                feature_maps_filename, self.feature_maps_npy_filename)
+
+        # The file is opened lazily, separately in every process using the
+        # dataset (h5py handles cannot be shared by the DataLoader workers).
+        self.feature_maps_filename = feature_maps_filename
+        self.h = None
+        self.img = None
+        self.img_scales = None
+        self.h_pid = None
+        self.open_feature_maps()
+
+        # checking if the folder containing the tokenized questions (& answers,
+        # image indices, families) exists or not
+        questions_dirname = self.questions_dirname(self.set)
+        questions_filename = questions_dirname + '.pkl'
+        if os.path.isdir(questions_dirname):
+            logger.info('The folder {} already exists, loading it.'.format(
+                questions_dirname))
+
+        elif os.path.isfile(questions_filename):
+            # questions tokenized by a previous version, convert them.
+            logger.warning('Converting the file {} to {}.'.format(
+                questions_filename, questions_dirname))
             with open(questions_filename, 'rb') as questions:
-                self.data = pickle.load(questions)
-
-            # load word_dics & answer_dics
+                data = pickle.load(questions)
             with open(self.clevr_dir + '/generated_files/dics.pkl', 'rb') as f:
                 dic = pickle.load(f)
-                self.answer_dic = dic['answer_dic']
-                self.word_dic = dic['word_dic']
+            self.save_questions(
+                data, dic['word_dic'], dic['answer_dic'], questions_dirname)
 
         else:
             logger.warning(
-                'File {} not found on disk, generating it.'.format(
-                    questions_filename))
+                'Folder {} not found on disk, generating it.'.format(
+                    questions_dirname))
 
             # WARNING: We need to ensure that we use the same words & answers dics for both train & val, otherwise we
             # do not have the same reference!
@@ -174,27 +233,46 @@ class CLEVRDataset(Dataset):
                 logger.warning(
                     'We need to ensure that we use the same words-to-index & answers-to-index dictionaries '
                     'for both the train & val samples.')
-                logger.warning(
-                    'First, generating the words-to-index & answers-to-index dictionaries from '
-                    'the training samples :')
-                _, self.word_dic, self.answer_dic = self.generate_questions_dics(
-                    'train' if self.set == 'val' else 'trainA', word_dic=None, answer_dic=None)
+                train_set = 'train' if self.set == 'val' else 'trainA'
+                train_dirname = self.questions_dirname(train_set)
+                if os.path.isdir(train_dirname):
+                    # reuse the dictionaries of the (already tokenized)
+                    # training samples
+                    logger.warning(
+                        'First, loading the words-to-index & answers-to-index dictionaries from '
+                        '{}:'.format(train_dirname))
+                    self.load_vocabularies(train_dirname)
+                else:
+                    logger.warning(
+                        'First, generating the words-to-index & answers-to-index dictionaries from '
+                        'the training samples :')
+                    _, self.word_dic, self.answer_dic = self.generate_questions_dics(
+                        train_set, word_dic=None, answer_dic=None)
 
                 # then tokenize the questions using the created dictionaries
                 # from the training samples
                 logger.warning(
                     'Then we can tokenize the validation questions using the dictionaries '
                     'created from the training samples')
-                self.data, self.word_dic, self.answer_dic = self.generate_questions_dics(
+                self.generate_questions_dics(
                     self.set, word_dic=self.word_dic, answer_dic=self.answer_dic)
 
             # self.set=='train', we can directly tokenize the questions
             elif self.set == 'train' or self.set == 'trainA':
-                self.data, self.word_dic, self.answer_dic = self.generate_questions_dics(
+                self.generate_questions_dics(
                     self.set, word_dic=None, answer_dic=None)
 
-        # At this point, the objects self.img & self.data contains the feature
-        # maps & questions
+        # memory-map the questions, load the vocabularies.
+        self.load_questions(questions_dirname)
+
+        # Family table shared by all sets (families of the questions of a set
+        # may be indexed differently in folders of previous versions).
+        self.family_table = self.load_family_table()
+        self.family_ids = np.array(
+            [self.family_table.index(family) for family in self.index_to_family], dtype=np.int64)
+
+        # At this point, the objects self.img & self.tokens (...) contains the
+        # feature maps & questions
 
         # creates the objects for the specified embeddings
         if self.embedding_type == 'random':
@@ -224,29 +302,250 @@ class CLEVRDataset(Dataset):
                 with open(self.clevr_dir + '/generated_files/random_embedding_weights.pkl', 'wb') as f:
                     pickle.dump(self.embed_layer.weight.data, f)
 
-        else:
-            logger.info('Constructing embeddings using {}'.format(
-                self.embedding_type))
-            # instantiate Language class
-            self.language = Language('lang')
-            self.questions = [q['string_question'] for q in self.data]
-            # use the questions set to construct the embeddings vectors
-            self.language.build_pretrained_vocab(
-                self.questions, vectors=self.embedding_type)
+            # The embeddings are not trained - this also allows to pass the
+            # embedded questions between the DataLoader worker processes.
+            self.embed_layer.weight.requires_grad = False
+            # Index 0 (never used by words) is the padding - embedded as zeros.
+            self.embed_layer.weight.data[0] = 0
 
-        # Done! The actual question embedding is handled in __getitem__.
+        else:
+            # The table depends on the vocabulary (which differs between the
+            # sets and CLEVR-Humans): keyed by a digest of the words.
+            vocabulary_digest = hashlib.sha1(
+                json.dumps(self.index_to_word).encode()).hexdigest()[:16]
+            embeddings_filename = self.clevr_dir + \
+                '/generated_files/{}_{}_{}_{}words_embeddings_fp16.npy'.format(
+                    self.embedding_type, 'CLEVR_Humans' if self.clevr_humans else 'CLEVR',
+                    vocabulary_digest, len(self.word_dic) + 1)
+
+            self.embedding_table = None
+            if self.precomputed_embeddings and os.path.isfile(embeddings_filename):
+                logger.info('Loading precomputed embeddings from {}'.format(
+                    embeddings_filename))
+                self.embedding_table = np.load(embeddings_filename, mmap_mode='r')
+                if len(self.embedding_table) != len(self.word_dic) + 1:
+                    logger.warning('The embeddings in {} do not match the vocabulary, recomputing them.'.format(
+                        embeddings_filename))
+                    self.embedding_table = None
+
+            if self.embedding_table is None:
+                logger.info('Constructing embeddings using {}'.format(
+                    self.embedding_type))
+                # instantiate Language class
+                self.language = Language('lang')
+                # use the words of the questions (tokenized as in word_dic) to
+                # construct the embeddings vectors
+                self.language.build_pretrained_vocab(
+                    list(self.word_dic.keys()), vectors=self.embedding_type)
+
+                # Look-up table indexed by the word indexes, 0 is the padding.
+                weights = torch.zeros(len(self.word_dic) + 1,
+                                      self.language.vocab.vectors.size(1))
+                for word, index in self.word_dic.items():
+                    weights[index] = self.language.embed_word(word)
+                self.embed_layer = torch.nn.Embedding.from_pretrained(
+                    weights, freeze=True)
+
+                if self.precomputed_embeddings:
+                    np.save(embeddings_filename,
+                            weights.numpy().astype(np.float16))
+                    logger.warning('Saved embeddings to file {}.'.format(
+                        embeddings_filename))
+
+        # Done! The actual question embedding is handled (for a whole batch)
+        # in collate_data.
 
     def __len__(self):
         """
         Return the length of the questions set.
         """
-        return len(self.data)
+        return len(self.answers)
+
+    def questions_dirname(self, set):
+        """
+        Returns the path of the folder containing the tokenized questions.
+
+        :param set: String to specify which dataset to use: 'train', 'val'
+
+        """
+        return self.clevr_dir + '/generated_files/{}_{}_questions'.format(
+            set, 'CLEVR_Humans' if self.clevr_humans else 'CLEVR')
+
+    def save_questions(self, data, word_dic, answer_dic, questions_dirname):
+        """
+        Stores the tokenized questions in columnar numpy arrays (.npy): word
+        indexes of all questions (flat int32) with offsets of the questions,
+        answer indexes, family indexes and image indices. The vocabularies
+        (words, answers, families) are stored in JSON.
+
+        :param data: list of dicts (tokenized_question, answer, string_question, imgfile, question_type)
+        :param word_dic: dict {'word': index}
+        :param answer_dic: dict {'answer': index}
+        :param questions_dirname: Folder to store the arrays in.
+
+        """
+        families = self.load_family_table()
+        family_dic = {family: index for index, family in enumerate(families)}
+
+        lengths = [len(q['tokenized_question']) for q in data]
+        columns = {
+            'tokens': np.fromiter(
+                (word for q in data for word in q['tokenized_question']),
+                dtype=np.int32, count=sum(lengths)),
+            'offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            'answers': np.array([q['answer'] for q in data], dtype=np.int64),
+            'families': np.array([family_dic[q['question_type']] for q in data],
+                                 dtype=np.int64),
+            'image_indices': np.array(
+                [int(q['imgfile'].rsplit('_', 1)[1][:-4]) for q in data],
+                dtype=np.int64)}
+
+        # index to word/answer tables, 0 is reserved for padding (words).
+        words = ['<pad>'] * (len(word_dic) + 1)
+        for word, index in word_dic.items():
+            words[index] = word
+        answers = [None] * len(answer_dic)
+        for answer, index in answer_dic.items():
+            answers[index] = answer
+
+        # write to a temporary folder first.
+        tmp_dirname = '{}.tmp{}'.format(questions_dirname, os.getpid())
+        os.makedirs(tmp_dirname, exist_ok=True)
+        for name, column in columns.items():
+            np.save(os.path.join(tmp_dirname, name + '.npy'), column)
+        with open(os.path.join(tmp_dirname, 'vocabularies.json'), 'w') as f:
+            json.dump({'words': words, 'answers': answers,
+                       'families': families}, f)
+        try:
+            os.rename(tmp_dirname, questions_dirname)
+            logger.warning(
+                'Saved tokenized questions to folder {}.'.format(questions_dirname))
+        except OSError:
+            # folder created in the meantime (e.g. by another process).
+            shutil.rmtree(tmp_dirname, ignore_errors=True)
+            logger.warning(
+                'Folder {} already exists, keeping it.'.format(questions_dirname))
+
+    def load_family_table(self):
+        """
+        Returns the table of the question families (types), shared by all
+        sets: sorted types of questions/index_to_family.json.
+
+        :return: list of families names, indexed by the family ids.
+
+        """
+        with open(os.path.join(self.clevr_dir, 'questions/index_to_family.json')) as f:
+            return sorted(set(json.load(f).values()))
+
+    def load_questions(self, questions_dirname):
+        """
+        Memory-maps the columnar arrays of the tokenized questions and loads
+        the vocabularies.
+
+        :param questions_dirname: Folder containing the arrays.
+
+        """
+        for name in ['tokens', 'offsets', 'answers', 'families', 'image_indices']:
+            setattr(self, name, np.load(
+                os.path.join(questions_dirname, name + '.npy'), mmap_mode='r'))
+
+        self.load_vocabularies(questions_dirname)
+
+    def load_vocabularies(self, questions_dirname):
+        """
+        Loads the vocabularies (words, answers, families) of the tokenized
+        questions.
+
+        :param questions_dirname: Folder containing the tokenized questions.
+
+        """
+        with open(os.path.join(questions_dirname, 'vocabularies.json')) as f:
+            vocabularies = json.load(f)
+        self.index_to_word = vocabularies['words']
+        self.index_to_answer = vocabularies['answers']
+        self.index_to_family = vocabularies['families']
+        self.word_dic = {word: index for index, word in enumerate(self.index_to_word) if index > 0}
+        self.answer_dic = {answer: index for index, answer in enumerate(self.index_to_answer)}
+
+    def open_feature_maps(self):
+        """
+        Opens the hdf5 file containing the feature maps, if it is not opened
+        yet by the current process (or memory-maps the .npy file).
+        """
+        if self.feature_maps_memmap:
+            if self.img is None:
+                self.img = np.load(self.feature_maps_npy_filename, mmap_mode='r')
+                if self.feature_maps_dtype == 'uint8':
+                    self.img_scales = np.load(
+                        self.feature_maps_npy_filename[:-4] + '_scales.npy', mmap_mode='r')
+        elif self.h is None or self.h_pid != os.getpid():
+            self.h = h5py.File(self.feature_maps_filename, 'r')
+            self.img = self.h['data']
+            self.img_scales = self.h['scales'] if 'scales' in self.h else None
+            self.h_pid = os.getpid()
+
+    @staticmethod
+    def worker_init_fn(worker_id):
+        """
+        Initializes a DataLoader worker process: opens the worker-local handle
+        to the hdf5 file.
+
+        :param worker_id: Id of the worker (unused).
+
+        """
+        torch.utils.data.get_worker_info().dataset.open_feature_maps()
+
+    def __getstate__(self):
+        """
+        Returns the state of the dataset to be pickled (e.g. when sent to the
+        DataLoader worker processes) - without the hdf5 handles and cache.
+        """
+        state = self.__dict__.copy()
+        state.update(h=None, img=None, img_scales=None, h_pid=None,
+                     feature_maps_cache=collections.OrderedDict())
+        return state
+
+    def get_feature_maps(self, id):
+        """
+        Returns the (stored, i.e. possibly quantized) feature maps of an image,
+        using the LRU cache (the same image is shared by several questions).
+
+        :param id: index of the image.
+
+        :return: tensor of feature maps [1024 x 14 x 14], tensor of scales and offsets [2 x 1024] (None if not
+                 quantized),
+                 number of bytes read from the file (0 if cached).
+
+        """
+        cache = self.feature_maps_cache
+        if id in cache:
+            cache.move_to_end(id)
+            img, img_scales = cache[id]
+            return img, img_scales, 0
+
+        self.open_feature_maps()
+        img = torch.from_numpy(np.array(self.img[id]))
+        img_scales = None
+        bytes_read = img.numel() * img.element_size()
+        if self.img_scales is not None:
+            img_scales = torch.from_numpy(np.array(self.img_scales[id]))
+            bytes_read += img_scales.numel() * img_scales.element_size()
+
+        if self.feature_maps_cache_size > 0:
+            cache[id] = (img, img_scales)
+            if len(cache) > self.feature_maps_cache_size:
+                cache.popitem(last=False)
+
+        return img, img_scales, bytes_read
 
     def close(self):
         """
         Close hdf5 file.
         """
-        self.h.close()
+        if self.h is not None:
+            self.h.close()
+            self.h = None
+            self.img = None
 
     def generate_questions_dics(self, set, word_dic=None, answer_dic=None):
         """
@@ -265,7 +564,6 @@ class CLEVRDataset(Dataset):
             # same for the answers
             answer_dic = {}
 
-        import json
         import tqdm
         import nltk
         nltk.download('punkt')  # needed for nltk.word.tokenize
@@ -286,8 +584,10 @@ class CLEVRDataset(Dataset):
 
         # start constructing vocab sets
         result = []
-        word_index = 1  # 0 reserved for padding
-        answer_index = 0
+        # new words & answers are appended to the (given) dictionaries, 0 is
+        # reserved for padding
+        word_index = len(word_dic) + 1
+        answer_index = len(answer_dic)
 
         logger.info('Constructing {} words dictionary:'.format(set))
         for question in tqdm.tqdm(data['questions']):
@@ -324,13 +624,8 @@ class CLEVRDataset(Dataset):
             'Done: constructed words dictionary of length {}, and answers dictionary of length {}'.format(
                 len(word_dic), len(answer_dic)))
         # save result to file
-        questions_filename = self.clevr_dir + '/generated_files/{}_{}_questions.pkl'.format(
-            set, 'CLEVR_Humans' if self.clevr_humans else 'CLEVR')
-        with open(questions_filename, 'wb') as f:
-            pickle.dump(result, f)
-
-        logger.warning(
-            'Saved tokenized questions to file {}.'.format(questions_filename))
+        self.save_questions(result, word_dic, answer_dic,
+                            self.questions_dirname(set))
 
         # save dictionaries to file:
         with open(self.clevr_dir + '/generated_files/dics.pkl', 'wb') as f:
@@ -344,50 +639,19 @@ class CLEVRDataset(Dataset):
     def generate_feature_maps_file(self, feature_maps_filename, batch_size=50):
         """
         Uses GenerateFeatureMaps to pass the CLEVR images through a pretrained
-        CNN model.
+        CNN model (on GPU if available, otherwise with worker processes on
+        CPU, see extract_feature_maps).
 
-        :param set: String to specify which dataset to use: 'train', 'val' or 'test'.
         :param feature_maps_filename: filename for saving to file.
         :param batch_size: batch size
 
-        :return: feature maps
-
         """
-        # import lines
-        from problems.image_text_to_class.generate_feature_maps import GenerateFeatureMaps
-        from torch.utils.data import DataLoader
-        import tqdm
+        from problems.image_text_to_class.generate_feature_maps import extract_feature_maps
 
-        # create DataLoader of the images dataset.
-        generate_feature_maps = GenerateFeatureMaps(
-            clevr_dir=self.clevr_dir,
-            set=self.set,
-            cnn_model='resnet101',
-            num_blocks=4)
-        dataloader = DataLoader(generate_feature_maps, batch_size=batch_size)
-
-        size = len(dataloader)
-        dataset = iter(dataloader)
-        pbar = tqdm.tqdm(dataset, total=size, unit="batches")
-
-        # create file to store feature maps.
-        f = h5py.File(feature_maps_filename, 'w', libver='latest')
-        dset = f.create_dataset(
-            'data', (size * batch_size, 1024, 14, 14), dtype='f4')
-
-        with torch.no_grad():
-            for i, image in enumerate(pbar):
-                # move batch to GPU
-                image = image.type(torch.cuda.FloatTensor)
-
-                # forward pass, move output to cpu and store it into the file.
-                features = generate_feature_maps.model(
-                    image).detach().cpu().numpy()
-                dset[i * batch_size:(i + 1) * batch_size] = features
-
-        f.close()
-        logger.warning('File {} successfully created.'.format(
-            feature_maps_filename))
+        extract_feature_maps(
+            self.clevr_dir, self.set, feature_maps_filename,
+            dtype=self.feature_maps_dtype, batch_size=batch_size,
+            **self.extraction_params)
 
     def __getitem__(self, index):
         """
@@ -395,39 +659,77 @@ class CLEVRDataset(Dataset):
 
         :param index: index of the sample to return.
 
-        :return: img: extracted feature maps from the raw image
-                 tokenized_question: tensor of word indexes
+        :return: img: extracted feature maps from the raw image (stored type, dequantized in collate_data)
+                 tokenized_question: tensor of word indexes (embedded in collate_data)
                  len(question): question length
                  answer: index of the answer in the answers dictionary
                  string_question: original question string
                  index: index of the sample
                  imgfile: image filename
+                 question_type: family of the question
+                 img_scales: scales and offsets of the uint8 feature maps (None if not quantized)
+                 bytes_read: number of bytes of feature maps read from file
 
         """
-        # load tokenized_question, answer, string_question, image_filename from
-        # self.data
-        question, answer, string_question, imgfile, question_type = self.data[index].values(
-        )
+        return self.__getitems__([index])[0]
 
-        # create the image index to retrieve the feature maps in self.img
-        id = int(imgfile.rsplit('_', 1)[1][:-4])
+    def __getitems__(self, indexes):
+        """
+        Returns the samples of a batch (used by the DataLoader). The feature
+        maps of every distinct image are read once and shared by all its
+        questions.
 
-        img = torch.from_numpy(self.img[id]).type(self.app_state.dtype)
+        :param indexes: list of indexes of the samples to return.
 
-        # embed question
-        if self.embedding_type == 'random':
-            # embed question:
-            question = self.embed_layer(
-                torch.LongTensor(question)).type(self.app_state.dtype)
+        :return: list of samples (see __getitem__).
 
-        else:
-            # embed question
-            question = self.language.embed_sentence(string_question)
+        """
+        samples = []
+        images = {}
+        for index in indexes:
+            # load tokenized_question, answer, image index & family from the
+            # (memory-mapped) arrays
+            question = self.tokens[self.offsets[index]:self.offsets[index + 1]]
+            answer = int(self.answers[index])
+            id = int(self.image_indices[index])
+
+            # decode the question string, image filename & family (visualization)
+            string_question = ' '.join(self.index_to_word[word] for word in question)
+            imgfile = 'CLEVR_{}_{:06d}.png'.format(self.set, id)
+            question_type = self.index_to_family[self.families[index]]
+
+            # Samples are returned on CPU (they can be assembled by the DataLoader
+            # worker processes), turn_on_cuda() moves the batch to GPU.
+            if id in images:
+                img, img_scales = images[id]
+                bytes_read = 0
+            else:
+                img, img_scales, bytes_read = self.get_feature_maps(id)
+                images[id] = (img, img_scales)
 
-        question_length = question.shape[0]
+            question = torch.from_numpy(question.astype(np.int64))
+            question_length = question.shape[0]
+
+            samples.append((img, question, question_length, answer, string_question, index, imgfile,
+                            question_type, img_scales, bytes_read))
 
         # return everything
-        return img, question, question_length, answer, string_question, index, imgfile, question_type
+        return samples
+
+    def embed_questions(self, questions):
+        """
+        Embeds a batch of questions.
+
+        :param questions: tensor of padded word indexes [batch_size x max_question_length]
+
+        :return: tensor of embedded questions [batch_size x max_question_length x embedding_dim]
+
+        """
+        if self.embedding_table is not None:
+            return torch.from_numpy(
+                self.embedding_table[questions.numpy()].astype(np.float32))
+
+        return self.embed_layer(questions)
 
     def collate_data(self, batch):
         """
@@ -436,12 +738,14 @@ class CLEVRDataset(Dataset):
         :param batch: list (?) of samples to combine
 
         :return: images (tensor), padded_tokenized_questions (tensor), questions_lengths (list), answers (tensor),
-                questions_strings (list), indexes (list), imgfiles (list)
+                questions_strings (list), indexes (list), imgfiles (list), question_types (list),
+                bytes_read (number of bytes of feature maps read from file for the batch)
 
         """
         # create list placeholders
-        images, lengths, answers, s_questions, indexes, imgfiles, question_types = [
-        ], [], [], [], [], [], []
+        images, lengths, answers, s_questions, indexes, imgfiles, question_types, images_scales = [
+        ], [], [], [], [], [], [], []
+        bytes_read = 0
         batch_size = len(batch)
 
         # get max question length, create tensor of shape [batch_size x maxQuestionLength] & sort questions by
@@ -449,23 +753,13 @@ class CLEVRDataset(Dataset):
         max_len = max(map(lambda x: len(x[1]), batch))
         sort_by_len = sorted(batch, key=lambda x: len(x[1]), reverse=True)
 
-        # create tensor containing the embedded questions
-        if self.embedding_type == 'random':
-            questions = torch.zeros(
-                batch_size,
-                max_len,
-                self.random_embedding_dim).type(
-                self.app_state.dtype)
-
-        else:
-            # get embedding dimension from the embedding type
-            embedding_dim = int(self.embedding_type[-4:-1])
-            questions = torch.zeros(
-                batch_size, max_len, embedding_dim).type(self.app_state.dtype)
+        # create tensor containing the (padded) word indexes of the questions
+        questions = torch.zeros(batch_size, max_len, dtype=torch.long)
 
         # fill in the placeholders
         for i, b in enumerate(sort_by_len):
-            image, question, length, answer, string_question, index, imgfile, question_type = b
+            image, question, length, answer, string_question, index, imgfile, question_type, \
+                image_scales, image_bytes_read = b
 
             images.append(image)
             lengths.append(length)
@@ -474,13 +768,23 @@ class CLEVRDataset(Dataset):
             indexes.append(index)
             imgfiles.append(imgfile)
             question_types.append(question_type)
+            images_scales.append(image_scales)
+            bytes_read += image_bytes_read
+
+            questions[i, :length] = question
+
+        # dequantize the feature maps of the whole batch
+        images = torch.stack(images).float()
+        if images_scales[0] is not None:
+            images_scales = torch.stack(images_scales)
+            images = images * images_scales[:, 0, :, None, None] + images_scales[:, 1, :, None, None]
 
-            questions[i, :length, :] = question
+        # embed all questions at once
+        questions = self.embed_questions(questions)
 
         # return all
-        return torch.stack(images).type(
-            self.app_state.dtype), questions, lengths, torch.tensor(answers).type(
-            self.app_state.LongTensor), s_questions, indexes, imgfiles, question_types
+        return images, questions, lengths, torch.LongTensor(
+            answers), s_questions, indexes, imgfiles, question_types, bytes_read
 
 
 if __name__ == '__main__':
@@ -495,4 +799,22 @@ if __name__ == '__main__':
 
     clevr_dataset = CLEVRDataset(
         set, clevr_dir, clevr_humans, embedding_type, random_embedding_dim)
+
+    # Benchmark of the random access to samples (hdf5/.npy, with/without cache).
+    import time
+    num_samples = 2000
+    indexes = np.random.randint(0, len(clevr_dataset), num_samples)
+    for feature_maps_memmap in [False, True]:
+        for feature_maps_cache_size in [0, 1000]:
+            clevr_dataset = CLEVRDataset(
+                set, clevr_dir, clevr_humans, embedding_type, random_embedding_dim,
+                feature_maps_memmap=feature_maps_memmap,
+                feature_maps_cache_size=feature_maps_cache_size)
+            start = time.time()
+            for index in indexes:
+                clevr_dataset[index]
+            print('memmap: {} cache size: {} - {:.1f} samples/s'.format(
+                feature_maps_memmap, feature_maps_cache_size,
+                num_samples / (time.time() - start)))
+
     print('Unit test completed.')
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+import torch
+from problems.image_text_to_class.clevr import CLEVR, CLEVR_SETS
+# Tests for the images keys of CLEVR (run from the root directory:
+# python -m problems.image_text_to_class.clevr_images_keys_test)
+image_indices = np.array([0, 1, 69999, 2**31 - 1])
+
+keys = []
+for set_name in CLEVR_SETS:
+    images_keys = CLEVR.images_keys(image_indices, set_name)
+    print(set_name, images_keys)
+    assert images_keys.dtype == torch.int64
+    # The image index & the set are recovered from the key (no overflow).
+    assert (images_keys & (2**32 - 1)).tolist() == image_indices.tolist()
+    assert ((images_keys >> 32) == CLEVR_SETS.index(set_name)).all()
+    keys += images_keys.tolist()
+
+# Keys are unique across the sets.
+assert len(set(keys)) == len(keys)
@@ -45,11 +45,23 @@ generate-feature_maps.py: This file contains 1 class:
 - GenerateFeatureMaps: This class instantiates a specified pretrained CNN model to extract feature maps from images stored in the indicated directory. It also creates a DataLoader to generate batches of these images.
   This class is used in problems.image_text_to_class.new_clevr_dataset.generate_feature_maps_file.
 
+and 7 functions:
+
+- quantize_feature_maps: converts feature maps to the reduced precision storage (float16 or per-channel uint8).
+- dequantize_feature_maps: converts stored feature maps back to float32.
+- quantization_error: measures the error of the reduced precision storage on an extracted (float32) file.
+- create_feature_maps_file: creates the hdf5 file storing the feature maps, with one chunk per image.
+- write_feature_maps: writes (quantized) feature maps to the hdf5 file.
+- convert_feature_maps: converts the float32 hdf5 file to a reduced precision one.
+- convert_feature_maps_to_npy: converts the hdf5 file to raw .npy files (to be memory-mapped).
+
 """
 __author__ = "Vincent Marois"
 import torchvision
 from torchvision import transforms
 import torch
+import h5py
+import numpy as np
 from PIL import Image
 
 from torch.utils.data import Dataset
@@ -69,21 +81,24 @@ class GenerateFeatureMaps(Dataset):
     images of the CLEVR dataset.
     """
 
-    def __init__(self, clevr_dir, set, cnn_model='resnet101', num_blocks=4):
+    def __init__(self, clevr_dir, set, cnn_model='resnet101', num_blocks=4,
+                 cuda=None, channels_last=False, optimize_for_inference=False):
         """
-        Creates the pretrained CNN model & move it to CUDA.
-        WARNING: WE ONLY AUTHORIZE USING THIS CLASS ON GPU, TO SPEED UP THE FORWARD PASSES OF THE PRETRAINED CNN.
+        Creates the pretrained CNN model & move it to CUDA (if used).
 
         :param clevr_dir: Directory path to the CLEVR dataset.
         :param set: String to specify which dataset to use: 'train', 'val' or 'test'.
         :param cnn_model: pretrained CNN model to use
         :param num_blocks: number of layers to use from the cnn_model.
+        :param cuda: Run the CNN on GPU (DEFAULT: None, i.e. if CUDA is available).
+        :param channels_last: Use the channels last memory format (faster convolutions on CPU).
+        :param optimize_for_inference: Freeze the (traced) CNN and optimize it for inference (oneDNN on CPU).
         """
-        # we only authorize the images processing on GPU.
-        if not torch.cuda.is_available():
-            logger.error(
-                'WARNING: CUDA IS NOT AVAILABLE. NOT AUTHORIZING DO FEATURE MAPS EXTRACTION. EXITING.')
-            exit(1)
+        if cuda is None:
+            cuda = torch.cuda.is_available()
+        elif cuda and not torch.cuda.is_available():
+            logger.warning('CUDA is not available, extracting the feature maps on CPU.')
+            cuda = False
 
         # call base constructor
         super(GenerateFeatureMaps, self).__init__()
@@ -93,6 +108,9 @@ class GenerateFeatureMaps(Dataset):
         self.set = set
         self.cnn_model = cnn_model
         self.num_blocks = num_blocks
+        self.cuda = cuda
+        self.channels_last = channels_last
+        self.optimize_for_inference = optimize_for_inference
 
         # Get specified pretrained cnn model
         cnn = getattr(torchvision.models, self.cnn_model)(pretrained=True)
@@ -114,8 +132,13 @@ class GenerateFeatureMaps(Dataset):
         self.model = torch.nn.Sequential(*layers)
 
         # move it to CUDA & specify evaluation behavior
-        self.model.cuda()
+        if self.cuda:
+            self.model.cuda()
+        if self.channels_last:
+            self.model.to(memory_format=torch.channels_last)
         self.model.eval()
+        # optimized (traced) model - created with the first batch.
+        self.optimized_model = None
 
         self.length = len(os.listdir(os.path.join(
             self.clevr_dir, 'images', self.set)))
@@ -154,3 +177,425 @@ class GenerateFeatureMaps(Dataset):
         :return: length of dataset.
         """
         return self.length
+
+    def extract(self, images):
+        """
+        Passes a batch of images through the CNN.
+
+        :param images: tensor of images [batch_size x 3 x 224 x 224]
+
+        :return: array of float32 feature maps [batch_size x 1024 x 14 x 14]
+
+        """
+        if self.cuda:
+            images = images.cuda()
+        if self.channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+
+        with torch.no_grad():
+            model = self.model
+            if self.optimize_for_inference:
+                if self.optimized_model is None:
+                    self.optimized_model = torch.jit.optimize_for_inference(
+                        torch.jit.freeze(torch.jit.trace(self.model, images)))
+                model = self.optimized_model
+
+            features = model(images)
+
+        return features.float().cpu().numpy()
+
+
+def quantize_feature_maps(features, dtype='float32'):
+    """
+    Converts feature maps to the type they are stored in:
+
+        - 'float32' and 'float16': values are cast,
+        - 'uint8': values are quantized per image & channel (asymmetric, with scales = (max - min) / 255 and
+          offsets = min). The feature maps are post-ReLU (non-negative), so a symmetric scheme would waste half of
+          the range.
+
+    :param features: array of feature maps [num_images x channels x height x width]
+    :param dtype: storage type: 'float32', 'float16' or 'uint8'.
+
+    :return: stored values, scales and offsets [num_images x 2 x channels] (None if not quantized)
+
+    """
+    if dtype == 'uint8':
+        offsets = features.min(axis=(2, 3))
+        scales = (features.max(axis=(2, 3)) - offsets) / 255
+        scales[scales == 0] = 1
+        values = np.round((features - offsets[:, :, None, None]) / scales[:, :, None, None])
+        return np.clip(values, 0, 255).astype(np.uint8), \
+            np.stack([scales, offsets], axis=1).astype(np.float32)
+
+    return features.astype(dtype), None
+
+
+def dequantize_feature_maps(values, scales=None):
+    """
+    Converts stored feature maps back to float32 (the inverse of quantize_feature_maps).
+
+    :param values: array of stored feature maps [num_images x channels x height x width]
+    :param scales: scales and offsets [num_images x 2 x channels] (None if not quantized)
+
+    :return: array of float32 feature maps [num_images x channels x height x width]
+
+    """
+    features = values.astype(np.float32)
+    if scales is not None:
+        features = features * scales[:, 0, :, None, None] + scales[:, 1, :, None, None]
+    return features
+
+
+def create_feature_maps_file(feature_maps_filename, num_images,
+                             shape=(1024, 14, 14), dtype='float32'):
+    """
+    Creates the hdf5 file storing the feature maps of the images.
+
+    The datasets are chunked per image, so reading the feature maps of a single
+    image (random access while training) reads exactly one chunk.
+
+    :param feature_maps_filename: filename of the hdf5 file.
+    :param num_images: number of images.
+    :param shape: shape of the feature maps of a single image.
+    :param dtype: storage type: 'float32', 'float16' or 'uint8' (with per channel 'scales' and offsets).
+
+    :return: hdf5 file, with 'data' (and 'scales') datasets.
+
+    """
+    f = h5py.File(feature_maps_filename, 'w', libver='latest')
+    f.create_dataset('data', (num_images,) + tuple(shape),
+                     dtype=dtype, chunks=(1,) + tuple(shape))
+    if dtype == 'uint8':
+        f.create_dataset('scales', (num_images, 2, shape[0]),
+                         dtype='float32', chunks=(1, 2, shape[0]))
+    return f
+
+
+def write_feature_maps(f, start, features, dtype='float32'):
+    """
+    Writes (quantized) feature maps to the hdf5 file.
+
+    :param f: hdf5 file created by create_feature_maps_file().
+    :param start: index of the first image.
+    :param features: array of float32 feature maps [num_images x channels x height x width]
+    :param dtype: storage type of the file.
+
+    """
+    values, scales = quantize_feature_maps(features, dtype)
+    f['data'][start:start + len(values)] = values
+    if scales is not None:
+        f['scales'][start:start + len(scales)] = scales
+
+
+def convert_feature_maps(feature_maps_filename, converted_filename, dtype,
+                         batch_size=500):
+    """
+    Converts the (float32) hdf5 file storing the feature maps to an hdf5 file
+    storing them in reduced precision.
+
+    :param feature_maps_filename: filename of the float32 hdf5 file.
+    :param converted_filename: filename of the converted hdf5 file.
+    :param dtype: storage type: 'float16' or 'uint8'.
+    :param batch_size: number of images converted at once.
+
+    """
+    tmp_filename = '{}.tmp{}'.format(converted_filename, os.getpid())
+    with h5py.File(feature_maps_filename, 'r') as f:
+        data = f['data']
+        out = create_feature_maps_file(
+            tmp_filename, data.shape[0], data.shape[1:], dtype)
+        for start in range(0, data.shape[0], batch_size):
+            write_feature_maps(
+                out, start, data[start:start + batch_size], dtype)
+        out.close()
+
+    os.rename(tmp_filename, converted_filename)
+    logger.warning('File {} successfully created.'.format(converted_filename))
+
+
+def quantization_error(feature_maps_filename, dtype, batch_size=500):
+    """
+    Measures the error of the reduced precision storage of the feature maps
+    of the (float32) hdf5 file, i.e. the round-trip through
+    quantize_feature_maps and dequantize_feature_maps.
+
+    :param feature_maps_filename: filename of the float32 hdf5 file.
+    :param dtype: storage type: 'float16' or 'uint8'.
+    :param batch_size: number of images processed at once.
+
+    :return: maximum absolute error, root mean square error relative to the root mean square of the feature maps.
+
+    """
+    max_error, squared_error, squared_norm = 0.0, 0.0, 0.0
+    with h5py.File(feature_maps_filename, 'r') as f:
+        data = f['data']
+        for start in range(0, data.shape[0], batch_size):
+            features = data[start:start + batch_size]
+            error = dequantize_feature_maps(*quantize_feature_maps(features, dtype)) - features
+            max_error = max(max_error, float(np.abs(error).max()))
+            squared_error += float(np.square(error, dtype=np.float64).sum())
+            squared_norm += float(np.square(features, dtype=np.float64).sum())
+
+    return max_error, np.sqrt(squared_error / max(squared_norm, 1e-30))
+
+
+def convert_feature_maps_to_npy(feature_maps_filename, npy_filename,
+                                batch_size=500):
+    """
+    Converts the hdf5 file storing the feature maps to a raw .npy file, which
+    can be memory-mapped (no decompression, no h5py global lock). The scales
+    and offsets of the uint8 feature maps are stored in <npy_filename>_scales.npy.
+
+    :param feature_maps_filename: filename of the hdf5 file.
+    :param npy_filename: filename of the .npy file.
+    :param batch_size: number of images copied at once.
+
+    """
+    with h5py.File(feature_maps_filename, 'r') as f:
+        for name in ['scales', 'data']:
+            if name not in f:
+                continue
+            data = f[name]
+            filename = npy_filename if name == 'data' else \
+                npy_filename[:-4] + '_scales.npy'
+
+            tmp_filename = '{}.tmp{}.npy'.format(filename[:-4], os.getpid())
+            out = np.lib.format.open_memmap(
+                tmp_filename, mode='w+', dtype=data.dtype, shape=data.shape)
+            for start in range(0, data.shape[0], batch_size):
+                out[start:start + batch_size] = data[start:start + batch_size]
+            out.flush()
+            del out
+
+            # the data file is the last one, its presence marks a complete
+            # conversion.
+            os.rename(tmp_filename, filename)
+
+    logger.warning('File {} successfully created.'.format(npy_filename))
+
+
+def shard_filename(shards_dirname, start):
+    """
+    Returns the filename of the shard file starting at the given image.
+
+    :param shards_dirname: Folder containing the shards files.
+    :param start: index of the first image of the shard.
+
+    """
+    return os.path.join(shards_dirname, 'shard_{:06d}.hdf5'.format(start))
+
+
+# Model of the worker process (created once, by init_extraction_worker).
+_worker_generate_feature_maps = None
+
+
+def init_extraction_worker(generate_feature_maps_kwargs, num_threads):
+    """
+    Initializes a worker process of the CPU extraction: limits the number of
+    (intra-op) threads and creates the CNN.
+
+    :param generate_feature_maps_kwargs: Arguments of GenerateFeatureMaps.
+    :param num_threads: Number of threads used by the worker (DEFAULT: None, i.e. 1).
+
+    """
+    global _worker_generate_feature_maps
+    torch.set_num_threads(1 if num_threads is None else num_threads)
+    _worker_generate_feature_maps = GenerateFeatureMaps(**generate_feature_maps_kwargs)
+
+
+def extract_shard(start, stop, shards_dirname, dtype, batch_size,
+                  generate_feature_maps=None):
+    """
+    Extracts the feature maps of a shard of images and writes them to the
+    shard file (renamed when complete).
+
+    :param start: index of the first image of the shard.
+    :param stop: index after the last image of the shard.
+    :param shards_dirname: Folder containing the shards files.
+    :param dtype: storage type: 'float32', 'float16' or 'uint8'.
+    :param batch_size: batch size.
+    :param generate_feature_maps: GenerateFeatureMaps object (DEFAULT: the one of the worker process).
+
+    :return: start (index of the first image of the shard).
+
+    """
+    if generate_feature_maps is None:
+        generate_feature_maps = _worker_generate_feature_maps
+
+    filename = shard_filename(shards_dirname, start)
+    tmp_filename = '{}.tmp{}'.format(filename, os.getpid())
+
+    f = None
+    for batch_start in range(start, stop, batch_size):
+        images = torch.stack(
+            [generate_feature_maps[index]
+             for index in range(batch_start, min(batch_start + batch_size, stop))])
+        features = generate_feature_maps.extract(images)
+        if f is None:
+            f = create_feature_maps_file(
+                tmp_filename, stop - start, features.shape[1:], dtype)
+        write_feature_maps(f, batch_start - start, features, dtype)
+    f.close()
+
+    os.rename(tmp_filename, filename)
+    return start
+
+
+def extract_feature_maps(clevr_dir, set, feature_maps_filename, dtype='float32',
+                         batch_size=50, shard_size=1000, num_workers=1,
+                         num_threads=None, cuda=None, channels_last=False,
+                         optimize_for_inference=False):
+    """
+    Extracts the feature maps of all images of the set and stores them in
+    the hdf5 file.
+
+    The images are split into shards, each one written to its own file (in
+    <feature_maps_filename>.shards). Completed shards are recorded (in
+    completed_shards.txt), so an interrupted extraction resumes from the
+    remaining shards. On CPU, the shards are distributed over num_workers
+    processes, each one using num_threads threads (a single thread by default).
+    A single process extraction only changes the number of threads of the
+    calling process when num_threads is given, and restores it at the end.
+    The shards are merged at the end.
+
+    :param clevr_dir: Directory path to the CLEVR dataset.
+    :param set: String to specify which dataset to use: 'train', 'val' or 'test'.
+    :param feature_maps_filename: filename of the hdf5 file.
+    :param dtype: storage type: 'float32', 'float16' or 'uint8'.
+    :param batch_size: batch size.
+    :param shard_size: number of images per shard.
+    :param num_workers: number of worker processes (CPU extraction).
+    :param num_threads: number of threads of every worker process (CPU extraction, DEFAULT: None).
+    :param cuda: Run the CNN on GPU (DEFAULT: None, i.e. if CUDA is available).
+    :param channels_last: Use the channels last memory format.
+    :param optimize_for_inference: Freeze the (traced) CNN and optimize it for inference (oneDNN on CPU).
+
+    """
+    import tqdm
+    import shutil
+    import multiprocessing
+
+    generate_feature_maps_kwargs = {
+        'clevr_dir': clevr_dir, 'set': set, 'cnn_model': 'resnet101',
+        'num_blocks': 4, 'cuda': cuda, 'channels_last': channels_last,
+        'optimize_for_inference': optimize_for_inference}
+    if cuda is None:
+        cuda = torch.cuda.is_available()
+
+    num_images = len(os.listdir(os.path.join(clevr_dir, 'images', set)))
+
+    # resume: skip the shards recorded as completed.
+    shards_dirname = feature_maps_filename + '.shards'
+    os.makedirs(shards_dirname, exist_ok=True)
+    completed_filename = os.path.join(shards_dirname, 'completed_shards.txt')
+    completed = frozenset()
+    if os.path.isfile(completed_filename):
+        with open(completed_filename) as f:
+            recorded = [int(line) for line in f if line.strip()]
+        completed = {start for start in recorded
+                     if os.path.isfile(shard_filename(shards_dirname, start))}
+
+    shards = [(start, min(start + shard_size, num_images))
+              for start in range(0, num_images, shard_size)
+              if start not in completed]
+    logger.info('Extracting feature maps: {} shards to process, {} already completed'.format(
+        len(shards), len(completed)))
+
+    pbar = tqdm.tqdm(total=len(shards), unit="shards")
+    with open(completed_filename, 'a') as completed_f:
+
+        def record(start):
+            completed_f.write('{}\n'.format(start))
+            completed_f.flush()
+            pbar.update(1)
+
+        if cuda or num_workers <= 1:
+            # single process (GPU or CPU).
+            previous_num_threads = torch.get_num_threads()
+            if not cuda and num_threads is not None:
+                torch.set_num_threads(num_threads)
+            try:
+                generate_feature_maps = GenerateFeatureMaps(**generate_feature_maps_kwargs)
+                for start, stop in shards:
+                    record(extract_shard(start, stop, shards_dirname, dtype,
+                                         batch_size, generate_feature_maps))
+            finally:
+                torch.set_num_threads(previous_num_threads)
+        else:
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(num_workers, initializer=init_extraction_worker,
+                              initargs=(generate_feature_maps_kwargs, num_threads)) as pool:
+                results = [pool.apply_async(extract_shard, (start, stop, shards_dirname, dtype, batch_size))
+                           for start, stop in shards]
+                for result in results:
+                    record(result.get())
+    pbar.close()
+
+    # merge the shards.
+    logger.info('Merging the shards into {}'.format(feature_maps_filename))
+    tmp_filename = '{}.tmp{}'.format(feature_maps_filename, os.getpid())
+    out = None
+    for start in range(0, num_images, shard_size):
+        with h5py.File(shard_filename(shards_dirname, start), 'r') as shard:
+            if out is None:
+                out = create_feature_maps_file(
+                    tmp_filename, num_images, shard['data'].shape[1:], dtype)
+            for name in shard:
+                out[name][start:start + shard[name].shape[0]] = shard[name][()]
+    out.close()
+
+    os.rename(tmp_filename, feature_maps_filename)
+    shutil.rmtree(shards_dirname)
+    logger.warning('File {} successfully created.'.format(feature_maps_filename))
+
+
+if __name__ == '__main__':
+    """
+    Extracts the feature maps of the CLEVR images (e.g. on a CPU-only machine).
+    """
+    import argparse
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clevr_dir', type=str, required=True,
+                        help='Directory path to the CLEVR dataset')
+    parser.add_argument('--set', type=str, default='train',
+                        help='Set of images: train, val, test (DEFAULT: train)')
+    parser.add_argument('--dtype', type=str, default='float32',
+                        help='Storage type of the feature maps: float32, float16, uint8 (DEFAULT: float32)')
+    parser.add_argument('--batch_size', type=int, default=50)
+    parser.add_argument('--shard_size', type=int, default=1000,
+                        help='Number of images per shard (DEFAULT: 1000)')
+    parser.add_argument('--num_workers', type=int, default=1,
+                        help='Number of worker processes (CPU extraction, DEFAULT: 1)')
+    parser.add_argument('--num_threads', type=int, default=None,
+                        help='Number of threads per worker process (CPU extraction, DEFAULT: 1 per worker, '
+                             'all the cores with a single process)')
+    parser.add_argument('--cpu', action='store_true',
+                        help='Extract on CPU even if CUDA is available')
+    parser.add_argument('--channels_last', action='store_true',
+                        help='Use the channels last memory format')
+    parser.add_argument('--optimize_for_inference', action='store_true',
+                        help='Freeze the CNN and optimize it for inference (oneDNN on CPU)')
+    parser.add_argument('--quantization_error', action='store_true',
+                        help='Only report the error of the float16 and uint8 storage of the extracted float32 '
+                             'feature maps of the set')
+    FLAGS = parser.parse_args()
+
+    suffix = '' if FLAGS.dtype == 'float32' else '_' + FLAGS.dtype
+    filename = os.path.join(FLAGS.clevr_dir, 'generated_files',
+                            '{}_CLEVR_features{}.hdf5'.format(FLAGS.set, suffix))
+    if FLAGS.quantization_error:
+        float32_filename = os.path.join(FLAGS.clevr_dir, 'generated_files',
+                                        '{}_CLEVR_features.hdf5'.format(FLAGS.set))
+        for dtype in ['float16', 'uint8']:
+            logger.info('{}: max absolute error {:.6f}, relative RMS error {:.6f}'.format(
+                dtype, *quantization_error(float32_filename, dtype)))
+        sys.exit(0)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    extract_feature_maps(
+        FLAGS.clevr_dir, FLAGS.set, filename, FLAGS.dtype, FLAGS.batch_size,
+        FLAGS.shard_size, FLAGS.num_workers, FLAGS.num_threads,
+        False if FLAGS.cpu else None, FLAGS.channels_last,
+        FLAGS.optimize_for_inference)
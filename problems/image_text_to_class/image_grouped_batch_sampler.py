@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""image_grouped_batch_sampler.py: contains a batch sampler building batches from groups of questions about the same image."""
+__author__ = "Vincent Marois"
+
+import numpy as np
+import torch
+from torch.utils.data.sampler import Sampler
+
+
+class ImageGroupedBatchSampler(Sampler):
+    """
+    Batch sampler returning batches of questions made of groups of (up to
+    max_questions_per_image) questions about the same image, so that the
+    feature maps of an image are read once for several questions.
+
+    Every epoch, the questions of every image are shuffled and split into
+    groups, the groups are shuffled and the batches are consecutive slices of
+    the resulting order. A batch thus contains questions about at least
+    batch_size / max_questions_per_image distinct images (unless groups of
+    the same image happen to be consecutive).
+
+    """
+
+    def __init__(self, image_indices, batch_size, max_questions_per_image=4,
+                 generator=None, drop_last=False):
+        """
+        Initializes the sampler.
+
+        :param image_indices: array of image indices of the questions [num_questions].
+        :param batch_size: batch size.
+        :param max_questions_per_image: maximal number of questions in a group (about the same image).
+        :param generator: torch.Generator used for shuffling (DEFAULT: None, i.e. global generator).
+        :param drop_last: drop the last (incomplete) batch.
+
+        """
+        self.image_indices = np.asarray(image_indices)
+        self.batch_size = batch_size
+        self.max_questions_per_image = max_questions_per_image
+        self.generator = generator
+        self.drop_last = drop_last
+
+    def permutation(self):
+        """
+        Returns the permutation of the questions for the epoch, with groups of
+        questions about the same image.
+
+        :return: array of question indexes [num_questions].
+
+        """
+        num_questions = len(self.image_indices)
+        if num_questions == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # Questions of every image in random order.
+        permutation = torch.randperm(num_questions, generator=self.generator).numpy()
+        order = permutation[np.argsort(self.image_indices[permutation], kind='stable')]
+
+        # Rank of each question among the questions of its image.
+        images = self.image_indices[order]
+        image_starts = np.concatenate([[0], np.flatnonzero(np.diff(images)) + 1])
+        image_sizes = np.diff(np.concatenate([image_starts, [num_questions]]))
+        rank = np.arange(num_questions) - np.repeat(image_starts, image_sizes)
+
+        # Group index of each question, groups in random order.
+        group = np.cumsum(rank % self.max_questions_per_image == 0) - 1
+        group_keys = torch.randperm(int(group[-1]) + 1, generator=self.generator).numpy()
+        return order[np.argsort(group_keys[group], kind='stable')]
+
+    def __iter__(self):
+        """
+        Yields the batches (lists of question indexes) of an epoch.
+        """
+        permutation = self.permutation()
+        for start in range(0, len(self) * self.batch_size, self.batch_size):
+            yield permutation[start:start + self.batch_size].tolist()
+
+    def __len__(self):
+        """
+        :return: number of batches in an epoch.
+        """
+        if self.drop_last:
+            return len(self.image_indices) // self.batch_size
+        return (len(self.image_indices) + self.batch_size - 1) // self.batch_size
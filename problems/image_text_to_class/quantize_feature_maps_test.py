@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+from problems.image_text_to_class.generate_feature_maps import \
+    quantize_feature_maps, dequantize_feature_maps
+# Tests for the reduced precision storage of the feature maps (run from the
+# root directory: python -m problems.image_text_to_class.quantize_feature_maps_test)
+np.random.seed(0)
+# Post-ReLU feature maps [num_images x channels x height x width], with an
+# all-zero channel.
+features = np.maximum(np.random.randn(4, 16, 14, 14), 0).astype(np.float32)
+features[:, 3] = 0
+
+# float16: values are cast (relative error of the rounding, absolute one of
+# the subnormal numbers).
+values, scales = quantize_feature_maps(features, 'float16')
+assert values.dtype == np.float16 and scales is None
+error = np.abs(dequantize_feature_maps(values) - features)
+print('float16 max error', error.max())
+assert (error <= np.abs(features) * 2**-11 + 2**-25).all()
+
+# uint8: error is at most half of a quantization step, i.e. of
+# (max - min) / 255 per image & channel - half of the symmetric int8 step
+# (max(abs) / 127) of the non-negative feature maps.
+values, scales = quantize_feature_maps(features, 'uint8')
+assert values.dtype == np.uint8 and scales.shape == (4, 2, 16)
+error = np.abs(dequantize_feature_maps(values, scales) - features)
+print('uint8 max error', error.max())
+step = (features.max(axis=(2, 3)) - features.min(axis=(2, 3))) / 255
+assert (error <= step[:, :, None, None] / 2 + 1e-6).all()
+assert (error.max(axis=(2, 3)) <= features.max(axis=(2, 3)) / 127 / 2).all()
+# The whole range is used and zeros are exact.
+assert values.max() == 255 and values.min() == 0
+assert (dequantize_feature_maps(values, scales)[features == 0] == 0).all()
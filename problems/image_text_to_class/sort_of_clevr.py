@@ -26,7 +26,6 @@ import progressbar
 import logging
 logger = logging.getLogger('Sort-of-CLEVR')
 
-import random
 import os
 
 import torch
@@ -107,7 +106,8 @@ class SortOfCLEVR(ImageTextToClassProblem):
         Loads the dataset from the HDF5-encoded file.
 
         If file does not exists it generates new dataset and stores it
-        in a file.
+        in a file. Files with one group per sample are converted to the
+        contiguous layout. The arrays are then loaded in memory.
 
         """
 
@@ -125,7 +125,7 @@ class SortOfCLEVR(ImageTextToClassProblem):
         try:
             if self.regenerate:
                 raise Exception("Must regenerate... must regenerate...")
-            self.data = h5py.File(self.pathfilename, 'r')
+            data = h5py.File(self.pathfilename, 'r')
         except BaseException:
             logger.warning(
                 'File {} in {} not found. Generating new file... '.format(
@@ -139,57 +139,73 @@ class SortOfCLEVR(ImageTextToClassProblem):
             self.generate_h5py_dataset()
 
             # Load the file.
-            self.data = h5py.File(self.pathfilename, 'r')
+            data = h5py.File(self.pathfilename, 'r')
+
+        # Files storing one group per sample are converted to the contiguous
+        # layout.
+        if 'answers' not in data:
+            data.close()
+            self.convert_h5py_dataset()
+            data = h5py.File(self.pathfilename, 'r')
+
+        # Load the (contiguous) arrays: images (uint8) of the scenes,
+        # questions & answers indices, index of the scene of every question.
+        with data:
+            self.images = data['images'][()]
+            self.questions = data['questions'][()]
+            self.answers = data['answers'][()]
+            self.image_indices = data['image_indices'][()]
+            self.scene_descriptions = [
+                scene.decode() if isinstance(scene, bytes) else scene
+                for scene in data['scene_descriptions'][()]]
 
         logger.info("Loaded {} samples from file {}".format(
-            len(self.data), self.pathfilename))
-
-        # Generate list of indices (strings).
-        self.dataset_size = len(self.data)
-        self.ids = ['{}'.format(i) for i in range(self.dataset_size)]
+            len(self.answers), self.pathfilename))
 
+        # Permutation of the samples of the current epoch (drawn once per
+        # epoch) and position of the next batch in it.
+        self.dataset_size = len(self.answers)
+        self.permutation = None
+        self.batch_start = self.dataset_size
 
     def generate_batch(self):
         """
         Generates batch.
 
+        The samples of an epoch are taken in the order of a permutation drawn
+        at the beginning of the epoch (identity if shuffle is False), i.e.
+        every batch is a slice of that permutation.
+
         :return: DataTuple and AuxTuple object.
 
         """
-        # Shuffle indices.
-        if self.shuffle:
-            random.shuffle(self.ids)
-        # Get batch of indices.
-        batch_ids = self.ids[:self.batch_size]
-
-        # Get batch.
-        images = []
-        questions = []
-        answers = []
-        scenes = []
-
-        for id in batch_ids:
-            group = self.data[id]
+        # Start a new epoch.
+        if self.batch_start + self.batch_size > self.dataset_size:
+            if self.shuffle:
+                self.permutation = np.random.permutation(self.dataset_size)
+            else:
+                self.permutation = np.arange(self.dataset_size)
+            self.batch_start = 0
 
-            # Process data
-            images.append((group['image'].value / 255).transpose(2, 1, 0))
-            questions.append(group['question'].value.astype(np.float32))
-            answers.append(group['answer'].value.astype(np.float32))
-            scenes.append(group['scene_description'].value)
+        # Get batch of indices.
+        batch_ids = self.permutation[self.batch_start:self.batch_start + self.batch_size]
+        self.batch_start += self.batch_size
+
+        # Get batch: images [BATCH_SIZE x CHANNELS x WIDTH x HEIGHT] normalized
+        # to [0, 1] on the whole batch.
+        image_indices = self.image_indices[batch_ids]
+        images = torch.from_numpy(
+            np.ascontiguousarray(self.images[image_indices].transpose(0, 3, 2, 1)))
+        images = images.float().div_(255)
+        questions = torch.from_numpy(self.questions[batch_ids].astype(np.float32))
+        index_targets = torch.from_numpy(self.answers[batch_ids])
 
         # Generate tuple with inputs
-        inputs = ImageTextTuple(
-            torch.from_numpy(
-                np.stack(
-                    images, axis=0)).type(
-                torch.FloatTensor), torch.from_numpy(
-                    np.stack(
-                        questions, axis=0)))
-        targets = np.stack(answers, 0)
-        index_targets = torch.from_numpy(np.argmax(targets, axis=1))
+        inputs = ImageTextTuple(images, questions)
 
         # Add scene decription to aux tuple.
-        aux_tuple = SceneDescriptionTuple(scenes)
+        aux_tuple = SceneDescriptionTuple(
+            [self.scene_descriptions[index] for index in image_indices])
 
         # Return DataTuple(!) and an AuxTuple with scene description.
         return DataTuple(inputs, index_targets), aux_tuple
@@ -433,15 +449,33 @@ class SortOfCLEVR(ImageTextToClassProblem):
 
         return A
 
+    def write_h5py_dataset(self, filename, images, questions, answers,
+                           image_indices, scene_descriptions):
+        """
+        Saves the dataset in the form of a HDF5 file with contiguous arrays.
+
+        :param filename: Name of the HDF5 file.
+        :param images: Images of the scenes (uint8) [NUM_SCENES x IMG_SIZE x IMG_SIZE x 3].
+        :param questions: Encoded questions [DATASET_SIZE x ...].
+        :param answers: Indices of the answers [DATASET_SIZE].
+        :param image_indices: Index of the scene of every question [DATASET_SIZE].
+        :param scene_descriptions: List of descriptions of the scenes [NUM_SCENES].
+
+        """
+        with h5py.File(filename, 'w') as f:
+            f.create_dataset('images', data=np.asarray(images, dtype=np.uint8))
+            f.create_dataset('questions', data=np.asarray(questions, dtype=np.uint8))
+            f.create_dataset('answers', data=np.asarray(answers, dtype=np.int64))
+            f.create_dataset('image_indices', data=np.asarray(image_indices, dtype=np.int64))
+            f.create_dataset('scene_descriptions', data=np.array(
+                scene_descriptions, dtype=h5py.special_dtype(vlen=str)))
+
     def generate_h5py_dataset(self):
         """
         Generates a whole new Sort-of-CLEVR dataset and saves it in the form of
         a HDF5 file.
         """
 
-        # Output file.
-        f = h5py.File(self.pathfilename, 'w')
-
         # progress bar
         bar = progressbar.ProgressBar(
             maxval=100, widgets=[
@@ -449,44 +483,79 @@ class SortOfCLEVR(ImageTextToClassProblem):
                     '=', '[', ']'), ' ', progressbar.Percentage()])
         bar.start()
 
+        images = []
+        questions = []
+        answers = []
+        image_indices = []
+        scene_descriptions = []
         count = 0
 
         while(count < self.dataset_size):
             # Generate the scene.
             objects = self.generate_scene_representation()
             # Generate corresponding image, questions and answers.
-            I = self.generate_image(objects)
+            images.append(self.generate_image(objects))
+            scene_descriptions.append(self.scene2str(objects))
             Q = self.generate_question_matrix(objects)
             A = self.generate_answer_matrix(objects)
-            # Iterate through all questions generated for a given scene.
-            for j in range(len(objects) * self.NUM_QUESTIONS):
-                # Create new group.
-                id = '{}'.format(count)
-                grp = f.create_group(id)
-
-                # Set data.
-                grp['image'] = I
-                grp['question'] = Q[j, ...]
-                grp['answer'] = A[j, ...]
-                grp['scene_description'] = self.scene2str(objects)
-
-                # Increment counter.
-                count += 1
-
-                # Update progress bar.
-                if count % (self.dataset_size / 100) == 0:
-                    bar.update(count / (self.dataset_size / 100))
-                # Check whether we generated the required number of samples -
-                # break the internal loop.
-                if count >= self.dataset_size:
-                    break
+
+            # Keep (at most) the required number of questions of the scene.
+            num_questions = min(len(objects) * self.NUM_QUESTIONS,
+                                self.dataset_size - count)
+            questions.append(Q[:num_questions])
+            answers.append(np.argmax(A[:num_questions], axis=1))
+            image_indices.append(np.full(num_questions, len(images) - 1))
+            count += num_questions
+
+            # Update progress bar.
+            bar.update(100 * count // self.dataset_size)
 
         # Finalize the generation.
         bar.finish()
-        f.close()
+        self.write_h5py_dataset(
+            self.pathfilename, images, np.concatenate(questions), np.concatenate(answers),
+            np.concatenate(image_indices), scene_descriptions)
         logger.info('Generated dataset with {} samples and saved to {}'.format(
             self.dataset_size, self.pathfilename))
 
+    def convert_h5py_dataset(self):
+        """
+        Converts a dataset stored with one HDF5 group per sample into the
+        contiguous layout (the file is replaced). Consecutive samples
+        sharing the same scene share the image.
+        """
+        logger.info('Converting {} to contiguous arrays'.format(self.pathfilename))
+
+        images = []
+        questions = []
+        answers = []
+        image_indices = []
+        scene_descriptions = []
+
+        with h5py.File(self.pathfilename, 'r') as f:
+            for i in range(len(f)):
+                group = f['{}'.format(i)]
+                image = group['image'][()]
+                scene_description = group['scene_description'][()]
+                if isinstance(scene_description, bytes):
+                    scene_description = scene_description.decode()
+
+                # New scene.
+                if not images or scene_description != scene_descriptions[-1] \
+                        or not np.array_equal(image, images[-1]):
+                    images.append(image)
+                    scene_descriptions.append(scene_description)
+
+                questions.append(group['question'][()])
+                answers.append(np.argmax(group['answer'][()]))
+                image_indices.append(len(images) - 1)
+
+        # Write the new file next to the old one, then replace it.
+        self.write_h5py_dataset(
+            self.pathfilename + '.tmp', images, questions, answers,
+            image_indices, scene_descriptions)
+        os.replace(self.pathfilename + '.tmp', self.pathfilename)
+
     def show_sample(self, data_tuple, aux_tuple, sample_number=0):
         """
         Shows a sample from the batch.
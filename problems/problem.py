@@ -175,6 +175,22 @@ class Problem(metaclass=ABCMeta):
 
         return data_tuple, aux_tuple
 
+    def slice_window(self, data_tuple, aux_tuple, start, stop):
+        """
+        Returns a window (along the time axis) of the batch - used in streaming
+        (truncated BPTT) training. This method has to be overwritten in derived
+        classes of sequential problems.
+
+        :param data_tuple: Data tuple.
+        :param aux_tuple: Auxiliary tuple.
+        :param start: First step of the window.
+        :param stop: Step after the last step of the window.
+        :returns: Pair of Data and Auxiliary tuples containing the window.
+
+        """
+        raise NotImplementedError(
+            "Problem {} does not support streaming".format(self.name))
+
     def plot_preprocessing(self, data_tuple, aux_tuple, logits):
         """
         Allows for some data preprocessing before the model creates a plot for
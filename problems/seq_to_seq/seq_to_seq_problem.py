@@ -18,7 +18,7 @@
 """problem.py: contains base class for all seq2seq problems"""
 __author__ = "Tomasz Kornuta"
 
-from problems.problem import Problem
+from problems.problem import Problem, DataTuple
 
 
 class SeqToSeqProblem(Problem):
@@ -58,3 +58,21 @@ class SeqToSeqProblem(Problem):
             loss = self.loss_function(logits, data_tuple.targets)
 
         return loss
+
+    def slice_window(self, data_tuple, aux_tuple, start, stop):
+        """
+        Returns a window (along the time axis) of the batch - inputs, targets
+        and mask are sliced, other auxiliary values are kept.
+
+        :param data_tuple: Data tuple.
+        :param aux_tuple: Auxiliary tuple containing mask.
+        :param start: First step of the window.
+        :param stop: Step after the last step of the window.
+        :returns: Pair of Data and Auxiliary tuples containing the window.
+
+        """
+        data_window = DataTuple(data_tuple.inputs[:, start:stop],
+                                data_tuple.targets[:, start:stop])
+        aux_window = aux_tuple._replace(mask=aux_tuple.mask[:, start:stop])
+
+        return data_window, aux_window
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""corpus_bleu.py: contains vectorized, incremental computation of the corpus-level BLEU score on tensors of word indexes."""
+__author__ = "Vincent Marois"
+
+import sys
+import math
+import torch
+
+
+class CorpusBLEU(object):
+    """
+    Computes the corpus-level BLEU score (single reference per hypothesis,
+    uniform weights of n-grams up to max_order, no smoothing), i.e. the
+    score returned by nltk.translate.bleu_score.corpus_bleu().
+
+    The n-gram statistics (clipped matches, totals, lengths) are computed
+    directly on the (padded) tensors of word indexes, on the device they are
+    stored on, and accumulated over the consecutive calls of add() - the
+    statistics are brought to the host only in score().
+
+    """
+
+    def __init__(self, max_order=4):
+        """
+        Constructor.
+
+        :param max_order: Maximal order of the n-grams (DEFAULT: 4).
+
+        """
+        self.max_order = max_order
+        self.reset()
+
+    def reset(self):
+        """
+        Resets the accumulated statistics.
+
+        """
+        self.matches = [0] * self.max_order
+        self.totals = [0] * self.max_order
+        self.hypotheses_length = 0
+        self.references_length = 0
+
+    def ngrams(self, tokens_BxL, lengths_B, n):
+        """
+        Returns the n-grams of all sequences as rows (sequence index, n word
+        indexes).
+
+        :param tokens_BxL: Tensor of word indexes [BATCH_SIZE x LENGTH].
+        :param lengths_B: Lengths of the sequences [BATCH_SIZE].
+        :param n: Order of the n-grams.
+        :return: Tensor of n-grams [NUM_NGRAMS x (n + 1)].
+
+        """
+        batch_size, length = tokens_BxL.size()
+        if length < n:
+            return tokens_BxL.new_empty((0, n + 1))
+
+        # All windows of n words [BATCH_SIZE x NUM_WINDOWS x n].
+        windows = tokens_BxL.unfold(1, n, 1)
+        num_windows = windows.size(1)
+        index = torch.arange(batch_size, device=tokens_BxL.device).type_as(tokens_BxL)
+        rows = torch.cat(
+            [index.view(-1, 1, 1).expand(-1, num_windows, 1), windows], dim=2)
+
+        # Windows exceeding the sequence length are dropped.
+        positions = torch.arange(num_windows, device=tokens_BxL.device)
+        valid = (positions.view(1, -1) + n) <= lengths_B.view(-1, 1)
+        return rows[valid]
+
+    def add(self, hypotheses_BxL, hypotheses_lengths_B,
+            references_BxL, references_lengths_B):
+        """
+        Accumulates statistics of a batch of hypotheses and their references.
+
+        :param hypotheses_BxL: Tensor of word indexes of the hypotheses [BATCH_SIZE x LENGTH].
+        :param hypotheses_lengths_B: Lengths of the hypotheses [BATCH_SIZE].
+        :param references_BxL: Tensor of word indexes of the references [BATCH_SIZE x LENGTH'].
+        :param references_lengths_B: Lengths of the references [BATCH_SIZE].
+
+        """
+        hypotheses_lengths_B = hypotheses_lengths_B.to(hypotheses_BxL.device)
+        references_lengths_B = references_lengths_B.to(hypotheses_BxL.device)
+        references_BxL = references_BxL.to(hypotheses_BxL.device)
+
+        for i in range(self.max_order):
+            n = i + 1
+            hypotheses_ngrams = self.ngrams(hypotheses_BxL, hypotheses_lengths_B, n)
+            references_ngrams = self.ngrams(references_BxL, references_lengths_B, n)
+
+            # Count every distinct (sequence, n-gram) in hypotheses and
+            # references, clip hypotheses counts by references counts.
+            if hypotheses_ngrams.size(0) > 0:
+                unique, inverse = torch.unique(
+                    torch.cat([hypotheses_ngrams, references_ngrams]),
+                    dim=0, return_inverse=True)
+                num_unique = unique.size(0)
+                num_hypotheses_ngrams = hypotheses_ngrams.size(0)
+                hypotheses_counts = torch.bincount(
+                    inverse[:num_hypotheses_ngrams], minlength=num_unique)
+                references_counts = torch.bincount(
+                    inverse[num_hypotheses_ngrams:], minlength=num_unique)
+                self.matches[i] += torch.min(
+                    hypotheses_counts, references_counts).sum()
+
+            # Denominator of the modified precision is at least one per
+            # hypothesis (as in nltk).
+            self.totals[i] += (hypotheses_lengths_B - n + 1).clamp(min=1).sum()
+
+        self.hypotheses_length += hypotheses_lengths_B.sum()
+        self.references_length += references_lengths_B.sum()
+
+    def score(self):
+        """
+        Computes the BLEU score of the accumulated corpus.
+
+        :return: BLEU score (0 <= BLEU <= 1).
+
+        """
+        matches = [int(m) for m in self.matches]
+        totals = [int(t) for t in self.totals]
+        hypotheses_length = int(self.hypotheses_length)
+        references_length = int(self.references_length)
+
+        # No unigram matches (or empty corpus).
+        if hypotheses_length == 0 or matches[0] == 0:
+            return 0.0
+
+        # Geometric mean of modified precisions, zero precisions are replaced
+        # by the smallest float (nltk's "no smoothing").
+        log_precision = math.fsum(
+            math.log(m / t if m > 0 else sys.float_info.min) / self.max_order
+            for m, t in zip(matches, totals))
+
+        # Brevity penalty.
+        if hypotheses_length > references_length:
+            brevity_penalty = 1.0
+        else:
+            brevity_penalty = math.exp(1 - references_length / hypotheses_length)
+
+        return brevity_penalty * math.exp(log_precision)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import math
+import torch
+from nltk.translate.bleu_score import corpus_bleu
+from problems.seq_to_seq.text2text.corpus_bleu import CorpusBLEU
+# Tests for CorpusBLEU against nltk (run from the root directory:
+# python -m problems.seq_to_seq.text2text.corpus_bleu_test)
+torch.manual_seed(0)
+vocabulary_size, max_length, batch_size, num_batches = 8, 12, 16, 5
+
+bleu = CorpusBLEU()
+references, hypotheses = [], []
+for _ in range(num_batches):
+    # Small vocabulary, so that the n-grams repeat (clipping).
+    references_BxL = torch.randint(0, vocabulary_size, (batch_size, max_length))
+    hypotheses_BxL = torch.randint(0, vocabulary_size, (batch_size, max_length))
+    references_lengths = torch.randint(1, max_length + 1, (batch_size,))
+    # Include hypotheses shorter than the n-grams.
+    hypotheses_lengths = torch.randint(1, max_length + 1, (batch_size,))
+    hypotheses_lengths[0] = 2
+
+    bleu.add(hypotheses_BxL, hypotheses_lengths,
+             references_BxL, references_lengths)
+    for i in range(batch_size):
+        references.append([references_BxL[i, :references_lengths[i]].tolist()])
+        hypotheses.append(hypotheses_BxL[i, :hypotheses_lengths[i]].tolist())
+
+    # Corpus BLEU accumulated so far.
+    print(bleu.score(), corpus_bleu(references, hypotheses))
+    assert math.isclose(bleu.score(), corpus_bleu(references, hypotheses),
+                        rel_tol=1e-9)
+
+# Identical hypotheses and references.
+lengths = torch.full((batch_size,), max_length, dtype=torch.long)
+bleu.reset()
+bleu.add(references_BxL, lengths, references_BxL, lengths)
+assert math.isclose(bleu.score(), 1.0)
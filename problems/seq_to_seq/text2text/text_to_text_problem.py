@@ -50,24 +50,29 @@ import re
 import torch
 import torch.nn as nn
 from problems.seq_to_seq.seq_to_seq_problem import SeqToSeqProblem
+from problems.seq_to_seq.text2text.corpus_bleu import CorpusBLEU
 
 _TextAuxTuple = collections.namedtuple(
     'TextAuxTuple',
     ('inputs_text',
      'outputs_text',
      'input_lang',
-     'output_lang'))
+     'output_lang',
+     'inputs_lengths',
+     'targets_lengths'))
 
 
 class TextAuxTuple(_TextAuxTuple):
     """
     Tuple used for storing batches of data by text to text sequential problems.
-    Contains four elements:
+    Contains six elements:
 
     - text input sentence (e.g. string in input language for translation)
     - text output sentence (e.g. string in output language for translation
     - Lang() instance of the input language
     - Lang() instance of the output language
+    - lengths of the input sequences (including EOS token)
+    - lengths of the target sequences (including EOS token)
 
     """
     __slots__ = ()
@@ -102,50 +107,47 @@ class TextToTextProblem(SeqToSeqProblem):
         # padding elements.
         self.loss_function = nn.NLLLoss(size_average=True, ignore_index=0)
 
+        # BLEU score of training batches is computed every bleu_interval
+        # episodes (e.g. set it to the validation interval for the training
+        # problem). Validation and testing batches are always scored.
+        self.bleu_interval = params.get('bleu_interval', 1)
+        # Accumulate the BLEU statistics over all batches (e.g. for testing).
+        self.bleu_cumulative = params.get('bleu_cumulative', False)
+        self.corpus_bleu = CorpusBLEU()
+
     def compute_BLEU_score(self, data_tuple, logits, aux_tuple):
         """
         Compute BLEU score in order to evaluate the translation quality
         (equivalent of accuracy) Reference paper:
-        http://www.aclweb.org/anthology/P02-1040.pdf Implementation inspired
-        from https://machinelearningmastery.com/calculate-bleu-score-for-text-
-        python/ To deal with the batch, we accumulate the individual bleu score
-        for each pair of sentences and average over the batch size.
+        http://www.aclweb.org/anthology/P02-1040.pdf
+
+        The corpus-level BLEU score (as nltk.translate.bleu_score.corpus_bleu) is computed on the tensors of word
+        indexes, without decoding the sentences to text. Predictions end at the first EOS token, targets at their
+        EOS token. If 'bleu_cumulative' is set, the statistics are accumulated over all the batches evaluated so far
+        (e.g. the whole test set), otherwise the batch is treated as the corpus.
 
         :param data_tuple: DataTuple(input_tensors, target_tensors)
         :param logits: predictions of the model
-        :param aux_tuple: TextAuxTuple('inputs_text', 'outputs_text', 'input_lang', 'output_lang')
+        :param aux_tuple: TextAuxTuple('inputs_text', 'outputs_text', 'input_lang', 'output_lang', 'inputs_lengths', 'targets_lengths')
 
-        :return: Average BLEU Score for the batch ( 0 < BLEU < 1)
+        :return: BLEU Score of the corpus ( 0 < BLEU < 1)
 
         """
         # get most probable words indexes for the batch
-        _, top_indexes = logits.topk(k=1, dim=-1)
-        logits = top_indexes.squeeze()
-        batch_size = logits.shape[0]
-
-        from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-
-        # retrieve target sentences from TextAuxTuple
-        targets_text = []
-        for sentence in aux_tuple.outputs_text:
-            targets_text.append(sentence.split())
-
-        # retrieve text sentences from the logits (which should be tensors of
-        # indexes)
-        logits_text = []
-        for logit in logits:
-            logits_text.append(
-                [aux_tuple.output_lang.index2word[index.item()]
-                 for index in logit])
-
-        bleu_score = 0
-        for i in range(batch_size):
-            # compute bleu score and use a smoothing function
-            bleu_score += sentence_bleu([targets_text[i]],
-                                        logits_text[i],
-                                        smoothing_function=SmoothingFunction().method1)
-
-        return round(bleu_score / batch_size, 4)
+        predictions = logits.argmax(dim=-1)
+        predictions_lengths = (
+            (predictions == EOS_token).cumsum(dim=1) == 0).sum(dim=1)
+
+        targets = data_tuple.targets
+        targets_lengths = (
+            (targets != PAD_token) & (targets != EOS_token)).sum(dim=1)
+
+        if not self.bleu_cumulative:
+            self.corpus_bleu.reset()
+        self.corpus_bleu.add(predictions, predictions_lengths,
+                             targets, targets_lengths)
+
+        return round(self.corpus_bleu.score(), 4)
 
     def evaluate_loss(self, data_tuple, logits, aux_tuple):
         """
@@ -156,12 +158,20 @@ class TextToTextProblem(SeqToSeqProblem):
         K-dimensional case.
         The target that this loss expects is a class index (0 to C-1, where C = number of classes).
 
+        Targets are padded (with PAD tokens, ignored by the loss) to the length of the logits, as batches are
+        padded only to the length of their longest sequence, whereas the model can output more steps.
+
         :param data_tuple: Data tuple containing inputs and targets.
         :param logits: Logits being outputs of the model.
         :param aux_tuple: Auxiliary tuple containing mask.
         :return: loss
         """
-        loss = self.loss_function(logits.transpose(1, 2), data_tuple.targets)
+        targets = data_tuple.targets
+        if targets.size(1) < logits.size(1):
+            targets = nn.functional.pad(
+                targets, (0, logits.size(1) - targets.size(1)), value=PAD_token)
+
+        loss = self.loss_function(logits.transpose(1, 2), targets)
 
         return loss
 
@@ -185,7 +195,10 @@ class TextToTextProblem(SeqToSeqProblem):
 
     def collect_statistics(self, stat_col, data_tuple, logits, aux_tuple):
         """
-        Collects BLEU score.
+        Collects BLEU score. For training batches (i.e. with gradients
+        enabled) it is computed every bleu_interval episodes only, otherwise
+        the last computed score is kept. Validation and testing batches
+        (evaluated without gradients) are always scored.
 
         :param stat_col: Statistics collector.
         :param data_tuple: Data tuple containing inputs and targets.
@@ -193,9 +206,9 @@ class TextToTextProblem(SeqToSeqProblem):
         :param aux_tuple: auxiliary tuple (aux_tuple).
 
         """
-
-        stat_col['bleu_score'] = self.compute_BLEU_score(
-            data_tuple, logits, aux_tuple)
+        if not torch.is_grad_enabled() or stat_col['episode'] % self.bleu_interval == 0:
+            stat_col['bleu_score'] = self.compute_BLEU_score(
+                data_tuple, logits, aux_tuple)
 
     def show_sample(self, data_tuple, aux_tuple, sample_number=0):
         """
@@ -45,7 +45,11 @@
 __author__ = "Vincent Marois"
 
 import os
+import json
+import shutil
 import random
+import hashlib
+import numpy as np
 
 # fix the random seed for results repeatability
 # random.seed(0)
@@ -54,7 +58,11 @@ import torch
 import errno
 
 from problems.problem import DataTuple
-from problems.seq_to_seq.text2text.text_to_text_problem import TextToTextProblem, Lang, TextAuxTuple
+from problems.seq_to_seq.text2text.text_to_text_problem import TextToTextProblem, Lang, TextAuxTuple, PAD_token
+
+
+# version of the format of the cache of preprocessed datasets
+CACHE_VERSION = 1
 
 
 class Translation(TextToTextProblem):
@@ -97,11 +105,14 @@ class Translation(TextToTextProblem):
         # to filter the English sentences based on their structure.
         self.eng_prefixes = params['eng_prefixes']
 
+        # whether to group the sentences pairs of similar lengths in batches.
+        self.bucket_by_length = params.get('bucket_by_length', False)
+
         # other attributes
         self.input_lang = None  # will be a Lang instance
         self.output_lang = None  # will be a Lang instance
-        self.pairs = []  # will be used to constitute TextAuxTuple
-        self.tensor_pairs = []  # will be used to constitute DataTuple
+        self.pairs = []  # sentences pairs - used only for preprocessing
+        self.tensor_pairs = []  # tensors of indexes - used only for preprocessing
 
         # for datasets storage & handling
         self.root = os.path.expanduser(params['data_folder'])
@@ -116,17 +127,164 @@ class Translation(TextToTextProblem):
         # switch between training & inference datasets
         self.use_train_data = params['use_train_data']
 
+        # folder of the cache of preprocessed (tokenized) datasets.
+        self.cache_folder = os.path.expanduser(params.get(
+            'cache_folder', os.path.join(self.root, self.processed_folder, 'cache')))
+
         # create corresponding Lang instances using the names
         self.input_lang = Lang('eng')
         self.output_lang = Lang(self.output_lang_name)
 
-        # preprocess source data
+        # preprocess source data - or load it from the cache
         self.download()
-        self.input_lang, self.output_lang, self.pairs = self.prepare_data()
+        cache_path = os.path.join(self.cache_folder, self.cache_key())
+        if not os.path.isdir(cache_path):
+            self.input_lang, self.output_lang, self.pairs = self.prepare_data()
+
+            # create tensors of indexes from string pairs
+            self.tensor_pairs = self.tensors_from_pairs(
+                self.pairs, self.input_lang, self.output_lang, self.max_sequence_length)
+
+            self.save_cache(cache_path)
+            self.pairs, self.tensor_pairs = [], []
+
+        self.load_cache(cache_path)
+
+        # batches of pairs of similar lengths of the current epoch (for
+        # bucketing) & position of the next batch.
+        self.bucketed_batches = []
+        self.next_bucketed_batch = 0
+
+    def data_file(self):
+        """
+        Returns the path to the (processed) data file of the used dataset.
+        """
+        return os.path.join(
+            self.root, self.processed_folder,
+            self.training_file if self.use_train_data else self.test_file)
+
+    def cache_key(self):
+        """
+        Returns the key of the cached preprocessed dataset: hash of the cache
+        version, data file content and parameters of the preprocessing
+        (filtering, languages).
+
+        """
+        sha1 = hashlib.sha1()
+        sha1.update(json.dumps([CACHE_VERSION, self.output_lang_name, self.reverse,
+                                self.max_sequence_length, self.eng_prefixes and
+                                list(self.eng_prefixes)]).encode())
+        with open(self.data_file(), 'rb') as data_f:
+            for chunk in iter(lambda: data_f.read(2**20), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def save_cache(self, cache_path):
+        """
+        Stores the preprocessed dataset (from self.tensor_pairs and the Lang
+        instances): token indexes of the input & target sentences as flat
+        int32 arrays (.npy) with offsets of the sentences, vocabularies in
+        JSON.
+
+        :param cache_path: Folder of the cache entry.
+
+        """
+        # write to a temporary folder first - concurrent processes can create
+        # the same entry.
+        tmp_path = '{}.tmp{}'.format(cache_path, os.getpid())
+        os.makedirs(tmp_path, exist_ok=True)
+
+        for name, index in [('inputs', 0), ('targets', 1)]:
+            if self.tensor_pairs:
+                padded = torch.stack([pair[index] for pair in self.tensor_pairs]).cpu().numpy()
+            else:
+                padded = np.zeros((0, self.max_sequence_length), dtype=np.int64)
+            lengths = (padded != PAD_token).sum(axis=1)
+            offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+            np.save(os.path.join(tmp_path, name + '_tokens.npy'),
+                    padded[padded != PAD_token].astype(np.int32))
+            np.save(os.path.join(tmp_path, name + '_offsets.npy'), offsets)
+
+        with open(os.path.join(tmp_path, 'vocabularies.json'), 'w') as vocab_f:
+            json.dump({'version': CACHE_VERSION,
+                       'input_lang': vars(self.input_lang),
+                       'output_lang': vars(self.output_lang)}, vocab_f)
+
+        try:
+            os.rename(tmp_path, cache_path)
+            print('Preprocessed dataset stored in', cache_path)
+        except OSError:
+            # entry created by another process in the meantime.
+            shutil.rmtree(tmp_path, ignore_errors=True)
 
-        # create tensors of indexes from string pairs
-        self.tensor_pairs = self.tensors_from_pairs(
-            self.pairs, self.input_lang, self.output_lang, self.max_sequence_length)
+    def load_cache(self, cache_path):
+        """
+        Loads the preprocessed dataset: memory-maps the token arrays, creates
+        the Lang instances.
+
+        :param cache_path: Folder of the cache entry.
+
+        """
+        with open(os.path.join(cache_path, 'vocabularies.json'), 'r') as vocab_f:
+            vocabularies = json.load(vocab_f)
+        assert vocabularies['version'] == CACHE_VERSION, \
+            'Unsupported version of the cache {}'.format(cache_path)
+
+        for attribute in ['input_lang', 'output_lang']:
+            lang = Lang(vocabularies[attribute]['name'])
+            lang.__dict__.update(vocabularies[attribute])
+            # JSON keys are strings.
+            lang.index2word = {int(index): word for index, word in lang.index2word.items()}
+            setattr(self, attribute, lang)
+
+        # flat token arrays & offsets of the sentences - memory-mapped, so
+        # they are shared between processes.
+        self.inputs_tokens = np.load(os.path.join(cache_path, 'inputs_tokens.npy'), mmap_mode='r')
+        self.inputs_offsets = np.load(os.path.join(cache_path, 'inputs_offsets.npy'), mmap_mode='r')
+        self.targets_tokens = np.load(os.path.join(cache_path, 'targets_tokens.npy'), mmap_mode='r')
+        self.targets_offsets = np.load(os.path.join(cache_path, 'targets_offsets.npy'), mmap_mode='r')
+        self.num_pairs = len(self.inputs_offsets) - 1
+        print('Loaded %s sentence pairs from %s' % (self.num_pairs, cache_path))
+
+        # lengths of the sequences (including EOS token) - kept on CPU.
+        self.inputs_lengths = torch.from_numpy(np.diff(self.inputs_offsets))
+        self.targets_lengths = torch.from_numpy(np.diff(self.targets_offsets))
+
+    def padded_batch(self, tokens, offsets, indexes, lengths):
+        """
+        Creates the tensor of the sequences of a batch, padded to the length of
+        the longest one, from the flat array of tokens (only the tokens of the
+        batch are read).
+
+        :param tokens: flat array of tokens of all sequences.
+        :param offsets: offsets of the sequences.
+        :param indexes: indexes of the sequences of the batch (tensor).
+        :param lengths: lengths of the sequences of the batch (tensor).
+        :return: tensor [BATCH_SIZE x SEQUENCE_LENGTH]
+
+        """
+        lengths = lengths.numpy()
+        positions = np.arange(lengths.max())
+        mask = positions < lengths[:, None]
+        padded = np.full(mask.shape, PAD_token, dtype=np.int64)
+        padded[mask] = tokens[(offsets[indexes.numpy()][:, None] + positions)[mask]]
+        return torch.from_numpy(padded).type(self.app_state.LongTensor)
+
+    def sentence(self, lang, tokens, offsets, index):
+        """
+        Returns the (normalized) sentence of the given index, from the flat
+        array of tokens.
+
+        :param lang: Lang instance.
+        :param tokens: flat array of tokens of all sentences.
+        :param offsets: offsets of the sentences.
+        :param index: index of the sentence.
+        :return: string.
+
+        """
+        # skip EOS token
+        return ' '.join(lang.index2word[int(token)]
+                        for token in tokens[offsets[index]:offsets[index + 1] - 1])
 
     def prepare_data(self):
         """
@@ -320,42 +478,75 @@ class Translation(TextToTextProblem):
         """
         return [pair for pair in self.pairs if self.filter_pair(pair)]
 
-    def generate_batch(self):
+    def bucketed_indexes(self):
         """
-        Generates a batch  of size [BATCH_SIZE, MAX_SEQUENCE_LENGTH].
+        Returns the indexes of the pairs of a batch containing sequences of
+        similar lengths. Every epoch, the pairs are sorted by length (random
+        order of pairs of equal length) and split into consecutive batches,
+        which are returned in random order - every pair is used once per
+        epoch.
+
+        :return: tensor of indexes [BATCH_SIZE] (fewer for the last batch of the sorted pairs).
 
-        :return: DataTuple: inputs [BATCH_SIZE, MAX_SEQUENCE_LENGTH], targets [BATCH_SIZE, MAX_SEQUENCE_LENGTH],
-                TextAuxTuple: ('inputs_text', 'outputs_text', 'input_lang', 'output_lang')
+        """
+        if self.next_bucketed_batch >= len(self.bucketed_batches):
+            # sort by the longer sequence of the pair, random order of ties.
+            keys = torch.max(self.inputs_lengths, self.targets_lengths).float() + \
+                torch.rand(self.num_pairs)
+            _, sorted_indexes = keys.sort()
+            batches = torch.split(sorted_indexes, self.batch_size)
+            self.bucketed_batches = [batches[i] for i in torch.randperm(len(batches)).tolist()]
+            self.next_bucketed_batch = 0
+
+        indexes = self.bucketed_batches[self.next_bucketed_batch]
+        self.next_bucketed_batch += 1
+        return indexes
 
+    def generate_batch(self):
         """
-        # generate a sample of size batch_size of random indexes without
-        # replacement
-        indexes = random.sample(population=range(
-            len(self.tensor_pairs)), k=self.batch_size)
+        Generates a batch  of size [BATCH_SIZE, SEQUENCE_LENGTH], where SEQUENCE_LENGTH is the length of the longest
+        sequence in the batch (<= MAX_SEQUENCE_LENGTH).
+
+        If bucket_by_length is set, the batch contains pairs of sentences of similar lengths.
 
-        # create main batch inputs & outputs tensor
-        inputs = torch.zeros(self.batch_size, self.max_sequence_length).type(
-            self.app_state.LongTensor)
-        targets = torch.zeros(self.batch_size, self.max_sequence_length).type(
-            self.app_state.LongTensor)
+        :return: DataTuple: inputs [BATCH_SIZE, SEQUENCE_LENGTH], targets [BATCH_SIZE, SEQUENCE_LENGTH],
+                TextAuxTuple: ('inputs_text', 'outputs_text', 'input_lang', 'output_lang', 'inputs_lengths', \
+                'targets_lengths')
+
+        """
+        if self.bucket_by_length:
+            indexes = self.bucketed_indexes()
+        else:
+            # generate a sample of size batch_size of random indexes without
+            # replacement
+            indexes = torch.tensor(random.sample(population=range(
+                self.num_pairs), k=min(self.batch_size, self.num_pairs)))
+
+        # lengths of the sequences (on CPU)
+        inputs_lengths = self.inputs_lengths[indexes]
+        targets_lengths = self.targets_lengths[indexes]
+
+        # gather the batch from the (memory-mapped) tokens, padded to the
+        # length of its longest sequences
+        inputs = self.padded_batch(
+            self.inputs_tokens, self.inputs_offsets, indexes, inputs_lengths)
+        targets = self.padded_batch(
+            self.targets_tokens, self.targets_offsets, indexes, targets_lengths)
 
         # for TextAuxTuple
         inputs_text = []
         targets_text = []
-
-        for i, index in enumerate(indexes):
-            input_tensor, target_tensor = self.tensor_pairs[index]
-            input_text, target_text = self.pairs[index]
-
-            inputs[i] = input_tensor
-            targets[i] = target_tensor
-            inputs_text.append(input_text)
-            targets_text.append(target_text)
+        for index in indexes.tolist():
+            inputs_text.append(self.sentence(
+                self.input_lang, self.inputs_tokens, self.inputs_offsets, index))
+            targets_text.append(self.sentence(
+                self.output_lang, self.targets_tokens, self.targets_offsets, index))
 
         # Return tuples.
         data_tuple = DataTuple(inputs, targets)
         aux_tuple = TextAuxTuple(
-            inputs_text, targets_text, self.input_lang, self.output_lang)
+            inputs_text, targets_text, self.input_lang, self.output_lang,
+            inputs_lengths, targets_lengths)
 
         return data_tuple, aux_tuple
 
@@ -18,7 +18,7 @@
 __author__ = "Tomasz Kornuta, Younes Bouhadjar"
 
 import torch.nn as nn
-from problems.problem import Problem
+from problems.problem import Problem, DataTuple
 
 
 class VideoToClassProblem(Problem):
@@ -83,6 +83,24 @@ class VideoToClassProblem(Problem):
 
         return loss
 
+    def slice_window(self, data_tuple, aux_tuple, start, stop):
+        """
+        Returns a window (along the time axis) of the batch - inputs and mask
+        are sliced, the (per sequence) targets are kept.
+
+        :param data_tuple: Data tuple.
+        :param aux_tuple: Auxiliary tuple containing mask.
+        :param start: First step of the window.
+        :param stop: Step after the last step of the window.
+        :returns: Pair of Data and Auxiliary tuples containing the window.
+
+        """
+        data_window = DataTuple(data_tuple.inputs[..., start:stop, :],
+                                data_tuple.targets)
+        aux_window = aux_tuple._replace(mask=aux_tuple.mask[start:stop])
+
+        return data_window, aux_window
+
     def add_statistics(self, stat_col):
         """
         Add accuracy statistic to collector.
@@ -40,7 +40,7 @@ from models.model_factory import ModelFactory
 from utils.app_state import AppState
 from utils.statistics_collector import StatisticsCollector
 from utils.param_interface import ParamInterface
-from utils.worker_utils import forward_step, check_and_set_cuda
+from utils.worker_utils import forward_step, check_and_set_cuda, set_sync_mode
 
 logging.getLogger('matplotlib').setLevel(logging.WARNING)
 
@@ -158,6 +158,7 @@ if __name__ == '__main__':
 
     # check if CUDA is available turn it on
     check_and_set_cuda(param_interface['testing'], logger)
+    set_sync_mode(param_interface['testing'], logger)
 
     # check if the maximum number of episodes is specified, if not put a
     # default of 1
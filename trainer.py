@@ -42,7 +42,7 @@ import numpy as np
 from utils.app_state import AppState
 from utils.statistics_collector import StatisticsCollector
 from utils.param_interface import ParamInterface
-from utils.worker_utils import forward_step, check_and_set_cuda, recurrent_config_parse
+from utils.worker_utils import forward_step, forward_step_truncated_bptt, check_and_set_cuda, set_sync_mode, recurrent_config_parse
 
 # Import model and problem factories.
 from problems.problem_factory import ProblemFactory
@@ -257,6 +257,7 @@ if __name__ == '__main__':
 
     # check if CUDA is available turn it on
     check_and_set_cuda(param_interface['training'], logger)
+    set_sync_mode(param_interface['training'], logger)
 
     # Build the model.
     model = ModelFactory.build_model(param_interface['model'])
@@ -342,6 +343,25 @@ if __name__ == '__main__':
         except KeyError:
             loss_length = 10
 
+    # Streaming (truncated BPTT) training - optional.
+    if 'truncated_bptt' in param_interface['training']:
+        param_interface['training']['truncated_bptt'].add_default_params({
+            'update_every_window': False})
+        tbptt_window = param_interface['training']['truncated_bptt']['window']
+        tbptt_update_every_window = param_interface['training'][
+            'truncated_bptt']['update_every_window']
+        logger.info(
+            "Using truncated BPTT with windows of {} steps".format(tbptt_window))
+    else:
+        tbptt_window = None
+        tbptt_update_every_window = False
+
+    # Gradient clipping value (DEFAULT: None, i.e. no clipping).
+    try:
+        gradient_clipping = param_interface['training']['gradient_clipping']
+    except KeyError:
+        gradient_clipping = None
+
     # Set optimizer.
     optimizer_conf = dict(param_interface['training']['optimizer'])
     optimizer_name = optimizer_conf['name']
@@ -400,8 +420,15 @@ if __name__ == '__main__':
         # Turn on training mode.
         model.train()
         # 1. Perform forward step, calculate logits and loss.
-        logits, loss = forward_step(
-            model, problem, episode, stat_col, data_tuple, aux_tuple)
+        if tbptt_window is None:
+            logits, loss = forward_step(
+                model, problem, episode, stat_col, data_tuple, aux_tuple)
+        else:
+            # Streaming: forward and backward are done window by window.
+            logits, loss = forward_step_truncated_bptt(
+                model, problem, episode, stat_col, data_tuple, aux_tuple,
+                optimizer, tbptt_window, tbptt_update_every_window,
+                gradient_clipping)
 
         if not use_validation_problem:
             # Store the calculated loss on a list.
@@ -411,19 +438,18 @@ if __name__ == '__main__':
                 last_losses.popleft()
 
         # 2. Backward gradient flow.
-        loss.backward()
-        # Check the presence of parameter 'gradient_clipping'.
-        try:
+        if tbptt_window is None:
+            loss.backward()
+
+        # Optimizer was already stepped after every window.
+        if not tbptt_update_every_window:
             # if present - clip gradients to a range (-gradient_clipping,
             # gradient_clipping)
-            val = param_interface['training']['gradient_clipping']
-            nn.utils.clip_grad_value_(model.parameters(), val)
-        except KeyError:
-            # Else - do nothing.
-            pass
+            if gradient_clipping is not None:
+                nn.utils.clip_grad_value_(model.parameters(), gradient_clipping)
 
-        # 3. Perform optimization.
-        optimizer.step()
+            # 3. Perform optimization.
+            optimizer.step()
 
         # 4. Log statistics.
         # Log to logger.
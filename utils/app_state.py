@@ -22,6 +22,10 @@ import torch
 class AppState(metaclass=SingletonMetaClass):
     def __init__(self):
         self.visualize = False
+        # Avoid host synchronizations (tensor-to-Python conversions) in models.
+        self.sync_free = False
+        # Detection of host synchronizations in model.forward: None, 'count' or 'raise'.
+        self.detect_sync = None
         self.convert_non_cuda_types()
         self.set_dtype('float')
         self.set_itype('int')
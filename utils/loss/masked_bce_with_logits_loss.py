@@ -57,11 +57,11 @@ class MaskedBCEWithLogitsLoss(nn.Module):
         # Set the loss per element to zero for unneeded output
         masked_loss_per = mask_float * loss_per_element
 
-        # obtain the number of non-zero elements in the mask.
-        # nonzero() returns the indices so you have to divide by the number of dimensions
+        # obtain the number of non-zero elements in the mask (as a tensor, so
+        # there is no host synchronization).
         # The mask lacks the last dimension of the targets so needs to be
         # scaled up
-        size = mask.nonzero().numel() / len(mask.shape) * logits.shape[-1]
+        size = mask.type(AppState().dtype).sum() * logits.shape[-1]
 
         loss = torch.sum(masked_loss_per) / size
 
@@ -85,10 +85,12 @@ class MaskedBCEWithLogitsLoss(nn.Module):
 
         # The mask lacks the last dimension of the targets so needs to be
         # scaled up
-        size = mask.nonzero().numel() / len(mask.shape) * logits.shape[-1]
+        size = mask.type(AppState().dtype).sum() * logits.shape[-1]
 
         masked_acc_per = mask_float * acc_per
 
-        accuracy = masked_acc_per.sum().item() / size
+        # Accuracy is returned as a (0-dim) tensor - it is converted only when
+        # the statistics are exported.
+        accuracy = masked_acc_per.sum() / size
 
         return accuracy
@@ -59,10 +59,9 @@ class MaskedCrossEntropyLoss(nn.Module):
         # Set the loss per element to zero for unneeded output
         masked_loss_per = mask_float * loss_per_element
 
-        # obtain the number of non-zero elements in the mask.
-        # nonzero() returns the indices so you have to divide by the number of
-        # dimensions
-        size = mask.nonzero().numel() / len(mask.shape)
+        # obtain the number of non-zero elements in the mask (as a tensor, so
+        # there is no host synchronization).
+        size = mask.type(AppState().dtype).sum()
 
         # add up the loss scaling by only the needed outputs
         loss = torch.sum(masked_loss_per) / size
@@ -91,9 +90,11 @@ class MaskedCrossEntropyLoss(nn.Module):
 
         # scale by only the number of needed outputs
         # the mask has the same number of elements as the target in this case
-        size = mask.nonzero().numel() / len(mask.shape)
+        size = mask.type(AppState().dtype).sum()
 
-        accuracy = masked_correct_per.sum().item() / size
+        # Accuracy is returned as a (0-dim) tensor - it is converted only when
+        # the statistics are exported.
+        accuracy = masked_correct_per.type(AppState().dtype).sum() / size
 
         return accuracy
 
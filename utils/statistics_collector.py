@@ -19,6 +19,7 @@
 __author__ = "Tomasz Kornuta"
 
 from collections import Mapping
+import torch
 
 
 class StatisticsCollector(Mapping):
@@ -172,6 +173,113 @@ class StatisticsCollector(Mapping):
 # training_writer.add_scalar('Loss', loss, episode)
 
 
+class AccuracyPerCategoryCollector(object):
+    """
+    Extension of the StatisticsCollector accumulating the accuracy per
+    category of samples (e.g. per question family) over several episodes.
+
+    The numbers of correct predictions & of samples per category are
+    accumulated with bincount() on the tensors of category ids, on the device
+    they are stored on - they are brought to the host only when exported.
+
+    """
+
+    def __init__(self, categories, groups=None):
+        """
+        Initialization - creates the (empty) counters.
+
+        :param categories: List of names of the categories (indexed by the category ids).
+        :param groups: Optional dict {category: group} - the accuracy is also exported per group of categories.
+
+        """
+        self.categories = list(categories)
+        self.groups = []
+        self.group_ids = None
+        if groups is not None:
+            self.groups = sorted(set(groups[category] for category in self.categories))
+            self.group_ids = torch.tensor(
+                [self.groups.index(groups[category]) for category in self.categories])
+        self.reset()
+
+    def reset(self):
+        """
+        Resets the counters.
+        """
+        self.correct = torch.zeros(len(self.categories), dtype=torch.float64)
+        self.total = torch.zeros(len(self.categories), dtype=torch.float64)
+
+    def add(self, category_ids, correct):
+        """
+        Accumulates the predictions of a batch.
+
+        :param category_ids: Tensor of category ids of the samples [BATCH_SIZE].
+        :param correct: Tensor of (0/1) correct predictions [BATCH_SIZE].
+
+        """
+        category_ids = category_ids.to(correct.device).view(-1)
+        if self.total.device != correct.device:
+            self.correct = self.correct.to(correct.device)
+            self.total = self.total.to(correct.device)
+
+        minlength = len(self.categories)
+        self.correct += torch.bincount(
+            category_ids, weights=correct.view(-1).double(), minlength=minlength)
+        self.total += torch.bincount(category_ids, minlength=minlength).double()
+
+    def accuracies(self):
+        """
+        Returns the accumulated accuracies.
+
+        :return: Pair of lists of (name, accuracy, number of samples) per category & per group of categories
+            (accuracy is None for categories without samples).
+
+        """
+        correct = self.correct.cpu()
+        total = self.total.cpu()
+        results = [list(zip(self.categories, correct.tolist(), total.tolist()))]
+        if self.group_ids is not None:
+            group_correct = torch.zeros(len(self.groups), dtype=torch.float64).index_add_(
+                0, self.group_ids, correct)
+            group_total = torch.zeros(len(self.groups), dtype=torch.float64).index_add_(
+                0, self.group_ids, total)
+            results.append(list(zip(self.groups, group_correct.tolist(), group_total.tolist())))
+        else:
+            results.append([])
+
+        return [[(name, c / t if t > 0 else None, int(t)) for name, c, t in result]
+                for result in results]
+
+    def export_to_csv(self, filename, episode):
+        """
+        Appends the accumulated accuracies (one row per category & per group of
+        categories) to a csv file.
+
+        :param filename: Name of the csv file.
+        :param episode: Episode number.
+
+        """
+        categories, groups = self.accuracies()
+        with open(filename, 'a') as csv_file:
+            for name, accuracy, total in categories + groups:
+                csv_file.write('{:06d},{},{},{}\n'.format(
+                    episode, name, '' if accuracy is None else accuracy, total))
+
+    def export_to_string(self, additional_tag=''):
+        """
+        Returns the accumulated accuracies in the form of string.
+
+        :return: String being concatenation of categories names, accuracies & numbers of samples.
+
+        """
+        stat_str = ''
+        for name, accuracy, total in sum(self.accuracies(), []):
+            if accuracy is None:
+                stat_str += '{} -; '.format(name)
+            else:
+                stat_str += '{} {:2.4f} ({:d}); '.format(name, accuracy, total)
+        return stat_str[:-2] + " " + additional_tag
+
+
 if __name__ == "__main__":
 
     stat_col = StatisticsCollector()
@@ -192,3 +300,10 @@ if __name__ == "__main__":
 
     stat_col.export_statistics_to_csv(csv_file)
     print(stat_col.export_statistics_to_string('[Validation]'))
+
+    # Accuracy per category.
+    acc_col = AccuracyPerCategoryCollector(
+        ['a', 'b', 'c'], groups={'a': 'ab', 'b': 'ab', 'c': 'c'})
+    acc_col.add(torch.tensor([0, 0, 1, 2]), torch.tensor([1, 0, 1, 1]))
+    acc_col.add(torch.tensor([1]), torch.tensor([0]))
+    print(acc_col.export_to_string('[Validation]'))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) IBM Corporation 2018
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""sync_detector.py: contains a debug tool detecting tensor-to-Python conversions (host synchronizations)"""
+
+import logging
+import traceback
+
+import torch
+
+logger = logging.getLogger('SyncDetector')
+
+# Tensor methods converting (data of) a tensor into Python objects.
+_SYNC_METHODS = ['item', 'tolist', 'numpy', '__bool__',
+                 '__float__', '__int__', '__index__']
+
+
+class HostSyncError(RuntimeError):
+    """
+    Raised by SyncDetector (in 'raise' mode) when a tensor is converted into
+    a Python object.
+    """
+    pass
+
+
+class SyncDetector(object):
+    """
+    Context manager detecting tensor-to-Python conversions (``item()``,
+    ``tolist()``, ``bool(tensor)`` etc.), each of them forcing the host to
+    wait for the device.
+
+    Modes:
+
+        - 'count': conversions are counted (and logged when leaving the context),
+        - 'raise': the first conversion raises HostSyncError.
+
+    Usage:
+
+    >>> with SyncDetector('count') as detector:
+    >>>     logits = model(data_tuple)
+    >>> detector.count
+
+    """
+
+    def __init__(self, mode='count'):
+        """
+        Initializes the detector.
+
+        :param mode: 'count' or 'raise' (DEFAULT: 'count').
+
+        """
+        assert mode in ['count', 'raise'], "Unknown mode {}".format(mode)
+        self.mode = mode
+        self.count = 0
+        # Places (last frame of the stack) where conversions happened.
+        self.locations = {}
+        self._originals = {}
+
+    def _wrap(self, name, method):
+        detector = self
+
+        def wrapper(tensor, *args, **kwargs):
+            detector._report(name)
+            return method(tensor, *args, **kwargs)
+        return wrapper
+
+    def _report(self, name):
+        frame = traceback.extract_stack(limit=3)[0]
+        location = '{}:{} ({})'.format(frame.filename, frame.lineno, name)
+        if self.mode == 'raise':
+            raise HostSyncError(
+                "Tensor-to-Python conversion at {}".format(location))
+        self.count += 1
+        self.locations[location] = self.locations.get(location, 0) + 1
+
+    def __enter__(self):
+        for name in _SYNC_METHODS:
+            method = getattr(torch.Tensor, name, None)
+            if method is None:
+                continue
+            # Remember whether the method was defined in Tensor itself.
+            self._originals[name] = torch.Tensor.__dict__.get(name, None)
+            setattr(torch.Tensor, name, self._wrap(name, method))
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        for name, original in self._originals.items():
+            if original is None:
+                delattr(torch.Tensor, name)
+            else:
+                setattr(torch.Tensor, name, original)
+        self._originals = {}
+
+        if self.mode == 'count' and self.count > 0:
+            logger.warning("{} tensor-to-Python conversions detected:\n  {}".format(
+                self.count, '\n  '.join('{}: {}'.format(location, count)
+                                        for location, count in self.locations.items())))
+        return False
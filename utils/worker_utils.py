@@ -27,6 +27,24 @@ from torch.nn.modules.module import _addindent
 from .app_state import AppState
 
 
+def model_forward(forward, *args):
+    """
+    Calls the model (forward), detecting host synchronizations inside it if
+    required (see AppState().detect_sync).
+
+    :param forward: Model or its forward-like method.
+    :param args: Arguments of the call.
+    :returns: Result of the call.
+
+    """
+    if AppState().detect_sync is None:
+        return forward(*args)
+
+    from .sync_detector import SyncDetector
+    with SyncDetector(AppState().detect_sync):
+        return forward(*args)
+
+
 def forward_step(model, problem, episode, stat_col, data_tuple, aux_tuple):
     """
     Function performs a single forward step.
@@ -39,7 +57,7 @@ def forward_step(model, problem, episode, stat_col, data_tuple, aux_tuple):
         data_tuple, aux_tuple = problem.turn_on_cuda(data_tuple, aux_tuple)
 
     # Perform forward calculation.
-    logits = model(data_tuple)
+    logits = model_forward(model, data_tuple)
 
     # Evaluate loss function.
     loss = problem.evaluate_loss(data_tuple, logits, aux_tuple)
@@ -56,6 +74,90 @@ def forward_step(model, problem, episode, stat_col, data_tuple, aux_tuple):
     return logits, loss
 
 
+def forward_step_truncated_bptt(model, problem, episode, stat_col, data_tuple,
+                                aux_tuple, optimizer, window,
+                                update_every_window=False, gradient_clipping=None):
+    """
+    Function performs a single streaming (truncated BPTT) training step.
+
+    The sequences are processed in windows of ``window`` steps. The cell state
+    is carried (detached) from one window to the next, the loss of every window
+    is backpropagated right away, so only one window of activations is kept
+    alive at a time. Windows without any defined (masked) output are skipped
+    by the loss. Window losses are weighted by their share of the mask, so
+    the accumulated gradient matches the one of the whole-sequence loss
+    (up to the truncation).
+
+    :param optimizer: Optimizer, used only when ``update_every_window`` is set.
+    :param window: Number of steps in a window.
+    :param update_every_window: Clip gradients and perform optimizer step after every window (DEFAULT: False, i.e. gradients are accumulated and the caller performs the update).
+    :param gradient_clipping: Gradient clipping value used with ``update_every_window`` (DEFAULT: None).
+    :returns: logits (detached) and loss (already backpropagated)
+
+    """
+    from models.sequential_model import detach_state
+
+    # convert to CUDA
+    if AppState().use_CUDA:
+        data_tuple, aux_tuple = problem.turn_on_cuda(data_tuple, aux_tuple)
+
+    seq_length = data_tuple.inputs.size(-2)
+    # Mask defining where the loss is computed (if the problem uses one).
+    mask = None
+    if getattr(problem, 'use_mask', True) and hasattr(aux_tuple, 'mask'):
+        mask = aux_tuple.mask
+
+    # Initial state is built on the basis of the whole sequence.
+    cell_state = model.init_cell_state(data_tuple.inputs)
+
+    logits = []
+    # Zero tensor (and not int) even if every window is skipped.
+    loss = torch.zeros(()).type(AppState().dtype)
+    for start in range(0, seq_length, window):
+        stop = min(start + window, seq_length)
+        data_window, aux_window = problem.slice_window(
+            data_tuple, aux_tuple, start, stop)
+
+        logits_window, cell_state = model_forward(
+            model.forward_window, data_window.inputs, cell_state)
+        # Do not backpropagate to the previous windows.
+        cell_state = detach_state(cell_state)
+        logits.append(logits_window.detach())
+
+        # Share of the loss belonging to this window.
+        if mask is not None:
+            weight = float(aux_window.mask.sum()) / float(mask.sum())
+        else:
+            weight = (stop - start) / seq_length
+        if weight == 0:
+            continue
+
+        loss_window = weight * problem.evaluate_loss(
+            data_window, logits_window, aux_window)
+        loss_window.backward()
+        loss = loss + loss_window.detach()
+
+        if update_every_window:
+            if gradient_clipping is not None:
+                torch.nn.utils.clip_grad_value_(
+                    model.parameters(), gradient_clipping)
+            optimizer.step()
+            optimizer.zero_grad()
+
+    logits = torch.cat(logits, dim=-2)
+
+    # Collect "elementary" statistics - episode and loss.
+    stat_col['episode'] = episode
+    stat_col['loss'] = loss
+
+    # Collect other (potential) statistics from problem & model.
+    problem.collect_statistics(stat_col, data_tuple, logits, aux_tuple)
+    model.collect_statistics(stat_col, data_tuple, logits)
+
+    # Return tuple: logits, loss.
+    return logits, loss
+
+
 def check_and_set_cuda(params, logger):
     """
     Enables Cuda if available and sets the default data types.
@@ -83,6 +185,26 @@ def check_and_set_cuda(params, logger):
     AppState().set_itype('int')
 
 
+def set_sync_mode(params, logger):
+    """
+    Sets the host-synchronization-free execution mode and detection of host
+    synchronizations inside the model.
+
+    :param params: paramater interface object containing either training or testing parameters
+    :param logger: logger object
+
+    """
+    if 'sync_free' in params and params['sync_free']:
+        AppState().sync_free = True
+        logger.info('Running in host-synchronization-free mode')
+
+    if 'detect_sync' in params and params['detect_sync']:
+        # 'count' or 'raise'.
+        AppState().detect_sync = params['detect_sync']
+        logger.info('Detecting host synchronizations in model ({})'.format(
+            params['detect_sync']))
+
+
 def recurrent_config_parse(configs, configs_parsed):
     """
     Function parses names of configuration files in a recursive mannner, i.e.